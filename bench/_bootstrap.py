@@ -0,0 +1,33 @@
+"""Import duhur.py untuk benchmark: config dummy + DB & bot.log di folder temp"""
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG_KEYS = (
+    "TOKEN", "OWNER_ID", "WEATHER_API_KEY", "YOU_API_KEY", "DB_NAME",
+    "SPOTIPY_CLIENT_ID", "SPOTIPY_CLIENT_SECRET", "MY_PROXY", "QRIS_IMAGE",
+    "BASE_URL", "BMKG_URL", "ANIME_API", "BIN_API", "TEMPMAIL_API_KEY",
+    "OMYGPT_API_KEY", "OMDB_API_KEY", "FIREBASE_API_KEY",
+)
+
+
+def load_duhur(db_name="bench.db"):
+    """Import duhur dengan DB_NAME di folder temp (config.py asli tidak disentuh)"""
+    workdir = tempfile.mkdtemp(prefix="duhur_bench_")
+    config = types.ModuleType("config")
+    for key in CONFIG_KEYS:
+        setattr(config, key, "x")
+    config.TOKEN = "0:bench"
+    config.OWNER_ID = 0
+    config.MY_PROXY = None
+    config.DB_NAME = os.path.join(workdir, db_name)
+    sys.modules["config"] = config
+
+    # bot.log ditulis ke cwd saat import
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import duhur
+    return duhur
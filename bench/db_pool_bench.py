@@ -0,0 +1,64 @@
+"""Microbenchmark DBPool: koneksi long-lived vs aiosqlite.connect per query
+
+    python bench/db_pool_bench.py [N]
+"""
+import asyncio
+import sys
+import time
+
+from _bootstrap import load_duhur
+
+duhur = load_duhur()
+
+
+async def timed(label, n, make_op, concurrency=1):
+    """Jalankan n operasi (batch sebesar concurrency), cetak ops/sec"""
+    start = time.perf_counter()
+    for i in range(0, n, concurrency):
+        await asyncio.gather(*(make_op(i + j) for j in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {n / elapsed:>10.0f} ops/sec")
+    return n / elapsed
+
+
+async def run_suite(n):
+    results = {}
+    results["write"] = await timed(
+        "write (db_execute)", n,
+        lambda i: duhur.db_execute(
+            "INSERT OR REPLACE INTO bench_kv (k, v) VALUES (?, ?)", (i, f"value-{i}")
+        ),
+    )
+    results["read"] = await timed(
+        "read (db_fetch_one)", n,
+        lambda i: duhur.db_fetch_one("SELECT v FROM bench_kv WHERE k=?", (i,)),
+    )
+    results["read x8"] = await timed(
+        "read, 8 concurrent", n,
+        lambda i: duhur.db_fetch_one("SELECT v FROM bench_kv WHERE k=?", (i,)),
+        concurrency=8,
+    )
+    return results
+
+
+async def main(n):
+    await duhur.init_db()
+    await duhur.db_execute("CREATE TABLE IF NOT EXISTS bench_kv (k INTEGER PRIMARY KEY, v TEXT)")
+
+    print(f"Per-call connect (pool belum start), N={n}")
+    before = await run_suite(n)
+
+    await duhur.db_pool.start()
+    try:
+        print(f"DBPool (1 writer + {duhur.db_pool.size} readers), N={n}")
+        after = await run_suite(n)
+    finally:
+        await duhur.db_pool.close()
+
+    print("Speedup")
+    for key in before:
+        print(f"  {key:<28} {after[key] / before[key]:>9.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000))
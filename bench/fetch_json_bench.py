@@ -0,0 +1,71 @@
+"""Benchmark fetch_json: client httpx bersama vs client baru per call
+
+    python bench/fetch_json_bench.py [N]
+
+Upstream = http.server lokal di thread (keep-alive HTTP/1.1), jadi yang
+terukur murni overhead client: bikin AsyncClient + connect TCP per call
+vs pakai ulang koneksi dari pool.
+"""
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from _bootstrap import load_duhur
+
+duhur = load_duhur()
+logging.getLogger("httpx").setLevel(logging.WARNING)  # 1 baris log per request ikut terukur
+
+BODY = json.dumps({"ok": True, "data": list(range(50))}).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # tanpa ini keep-alive kena delayed-ACK ~40ms
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+async def run(label, url, n, fresh_client):
+    start = time.perf_counter()
+    for _ in range(n):
+        data = await duhur.fetch_json(url, cache=False)
+        assert data and data["ok"]
+        if fresh_client:
+            # Perilaku lama: tiap call bikin & tutup AsyncClient sendiri
+            await duhur.http_clients.close()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<26} {elapsed * 1000:>8.1f} ms total   {elapsed / n * 1000:>6.2f} ms/call")
+    return elapsed
+
+
+async def main(n):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/stub"
+    try:
+        await duhur.fetch_json(url, cache=False)  # warm-up (import/SSL context dll.)
+        await duhur.http_clients.close()
+        print(f"{n} sequential fetch_json calls")
+        per_call = await run("client per call", url, n, fresh_client=True)
+        duhur.http_clients.start()
+        shared = await run("shared client", url, n, fresh_client=False)
+        await duhur.http_clients.close()
+        print(f"Speedup: {per_call / shared:.1f}x")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,104 @@
+"""Seed user_actions (default 1M baris) lalu ukur latency statistik per user
+
+    python bench/user_stats_bench.py [ROWS] [USERS]
+
+Tahap yang diukur:
+  1. query lama (COUNT(*) + MAX(timestamp) WHERE user_id=?) tanpa index
+  2. query yang sama setelah idx_user_actions_user_ts (migrasi v2)
+  3. get_user_stats() dari tabel ringkasan user_stats (migrasi v3)
+"""
+import asyncio
+import datetime
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+from _bootstrap import load_duhur
+
+duhur = load_duhur()
+
+LEGACY_QUERY = "SELECT COUNT(*), MAX(timestamp) FROM user_actions WHERE user_id=?"
+INDEX_SQL = next(
+    step
+    for _version, _name, steps in duhur.SCHEMA_MIGRATIONS
+    for step in steps
+    if isinstance(step, str) and "idx_user_actions_user_ts" in step
+)
+ACTIONS = ("start", "download", "tiktok", "spotify", "weather", "note", "ai", "qr")
+SAMPLES = 200
+
+
+def seed(rows, users):
+    """Isi user_actions pakai sqlite3 biasa (jauh lebih cepat dari lewat bot)"""
+    rng = random.Random(42)
+    now = datetime.datetime.now()
+    start = time.perf_counter()
+    con = sqlite3.connect(duhur.DB_NAME)
+    con.execute("DROP INDEX IF EXISTS idx_user_actions_user_ts")
+    chunk = 50000
+    for offset in range(0, rows, chunk):
+        batch = [
+            (
+                rng.randint(1, users),
+                rng.choice(ACTIONS),
+                "",
+                (now - datetime.timedelta(seconds=rng.randint(0, 30 * 86400))).isoformat(),
+            )
+            for _ in range(min(chunk, rows - offset))
+        ]
+        con.executemany(
+            "INSERT INTO user_actions (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)",
+            batch,
+        )
+        con.commit()
+    con.close()
+    print(f"Seeded {rows} rows / {users} users in {time.perf_counter() - start:.1f}s")
+
+
+async def measure(label, fetch, user_ids):
+    latencies = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        await fetch(user_id)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"  {label:<36} p50 {p50:>8.3f} ms   p95 {p95:>8.3f} ms")
+    return p50
+
+
+async def main(rows, users):
+    await duhur.init_db()
+    seed(rows, users)
+    user_ids = random.Random(7).sample(range(1, users + 1), min(SAMPLES, users))
+
+    await duhur.db_pool.start()
+    try:
+        print(f"Per-user stats latency ({len(user_ids)} users)")
+        before = await measure(
+            "COUNT(*) scan, no index", lambda u: duhur.db_fetch_one(LEGACY_QUERY, (u,)), user_ids
+        )
+
+        start = time.perf_counter()
+        await duhur.db_execute(INDEX_SQL)
+        print(f"  (CREATE INDEX took {time.perf_counter() - start:.1f}s)")
+        indexed = await measure(
+            "COUNT(*) + idx_user_actions_user_ts", lambda u: duhur.db_fetch_one(LEGACY_QUERY, (u,)), user_ids
+        )
+
+        async with duhur.db_pool.write() as db:
+            await duhur.backfill_user_stats(db)
+        summary = await measure("get_user_stats (user_stats)", duhur.get_user_stats, user_ids)
+    finally:
+        await duhur.db_pool.close()
+
+    print(f"Speedup vs no index: index {before / indexed:.0f}x, summary table {before / summary:.0f}x")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    asyncio.run(main(rows, users))
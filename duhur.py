@@ -4,11 +4,11 @@ import asyncio
 import io
 import os
 import sys
-import subprocess  # Penting buat FFmpeg
+import signal
 import platform
 import shutil
 import psutil
-from collections import defaultdict  # ← DIUBAH dari: import speedtest
+from collections import defaultdict, OrderedDict, deque  # ← DIUBAH dari: import speedtest
 import time
 import datetime
 import pytz
@@ -27,7 +27,14 @@ import base64
 import hashlib
 import tempfile
 import zipfile
+import gzip
+import contextlib
+import threading
+import traceback
+import bisect
+import copy
 from urllib.parse import unquote
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 import urllib.parse
 from concurrent.futures import ThreadPoolExecutor  # ← DITAMBAH
 
@@ -59,8 +66,13 @@ except ImportError:
     print("❌ ERROR FATAL: File 'config.py' tidak ditemukan!")
     sys.exit()
 
+import config as _config
+
+def cfg(name, default):
+    """Setting opsional dari config.py (kalau tidak ada, pakai default)"""
+    return getattr(_config, name, default)
+
 # --- 2. LIBRARY TAMBAHAN (HTTP, DB, MEDIA, UTILS) ---
-import requests
 import httpx
 import yt_dlp
 import qrcode
@@ -68,6 +80,10 @@ import aiosqlite
 import sqlite3 # Tambahan buat Selenium DB (sync)
 import spotipy
 from spotipy.oauth2 import SpotifyClientCredentials
+try:
+    from spotipy.cache_handler import MemoryCacheHandler
+except ImportError:  # spotipy lama
+    MemoryCacheHandler = None
 from faker import Faker
 from gtts import gTTS
 from deep_translator import GoogleTranslator
@@ -95,6 +111,8 @@ from telegram import (
     KeyboardButton,
     ReplyKeyboardMarkup,
     InputMediaPhoto,
+    InputMediaVideo,
+    InputMediaAudio,
 )
 from telegram.constants import ParseMode, ChatAction
 from telegram.ext import (
@@ -127,12 +145,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Setup Spotify
+# Setup Spotify (token disimpan di memori & dipakai ulang sampai expired, bukan baca file .cache tiap call)
 try:
-    sp_client = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
-        client_id=SPOTIPY_CLIENT_ID,
-        client_secret=SPOTIPY_CLIENT_SECRET
-    ))
+    _sp_auth_kwargs = {"cache_handler": MemoryCacheHandler()} if MemoryCacheHandler else {}
+    sp_client = spotipy.Spotify(
+        auth_manager=SpotifyClientCredentials(
+            client_id=SPOTIPY_CLIENT_ID,
+            client_secret=SPOTIPY_CLIENT_SECRET,
+            **_sp_auth_kwargs
+        ),
+        requests_timeout=10,
+    )
     print("✅ Spotify API: Connected")
 except Exception as e:
     print(f"⚠️ Spotify Error: {e}")
@@ -142,31 +165,1242 @@ except Exception as e:
 # ⚙️ GLOBAL CONFIGURATION (EXECUTOR & UTILITIES)
 # ==========================================
 
-# Global executor untuk blocking operations
-executor = ThreadPoolExecutor(max_workers=5)
+# ==========================================
+# 🧵 EXECUTOR REGISTRY (IO / CPU / SUBPROCESS)
+# ==========================================
+
+class ExecutorBusyError(RuntimeError):
+    """Antrean executor penuh, request ditolak biar tidak numpuk tanpa batas"""
+
+class BoundedExecutor:
+    """Thread pool bernama: batas kerja paralel + antrean terbatas + metrik (antre, jalan, waktu tunggu)"""
+
+    def __init__(self, name, max_workers, max_queue=None):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._sem = asyncio.Semaphore(max_workers)
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.peak_queued = 0
+        self.wait_total = 0.0
+        self.run_total = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        if self.max_queue is not None and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ExecutorBusyError(f"{self.name} executor penuh ({self.queued} antre)")
+
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        t0 = time.monotonic()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.queued -= 1
+        t1 = time.monotonic()
+        self.wait_total += t1 - t0
+        self.running += 1
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.pool.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._finish(t1, failed=True)
+            raise
+        # Slot dilepas saat thread benar-benar selesai, bukan saat pemanggil di-cancel
+        future.add_done_callback(lambda f: self._on_done(loop, t1, f))
+        return await asyncio.wrap_future(future)
+
+    def _on_done(self, loop, started, future):
+        """Dipanggil dari thread worker: pindahkan pencatatan ke event loop"""
+        failed = future.cancelled() or future.exception() is not None
+        try:
+            loop.call_soon_threadsafe(self._finish, started, failed)
+        except RuntimeError:
+            pass  # loop sudah ditutup (shutdown)
+
+    def _finish(self, started, failed):
+        self.running -= 1
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self.run_total += time.monotonic() - started
+        self._sem.release()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        done = (self.completed + self.failed) or 1
+        return {
+            "name": self.name,
+            "workers": self.max_workers,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait": self.wait_total / done,
+            "avg_run": self.run_total / done,
+        }
+
+EXECUTORS = {
+    # Library sync yang nunggu network/disk: Spotify, translator, RSS, TempMail, gTTS, yt-dlp probe
+    "io": BoundedExecutor("io", cfg("EXECUTOR_IO_WORKERS", 16), max_queue=500),
+    # Kerja CPU murni (kompres, gambar) — dibatasi jumlah core
+    "cpu": BoundedExecutor("cpu", cfg("EXECUTOR_CPU_WORKERS", max(2, os.cpu_count() or 2)), max_queue=200),
+    # Download yt-dlp (+ postprocess ffmpeg internal); tool CLI langsung lewat process_runner
+    "subprocess": BoundedExecutor("subprocess", cfg("EXECUTOR_SUBPROCESS_WORKERS", 4), max_queue=100),
+}
+
+# Global executor untuk blocking operations (alias pool io)
+executor = EXECUTORS["io"].pool
+
+async def run_blocking(kind, fn, *args, **kwargs):
+    """await run_blocking("io", sp_client.track, track_id) — jalankan fungsi sync di executor bernama"""
+    return await EXECUTORS[kind].run(fn, *args, **kwargs)
+
+def shutdown_executors():
+    for ex in EXECUTORS.values():
+        ex.shutdown()
+
+# ==========================================
+# ⚙️ PROCESS RUNNER (ASYNC SUBPROCESS + LIMITS)
+# ==========================================
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+PROCESS_GLOBAL_LIMIT = cfg("PROCESS_GLOBAL_LIMIT", 4)
+# per tool: slot paralel, timeout (detik), nice, batas CPU (detik) & memori (MB)
+PROCESS_TOOLS = {
+    "ffmpeg":     {"limit": 2, "timeout": 300, "nice": 10, "cpu_seconds": 600, "memory_mb": 2048},
+    "gallery-dl": {"limit": 2, "timeout": 180, "nice": 5,  "cpu_seconds": 300, "memory_mb": 1024},
+    "gs":         {"limit": 2, "timeout": 180, "nice": 10, "cpu_seconds": 300, "memory_mb": 1024},
+    "speedtest":  {"limit": 1, "timeout": 190, "nice": 0,  "cpu_seconds": None, "memory_mb": None},
+}
+PROCESS_DEFAULT = {"limit": 2, "timeout": 300, "nice": 10, "cpu_seconds": None, "memory_mb": None}
+PROCESS_STDERR_LINES = 40
+PROCESS_STDERR_CHUNK = 8192   # stderr dibaca per chunk (progress ffmpeg pakai \r, bisa > limit readline)
+
+class ProcessTimeoutError(Exception):
+    """Proses melewati batas waktu dan sudah di-kill (1 process group)"""
+
+class ProcessResult:
+    def __init__(self, returncode, stdout, stderr_tail, elapsed):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr_tail = stderr_tail
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+class ProcessRunner:
+    """
+    Semua tool CLI lewat sini: batas global + per tool, timeout wall-clock yang kill
+    seluruh process tree, rlimit CPU/memori + nice opsional, stderr di-stream ke buffer.
+    """
+
+    def __init__(self, global_limit, tools):
+        self.global_limit = global_limit
+        self.tools = tools
+        self._global = asyncio.Semaphore(global_limit)
+        self._tool_sems = {}
+        self.running = defaultdict(int)
+        self.completed = defaultdict(int)
+        self.failed = defaultdict(int)
+        self.timeouts = defaultdict(int)
+        self.last_error = {}
+
+    def _tool(self, cmd):
+        return os.path.basename(cmd[0])
+
+    def _sem(self, tool):
+        if tool not in self._tool_sems:
+            self._tool_sems[tool] = asyncio.Semaphore(self.tools.get(tool, PROCESS_DEFAULT)["limit"])
+        return self._tool_sems[tool]
+
+    @staticmethod
+    def _wrap(cmd, nice, cpu_seconds, memory_mb):
+        """
+        nice/rlimit lewat wrapper `nice -n` + `prlimit` (keduanya exec ke tool, pid sama).
+        Bukan preexec_fn: tidak aman di proses yang punya thread (executor).
+        Return (cmd, sisa limit yang belum terpasang → dipasang setelah spawn).
+        """
+        pending = {"nice": nice, "cpu_seconds": cpu_seconds, "memory_mb": memory_mb}
+        if os.name != "posix":
+            return cmd, {}
+        limits = []
+        if cpu_seconds:
+            limits.append(f"--cpu={cpu_seconds}:{cpu_seconds + 5}")
+        if memory_mb:
+            limits.append(f"--as={memory_mb * 1024 * 1024}:{memory_mb * 1024 * 1024}")
+        if limits and shutil.which("prlimit"):
+            cmd = ["prlimit", *limits, "--", *cmd]
+            pending["cpu_seconds"] = pending["memory_mb"] = None
+        if nice and shutil.which("nice"):
+            cmd = ["nice", "-n", str(nice), *cmd]
+            pending["nice"] = None
+        return cmd, pending
+
+    @staticmethod
+    def _limit_after_spawn(pid, nice=None, cpu_seconds=None, memory_mb=None):
+        """Fallback kalau wrapper tidak ada: pasang limit ke pid yang sudah jalan"""
+        try:
+            if nice:
+                os.setpriority(os.PRIO_PROCESS, pid, nice)
+            if resource is not None and hasattr(resource, "prlimit"):
+                if cpu_seconds:
+                    resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5))
+                if memory_mb:
+                    limit = memory_mb * 1024 * 1024
+                    resource.prlimit(pid, resource.RLIMIT_AS, (limit, limit))
+        except (OSError, ValueError) as e:
+            logger.warning(f"[PROC] Gagal pasang limit pid {pid}: {e}")
+
+    @staticmethod
+    async def _kill_tree(proc):
+        """SIGTERM ke process group, tunggu sebentar, lalu SIGKILL"""
+        if proc.returncode is not None:
+            return
+        for sig, grace in ((signal.SIGTERM, 3.0), (signal.SIGKILL, 2.0)):
+            try:
+                if os.name == "posix":
+                    os.killpg(proc.pid, sig)
+                else:
+                    proc.kill()
+            except ProcessLookupError:
+                return
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=grace)
+                return
+            except asyncio.TimeoutError:
+                continue
+
+    async def run(self, cmd, timeout=None, capture_stdout=False, cwd=None, **limits):
+        """
+        Jalankan cmd (list). Return ProcessResult; raise ProcessTimeoutError kalau lewat timeout.
+        limits: nice / cpu_seconds / memory_mb untuk override default tool.
+        """
+        tool = self._tool(cmd)
+        conf = {**PROCESS_DEFAULT, **self.tools.get(tool, {}), **limits}
+        timeout = timeout or conf["timeout"]
+        if tool == "ffmpeg" and "-nostats" not in cmd:
+            cmd = [cmd[0], "-nostats", *cmd[1:]]  # progress per frame tidak perlu, cuma bikin stderr banjir
+        cmd, pending = self._wrap(cmd, conf["nice"], conf["cpu_seconds"], conf["memory_mb"])
+
+        async with self._sem(tool), self._global:
+            self.running[tool] += 1
+            start = time.monotonic()
+            stderr_tail = deque(maxlen=PROCESS_STDERR_LINES)
+            proc = None
+            tasks = []
+            try:
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE if capture_stdout else asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=cwd,
+                    start_new_session=(os.name == "posix"),  # process group sendiri → bisa kill 1 tree
+                )
+                if any(pending.values()):
+                    self._limit_after_spawn(proc.pid, **pending)
+
+                async def pump_stderr():
+                    partial = b""
+                    while True:
+                        chunk = await proc.stderr.read(PROCESS_STDERR_CHUNK)
+                        if not chunk:
+                            break
+                        *lines, partial = re.split(rb"[\r\n]", partial + chunk)
+                        partial = partial[-PROCESS_STDERR_CHUNK:]
+                        for line in lines:
+                            if line.strip():
+                                stderr_tail.append(line.decode(errors="replace").rstrip())
+                    if partial.strip():
+                        stderr_tail.append(partial.decode(errors="replace").rstrip())
+
+                async def read_stdout():
+                    return await proc.stdout.read() if capture_stdout else None
+
+                tasks = [
+                    asyncio.ensure_future(pump_stderr()),
+                    asyncio.ensure_future(read_stdout()),
+                    asyncio.ensure_future(proc.wait()),
+                ]
+                done, not_done = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()  # error baca pipe → naik ke except di bawah (proses di-kill)
+                if not_done:
+                    self.timeouts[tool] += 1
+                    await self._kill_tree(proc)
+                    raise ProcessTimeoutError(f"{tool} timeout setelah {timeout:g}s")
+                stdout = tasks[1].result()
+
+                result = ProcessResult(proc.returncode, stdout, "\n".join(stderr_tail), time.monotonic() - start)
+                if result.ok:
+                    self.completed[tool] += 1
+                else:
+                    self.failed[tool] += 1
+                    self.last_error[tool] = result.stderr_tail[-300:]
+                    logger.warning(f"[PROC] {tool} exit {result.returncode}: {result.stderr_tail[-300:]}")
+                return result
+            except BaseException:
+                # Timeout, handler dibatalkan, atau error baca pipe → jangan tinggalkan proses yatim
+                if proc is not None and proc.returncode is None:
+                    await self._kill_tree(proc)
+                raise
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                self.running[tool] -= 1
+
+    def stats(self):
+        tools = set(self.running) | set(self.completed) | set(self.failed) | set(self.timeouts)
+        return {
+            tool: {
+                "running": self.running[tool],
+                "completed": self.completed[tool],
+                "failed": self.failed[tool],
+                "timeouts": self.timeouts[tool],
+            }
+            for tool in sorted(tools)
+        }
+
+process_runner = ProcessRunner(PROCESS_GLOBAL_LIMIT, PROCESS_TOOLS)
+
+# ==========================================
+# 🩺 LOOP LAG MONITOR & HANDLER PROFILER
+# ==========================================
+
+LOOP_LAG_INTERVAL = 0.1        # detik, jarak heartbeat
+LOOP_STALL_THRESHOLD = cfg("LOOP_STALL_THRESHOLD", 0.25)  # detik, di atas ini dianggap stall
+LOOP_STALL_KEEP = 20           # stall terburuk yang disimpan (plus stack-nya)
+HANDLER_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+class LoopMonitor:
+    """
+    Heartbeat task di event loop + thread watchdog.
+    Task mengukur lag (tidur X, bangun telat berapa); watchdog melihat heartbeat macet
+    dan mengambil stack thread event loop saat itu juga → ketahuan siapa yang nge-block.
+    """
+
+    def __init__(self):
+        self.lags = deque(maxlen=600)  # ~1 menit terakhir
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.worst = []                # [(durasi, waktu, stack)] urut terburuk
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._stack = None             # stack yang ditangkap watchdog untuk stall yang sedang jalan
+        self._task = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _heartbeat(self):
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            now = time.monotonic()
+            lag = max(0.0, now - t0 - LOOP_LAG_INTERVAL)
+            self._beat = now
+            self.lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= LOOP_STALL_THRESHOLD:
+                self._record_stall(lag)
+            self._stack = None
+
+    def _watchdog(self):
+        """Thread terpisah: kalau heartbeat telat, foto stack event loop (sekali per stall)"""
+        while not self._stop.wait(LOOP_LAG_INTERVAL / 2):
+            late = time.monotonic() - self._beat - LOOP_LAG_INTERVAL
+            if late < LOOP_STALL_THRESHOLD or self._stack is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._stack = "".join(traceback.format_stack(frame, limit=12))
+
+    def _record_stall(self, lag):
+        self.stalls += 1
+        stack = self._stack or "(stack tidak tertangkap)"
+        logger.warning(f"[LOOP] Stall {lag * 1000:.0f}ms\n{stack}")
+        self.worst.append((lag, datetime.datetime.now().strftime("%d/%m %H:%M:%S"), stack))
+        self.worst.sort(key=lambda x: x[0], reverse=True)
+        del self.worst[LOOP_STALL_KEEP:]
+
+    def stats(self):
+        lags = sorted(self.lags)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+        return {
+            "current": self.lags[-1] if self.lags else 0.0,
+            "p99": p99,
+            "max": self.max_lag,
+            "stalls": self.stalls,
+        }
+
+loop_monitor = LoopMonitor()
+
+LOOP_SELFTEST_SECONDS = 1.0
+
+def _selftest_cpu_work(seconds):
+    """Simulasi kerja CPU (hash terus-menerus) selama N detik"""
+    end = time.monotonic() + seconds
+    h = hashlib.sha256()
+    while time.monotonic() < end:
+        h.update(b"x" * 65536)
+    return h.hexdigest()
+
+async def loop_stall_selftest(seconds=LOOP_SELFTEST_SECONDS, threshold=LOOP_STALL_THRESHOLD):
+    """
+    Regression check executor: simulasi download (sleep di 'subprocess', tulis file di 'io',
+    hash di 'cpu') lewat run_blocking sambil ukur lag loop. Return (lolos, lag maks detik).
+    """
+    tick = 0.01
+    worst = 0.0
+    done = asyncio.Event()
+
+    async def probe():
+        nonlocal worst
+        while not done.is_set():
+            start = time.monotonic()
+            await asyncio.sleep(tick)
+            worst = max(worst, time.monotonic() - start - tick)
+
+    def fake_write(n):
+        with tempfile.TemporaryFile() as f:
+            for _ in range(n):
+                f.write(os.urandom(65536))
+                time.sleep(seconds / n)
+
+    probe_task = asyncio.create_task(probe())
+    try:
+        await asyncio.gather(
+            run_blocking("subprocess", time.sleep, seconds),
+            run_blocking("io", fake_write, 20),
+            run_blocking("cpu", _selftest_cpu_work, seconds),
+        )
+    finally:
+        done.set()
+        await probe_task
+    return worst < threshold, worst
+
+class HandlerHistogram:
+    """Histogram latency 1 handler (bucket ms tetap)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.buckets = [0] * (len(HANDLER_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds, ok=True):
+        ms = seconds * 1000
+        self.buckets[bisect.bisect_left(HANDLER_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if not ok:
+            self.errors += 1
+
+    def percentile(self, q):
+        """Perkiraan percentile (batas atas bucket), detik"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return (HANDLER_BUCKETS_MS[i] if i < len(HANDLER_BUCKETS_MS) else self.max * 1000) / 1000
+        return self.max
+
+handler_stats = {}  # nama handler -> HandlerHistogram
+
+def _timed_callback(callback):
+    name = getattr(callback, "__name__", repr(callback))
+    hist = handler_stats.setdefault(name, HandlerHistogram(name))
+
+    @wraps(callback)
+    async def timed(update, context):
+        start = time.monotonic()
+        ok = False
+        try:
+            result = await callback(update, context)
+            ok = True
+            return result
+        finally:
+            hist.record(time.monotonic() - start, ok)
+
+    timed._timed = True
+    return timed
+
+def instrument_handlers(app):
+    """Bungkus callback semua handler (termasuk isi ConversationHandler) dengan timer"""
+    def wrap(handler):
+        for attr in ("entry_points", "fallbacks"):
+            for child in getattr(handler, attr, None) or []:
+                wrap(child)
+        for children in (getattr(handler, "states", None) or {}).values():
+            for child in children:
+                wrap(child)
+        callback = getattr(handler, "callback", None)
+        if callback is not None and asyncio.iscoroutinefunction(callback) and not getattr(callback, "_timed", False):
+            handler.callback = _timed_callback(callback)
+
+    count = 0
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            wrap(handler)
+            count += 1
+    logger.info(f"[PERF] {count} handler di-instrument")
+
+# ==========================================
+# 🧠 IN-MEMORY CACHE (LRU + TTL)
+# ==========================================
+
+SINGLE_FLIGHTS = []  # semua instance, buat metrik dedup di dashboard
+
+class SingleFlight:
+    """Call paralel dengan key sama cuma jalan 1x, caller lain menunggu future yang sama"""
+
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}  # key -> Future
+        self.calls = 0
+        self.deduped = 0
+        SINGLE_FLIGHTS.append(self)
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    def forget(self, key):
+        """Caller berikutnya mulai load baru (hasil yang sedang jalan tetap dikirim ke penunggunya)"""
+        self._inflight.pop(key, None)
+
+    def clear(self):
+        self._inflight.clear()
+
+    async def do(self, key, fn):
+        self.calls += 1
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.deduped += 1
+            try:
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if fut.cancelled():  # leader yang dibatalkan, bukan kita → coba lagi
+                    return await self.do(key, fn)
+                raise
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            value = await fn()
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # tandai sudah dibaca, biar tidak ada warning
+            raise
+        else:
+            fut.set_result(value)
+            return value
+        finally:
+            if self._inflight.get(key) is fut:
+                del self._inflight[key]
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "inflight": len(self._inflight),
+            "calls": self.calls,
+            "deduped": self.deduped,
+            "dedup_ratio": (self.deduped / self.calls) if self.calls else 0.0,
+        }
+
+def single_flight_summary():
+    """Ringkasan 'nama dedup/calls' untuk dashboard"""
+    return ", ".join(
+        f"{f.name} {f.deduped}/{f.calls}" for f in SINGLE_FLIGHTS if f.calls
+    ) or "-"
+
+class TTLCache:
+    """Cache in-process: LRU eviction + TTL, miss paralel untuk key sama cuma load 1x"""
+
+    def __init__(self, maxsize=10000, ttl=300, name="cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._flight = SingleFlight(name)
+        self._epoch = 0             # naik tiap invalidate, hasil load lama jangan disimpan
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, key):
+        """Return (hit, value) — entry kadaluarsa dianggap miss"""
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            del self._data[key]
+        self.misses += 1
+        return False, None
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (time.monotonic() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        self._data.pop(key, None)
+        self._flight.forget(key)
+        self._epoch += 1
+
+    def clear(self):
+        self._data.clear()
+        self._flight.clear()
+        self._epoch += 1
+
+    async def get_or_load(self, key, loader, ttl=None):
+        """Ambil dari cache, kalau miss panggil loader() (error tidak di-cache)"""
+        hit, value = self.lookup(key)
+        if hit:
+            return value
+
+        async def load():
+            epoch = self._epoch
+            value = await loader()
+            if self._epoch == epoch:
+                self.set(key, value, ttl)
+            return value
+
+        return await self._flight.do(key, load)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+
+# ==========================================
+# 🌐 SHARED HTTP CLIENTS (KEEP-ALIVE + HTTP/2)
+# ==========================================
+
+# HTTP/2 butuh paket 'h2' (pip install httpx[http2]); kalau tidak ada tetap HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 1 client per grup upstream → batas koneksi terpisah per grup
+HTTP_CLIENT_GROUPS = {
+    # API umum (cuaca, BMKG, Binance, Yahoo, BIN, lrclib, OMDB, scraping ringan)
+    "default": {
+        "timeout": httpx.Timeout(30.0, connect=10.0),
+        "limits": httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0),
+    },
+    # LLM (ohmygpt) — respon lama, koneksi sedikit
+    "ai": {
+        "timeout": httpx.Timeout(120.0, connect=10.0),
+        "limits": httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60.0),
+    },
+    # Media besar (tikwm, CDN TikTok, image generator)
+    "media": {
+        "timeout": httpx.Timeout(60.0, connect=10.0),
+        "limits": httpx.Limits(max_connections=40, max_keepalive_connections=10, keepalive_expiry=30.0),
+    },
+}
+
+class _NoStoreCookiePolicy(DefaultCookiePolicy):
+    """Set-Cookie tidak pernah disimpan di client bersama (cookie user A jangan kebawa ke user B)"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+class HttpClients:
+    """Registry httpx.AsyncClient per grup, dibuat di on_startup & ditutup di on_shutdown"""
+
+    def __init__(self, groups):
+        self.groups = groups
+        self._clients = {}
+
+    def get(self, group="default"):
+        client = self._clients.get(group)
+        if client is None or client.is_closed:
+            opts = self.groups.get(group, self.groups["default"])
+            jar = CookieJar(policy=_NoStoreCookiePolicy())
+            client = httpx.AsyncClient(http2=HTTP2_AVAILABLE, cookies=jar, **opts)
+            self._clients[group] = client
+        return client
+
+    def start(self):
+        for group in self.groups:
+            self.get(group)
+        logger.info(f"[HTTP] Shared clients ready: {', '.join(self.groups)} (http2={HTTP2_AVAILABLE})")
+
+    async def close(self):
+        for group, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"[HTTP] Close error ({group}): {e}")
+        self._clients.clear()
+
+http_clients = HttpClients(HTTP_CLIENT_GROUPS)
+
+# ==========================================
+# ⚡ CIRCUIT BREAKER (PER HOST + ADAPTIVE TIMEOUT)
+# ==========================================
+
+BREAKER_WINDOW = 60.0          # detik rolling window
+BREAKER_MIN_CALLS = 10         # minimal sampel sebelum boleh trip
+BREAKER_ERROR_RATE = 0.5       # ≥50% gagal → open
+BREAKER_COOLDOWN = 30.0        # open → half-open setelah ini (dobel tiap probe gagal)
+BREAKER_MAX_COOLDOWN = 300.0
+BREAKER_MIN_SAMPLES_P95 = 20   # sampel sukses minimal buat timeout adaptif
+BREAKER_TIMEOUT_MULT = 3.0     # timeout = p95 × ini (tidak lebih dari timeout asli)
+BREAKER_MIN_TIMEOUT = 5.0
+
+class CircuitOpenError(Exception):
+    """Upstream sedang di-blok breaker, request langsung ditolak (fail fast)"""
+
+class CircuitBreaker:
+    """Breaker 1 host: closed → open (error rate tinggi) → half-open (1 probe) → closed"""
+
+    def __init__(self, host):
+        self.host = host
+        self.samples = deque(maxlen=500)  # (ts, ok, latency)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.cooldown = BREAKER_COOLDOWN
+        self.probing = False
+        self.trips = 0
+        self.rejected = 0
+
+    def _prune(self, now):
+        while self.samples and now - self.samples[0][0] > BREAKER_WINDOW:
+            self.samples.popleft()
+
+    def retry_in(self):
+        return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+    def allow(self):
+        if self.state == "open":
+            if self.retry_in() > 0:
+                self.rejected += 1
+                return False
+            self.state = "half_open"
+            self.probing = False
+        if self.state == "half_open":
+            if self.probing:
+                self.rejected += 1
+                return False
+            self.probing = True
+        return True
+
+    def release(self):
+        """Request batal/error lokal: jangan dihitung, lepas slot probe"""
+        self.probing = False
+
+    def record(self, ok, latency):
+        now = time.monotonic()
+        if self.state == "half_open":
+            self.probing = False
+            if not ok:
+                self._trip(now, min(self.cooldown * 2, BREAKER_MAX_COOLDOWN))
+                return
+            self.state = "closed"
+            self.cooldown = BREAKER_COOLDOWN
+            self.samples.clear()
+            logger.info(f"[BREAKER] {self.host} closed (probe OK)")
+        self.samples.append((now, ok, latency))
+        self._prune(now)
+        if (self.state == "closed" and len(self.samples) >= BREAKER_MIN_CALLS
+                and self.error_rate() >= BREAKER_ERROR_RATE):
+            self._trip(now, BREAKER_COOLDOWN)
+
+    def _trip(self, now, cooldown):
+        self.state = "open"
+        self.opened_at = now
+        self.cooldown = cooldown
+        self.trips += 1
+        logger.warning(f"[BREAKER] {self.host} OPEN for {cooldown:.0f}s (error rate {self.error_rate():.0%})")
+
+    def error_rate(self):
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok, _ in self.samples if not ok) / len(self.samples)
+
+    def p95(self):
+        lat = sorted(l for _, ok, l in self.samples if ok)
+        if len(lat) < BREAKER_MIN_SAMPLES_P95:
+            return None
+        return lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+
+    def timeout_for(self, configured):
+        """Timeout adaptif dari p95, tidak pernah lebih lama dari timeout asli call site"""
+        p95 = self.p95()
+        if p95 is None:
+            return configured
+        return min(configured, max(BREAKER_MIN_TIMEOUT, p95 * BREAKER_TIMEOUT_MULT))
+
+circuit_breakers = {}  # host -> CircuitBreaker
+
+def breaker_for(url):
+    host = (urllib.parse.urlsplit(str(url)).hostname or "").lower()
+    breaker = circuit_breakers.get(host)
+    if breaker is None:
+        breaker = circuit_breakers[host] = CircuitBreaker(host)
+    return breaker
+
+def breaker_report(limit=8):
+    """Baris status breaker (yang tidak sehat duluan, lalu yang paling ramai)"""
+    order = {"open": 0, "half_open": 1, "closed": 2}
+    rows = sorted(circuit_breakers.values(), key=lambda b: (order[b.state], -len(b.samples)))
+    lines = []
+    for b in rows[:limit]:
+        icon = {"open": "🔴", "half_open": "🟠", "closed": "🟢"}[b.state]
+        p95 = b.p95()
+        p95_text = f"{p95:.1f}s" if p95 is not None else "-"
+        extra = f" retry {b.retry_in():.0f}s" if b.state == "open" else ""
+        lines.append(f"{icon} {b.host[:24]} err {b.error_rate():.0%} p95 {p95_text}{extra}")
+    return lines
+
+class HttpSession:
+    """
+    Pengganti 'async with httpx.AsyncClient(...)': pakai client bersama + default per call site.
+    Cookie cuma hidup selama satu session (blok async with), sama seperti client sendiri dulu.
+    """
+
+    def __init__(self, group="default", timeout=None, headers=None, follow_redirects=None):
+        self.client = http_clients.get(group)
+        self.timeout = timeout
+        self.headers = headers
+        self.follow_redirects = follow_redirects
+        self.cookies = httpx.Cookies()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False  # koneksi tetap hidup di pool, jangan ditutup
+
+    def _merge(self, kwargs):
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        if self.follow_redirects is not None:
+            kwargs.setdefault("follow_redirects", self.follow_redirects)
+        if self.headers or kwargs.get("headers"):
+            kwargs["headers"] = {**(self.headers or {}), **(kwargs.get("headers") or {})}
+        if self.cookies or kwargs.get("cookies"):
+            merged = httpx.Cookies(self.cookies)
+            merged.update(kwargs.get("cookies") or {})
+            kwargs["cookies"] = merged
+        return kwargs
+
+    async def request(self, method, url, **kwargs):
+        kwargs = self._merge(kwargs)
+        breaker = breaker_for(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.host} sedang down, coba lagi {breaker.retry_in():.0f} detik lagi")
+
+        configured = kwargs.get("timeout", self.client.timeout.read)
+        if isinstance(configured, (int, float)):
+            adaptive = breaker.timeout_for(configured)
+            if adaptive < configured:
+                kwargs["timeout"] = httpx.Timeout(adaptive, connect=min(10.0, adaptive))
+
+        start = time.monotonic()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+        except httpx.TransportError:  # timeout, connect/read error
+            breaker.record(False, time.monotonic() - start)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(resp.status_code < 500 and resp.status_code != 429, time.monotonic() - start)
+        self.cookies.extract_cookies(resp)
+        return resp
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    def stream(self, method, url, **kwargs):
+        return self.client.stream(method, url, **self._merge(kwargs))
+
+def http_session(group="default", **defaults):
+    """Shortcut: async with http_session("ai", timeout=120) as client: ..."""
+    return HttpSession(group, **defaults)
+
+async def hedged_race(attempts, hedge_delay=5.0, on_event=None):
+    """
+    Hedged request: attempts = [(name, async_fn), ...] urut prioritas.
+    Yang berikut start kalau belum ada jawaban dalam hedge_delay atau yang jalan gagal.
+    Hasil pertama yang bukan None menang, sisanya di-cancel. Return (name, result) / (None, None).
+    """
+    queue = list(attempts)
+    pending = {}  # task -> name
+
+    def notify(kind, name):
+        if on_event:
+            try:
+                on_event(kind, name)
+            except Exception:
+                pass
 
+    def launch():
+        name, fn = queue.pop(0)
+        pending[asyncio.create_task(fn())] = name
+        notify("start", name)
+
+    try:
+        launch()
+        while pending:
+            done, _ = await asyncio.wait(
+                pending, timeout=hedge_delay if queue else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                launch()  # hedge: yang jalan lambat, tambah source berikut
+                continue
+            for task in done:
+                name = pending.pop(task)
+                try:
+                    result = task.result()
+                except Exception as e:
+                    logger.debug(f"[HEDGE] {name} error: {e}")
+                    result = None
+                if result is not None:
+                    notify("win", name)
+                    return name, result
+                notify("fail", name)
+                if queue:
+                    launch()  # gagal → langsung lempar ke source berikut
+        return None, None
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Tunggu yang kalah benar-benar selesai (koneksi/file dilepas, error tidak nyangkut)
+            await asyncio.gather(*pending, return_exceptions=True)
+
+# ==========================================
+# 🗃️ HTTP RESPONSE CACHE (TTL + STALE-WHILE-REVALIDATE)
+# ==========================================
+
+# (prefix URL, fresh detik, stale detik) — prefix pertama yang cocok dipakai, sisanya tidak di-cache
+FETCH_CACHE_POLICY = [
+    (BMKG_URL, 60, 300),
+    (BASE_URL, 600, 1800),                                  # OpenWeather (cuaca + AQI)
+    ("https://api.binance.com/", 10, 20),
+    ("https://query1.finance.yahoo.com/", 60, 300),
+    ("http://ip-api.com/", 3600, 86400),
+    (BIN_API, 86400, 7 * 86400),
+    (ANIME_API, 3600, 86400),
+    ("https://api.aladhan.com/", 1800, 3600),
+]
+FETCH_CACHE_MAX_BYTES = cfg("FETCH_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+
+class ResponseCache:
+    """Cache respon upstream: LRU dengan budget byte, fresh → langsung, stale → kirim lama + refresh di background"""
+
+    def __init__(self, max_bytes, name="http"):
+        self.max_bytes = max_bytes
+        self.name = name
+        self._data = OrderedDict()  # key -> (fresh_until, stale_until, value, size)
+        self._flight = SingleFlight(name)
+        self._tasks = set()         # refresh background (simpan referensi biar tidak di-GC)
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _store(self, key, value, size, fresh, stale):
+        if size > self.max_bytes // 8:
+            return  # respon raksasa tidak layak makan budget
+        self._drop(key)
+        now = time.monotonic()
+        self._data[key] = (now + fresh, now + fresh + stale, value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes and self._data:
+            _, old = self._data.popitem(last=False)
+            self.bytes -= old[3]
+
+    def _drop(self, key):
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.bytes -= old[3]
+
+    async def _load(self, key, loader, fresh, stale):
+        """Jalankan loader 1x per key, caller lain ikut menunggu hasil yang sama"""
+        async def load():
+            value, size = await loader()
+            if value is not None and size is not None:  # error/None (size None) tidak di-cache
+                self._store(key, value, size, fresh, stale)
+            return value
+
+        return await self._flight.do(key, load)
+
+    async def _refresh(self, key, loader, fresh, stale):
+        self.refreshes += 1
+        try:
+            await self._load(key, loader, fresh, stale)
+        except Exception as e:
+            logger.error(f"[HTTP CACHE] Refresh gagal {key[1][:80]}: {e}")
+
+    async def get_or_load(self, key, loader, fresh, stale=0):
+        """loader() harus return (value, size_bytes); size None = kembalikan tapi jangan simpan"""
+        entry = self._data.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            fresh_until, stale_until, value, _ = entry
+            if now < fresh_until:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            if now < stale_until:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                if key not in self._flight:
+                    task = asyncio.create_task(self._refresh(key, loader, fresh, stale))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return value
+            self._drop(key)
+        self.misses += 1
+        return await self._load(key, loader, fresh, stale)
+
+    def invalidate(self, key):
+        self._drop(key)
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self):
+        served = self.hits + self.stale_hits
+        total = served + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "hit_ratio": (served / total) if total else 0.0,
+        }
+
+response_cache = ResponseCache(FETCH_CACHE_MAX_BYTES)
+
+fetch_flight = SingleFlight("fetch")
+
+def fetch_cache_policy(url):
+    """Return (fresh, stale) untuk URL, (0, 0) = tidak di-cache"""
+    for prefix, fresh, stale in FETCH_CACHE_POLICY:
+        if prefix and url.startswith(prefix):
+            return fresh, stale
+    return 0, 0
+
+def fetch_cache_key(method, url, payload=None):
+    """Key = (method, url tanpa fragment dengan query terurut, payload)"""
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.urlencode(sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+    norm = urllib.parse.urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ""))
+    body = json.dumps(payload, sort_keys=True) if payload is not None else None
+    return (method, norm, body)
 
 # ==========================================
 # 🚀 NETWORK & DB ENGINE
 # ==========================================
-async def fetch_json(url, method="GET", payload=None, headers=None):
-    async with httpx.AsyncClient(timeout=30.0, follow_redirects=True) as client:
+async def _fetch_json_upstream(url, method="GET", payload=None, headers=None):
+    """
+    Request asli ke upstream, return (json, ukuran byte) atau (None, 0).
+    Status non-2xx → (json error, None): tetap dikembalikan ke caller tapi tidak boleh masuk cache.
+    """
+    async with http_session(timeout=30.0, follow_redirects=True) as client:
         try:
             if method == "GET":
                 resp = await client.get(url, headers=headers)
             else:
                 resp = await client.post(url, json=payload, headers=headers)
-            return resp.json()
+            if not resp.is_success:
+                return resp.json(), None
+            return resp.json(), len(resp.content)
         except:
-            return None
+            return None, 0
+
+async def fetch_json(url, method="GET", payload=None, headers=None, cache=True, ttl=None):
+    """GET ke upstream di FETCH_CACHE_POLICY di-cache, GET lain digabung kalau barengan; cache=False = request mentah"""
+    fresh, stale = fetch_cache_policy(url) if ttl is None else (ttl, 0)
+    if method != "GET" or not cache:
+        data, _ = await _fetch_json_upstream(url, method, payload, headers)
+        return data
+    if fresh <= 0:
+        # Tidak di-cache, tapi GET identik yang barengan tetap cukup 1 request
+        key = fetch_cache_key(method, url) + (tuple(sorted((headers or {}).items())),)
+        data, _ = await fetch_flight.do(key, lambda: _fetch_json_upstream(url, method, payload, headers))
+        return data
+    return await response_cache.get_or_load(
+        fetch_cache_key(method, url, payload),
+        lambda: _fetch_json_upstream(url, method, payload, headers),
+        fresh, stale,
+    )
+
+# ==========================================
+# 🗄️ DB POOL (1 WRITER + N READER, WAL MODE)
+# ==========================================
+
+DB_READERS = 4
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-32000",    # ~32MB page cache per koneksi
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+class DBPool:
+    """Koneksi SQLite long-lived: 1 writer (serial) + N reader (paralel)"""
+
+    def __init__(self, path, readers=DB_READERS):
+        self.path = path
+        self.size = readers
+        self._writer = None
+        self._readers = None
+        self._all = []
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def started(self):
+        return self._writer is not None
+
+    async def _open(self):
+        db = await aiosqlite.connect(self.path)
+        for pragma in DB_PRAGMAS:
+            await db.execute(pragma)
+        self._all.append(db)
+        return db
+
+    async def start(self):
+        """Buka semua koneksi (dipanggil sekali saat boot)"""
+        if self.started:
+            return
+        self._writer = await self._open()
+        self._readers = asyncio.Queue()
+        for _ in range(self.size):
+            self._readers.put_nowait(await self._open())
+        logger.info(f"[DB POOL] Started: 1 writer + {self.size} readers ({self.path})")
+
+    async def close(self):
+        """Tutup semua koneksi dengan rapi"""
+        if not self.started:
+            return
+        async with self._write_lock:
+            for db in self._all:
+                try:
+                    await db.close()
+                except Exception as e:
+                    logger.error(f"[DB POOL] Close error: {e}")
+            self._all.clear()
+            self._writer = None
+            self._readers = None
+        logger.info("[DB POOL] Closed")
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        """Pinjam 1 koneksi reader (fallback: koneksi sekali pakai)"""
+        if not self.started:
+            async with aiosqlite.connect(self.path) as db:
+                yield db
+            return
+        readers = self._readers
+        db = await readers.get()
+        try:
+            yield db
+        finally:
+            readers.put_nowait(db)
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        """Pakai koneksi writer secara eksklusif, commit di akhir blok"""
+        if not self.started:
+            async with aiosqlite.connect(self.path) as db:
+                yield db
+                await db.commit()
+            return
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+db_pool = DBPool(DB_NAME)
 
 # ✅ DB HELPERS (HARUS ADA DULU)
 async def db_execute(query, params=()):
     """Execute query tanpa return"""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with db_pool.write() as db:
             await db.execute(query, params)
-            await db.commit()
         return True
     except Exception as e:
         logger.error(f"[DB_EXECUTE] Error: {str(e)}")
@@ -175,9 +1409,9 @@ async def db_execute(query, params=()):
 async def db_fetch_one(query, params=()):
     """Fetch 1 row"""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            cursor = await db.execute(query, params)
-            return await cursor.fetchone()
+        async with db_pool.read() as db:
+            async with db.execute(query, params) as cursor:
+                return await cursor.fetchone()
     except Exception as e:
         logger.error(f"[DB_FETCH_ONE] Error: {str(e)}")
         return None
@@ -185,9 +1419,9 @@ async def db_fetch_one(query, params=()):
 async def db_fetch_all(query, params=()):
     """Fetch semua rows"""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            cursor = await db.execute(query, params)
-            return await cursor.fetchall()
+        async with db_pool.read() as db:
+            async with db.execute(query, params) as cursor:
+                return await cursor.fetchall()
     except Exception as e:
         logger.error(f"[DB_FETCH_ALL] Error: {str(e)}")
         return []
@@ -198,9 +1432,8 @@ async def db_insert(table, data):
         columns = ", ".join(data.keys())
         placeholders = ", ".join(["?" for _ in data])
         query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with db_pool.write() as db:
             await db.execute(query, tuple(data.values()))
-            await db.commit()
         return True
     except Exception as e:
         logger.error(f"[DB_INSERT] Error: {str(e)}")
@@ -213,64 +1446,315 @@ async def db_update(table, data, where):
         where_clause = " AND ".join([f"{k}=?" for k in where.keys()])
         query = f"UPDATE {table} SET {set_clause} WHERE {where_clause}"
         params = tuple(data.values()) + tuple(where.values())
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with db_pool.write() as db:
             await db.execute(query, params)
-            await db.commit()
         return True
     except Exception as e:
         logger.error(f"[DB_UPDATE] Error: {str(e)}")
         return False
 
 # ==========================================
-# 💾 MEDIA CACHE FUNCTIONS
+# 💾 MEDIA CACHE FUNCTIONS (LRU + BLOOM + SQLITE)
 # ==========================================
+# Tier 1: LRU di memori (hit = 0 I/O)
+# Tier 2: Bloom filter semua key di media_cache → "pasti miss" tidak sentuh disk
+# Tier 3: SQLite (hanya kalau bloom bilang "mungkin ada")
+
+# --- URL CANONICALIZER: link beda, video sama → key cache sama ---
+# Tracker universal (semua host) + prefix utm_*
+MEDIA_TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_eid", "yclid", "twclid"}
+# Param share per platform: di situs lain 's', 't', 'ref' bisa jadi bagian dari alamat konten
+MEDIA_PLATFORM_TRACKING_PARAMS = {
+    "youtube": {"si", "feature", "pp", "t"},
+    "tiktok": {"is_from_webapp", "sender_device", "sender_web_id", "_r", "_t", "t"},
+    "instagram": {"igshid", "igsh"},
+    "twitter": {"s", "t", "ref_src", "ref_url"},
+    "facebook": {"mibextid", "ref", "s", "rdid", "share_url"},
+}
+MEDIA_ID_RE = {
+    "youtube": re.compile(r"^/(?:shorts|embed|live|v|e)/([A-Za-z0-9_-]{11})"),
+    "tiktok": re.compile(r"/(?:video|photo|v)/(\d+)"),
+    "instagram": re.compile(r"^/(?:[^/]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)"),
+    "twitter": re.compile(r"/status(?:es)?/(\d+)"),
+    "facebook": re.compile(r"/(?:videos|reel|reels)/(?:[^/]+/)?(\d+)"),
+}
+
+def media_platform(host: str):
+    """Nama platform untuk host yang sudah dinormalisasi (None kalau bukan platform yang dikenal)"""
+    if host in ("youtube.com", "youtube-nocookie.com", "youtu.be"):
+        return "youtube"
+    if host.endswith("tiktok.com"):
+        return "tiktok"
+    if host in ("instagram.com", "instagr.am"):
+        return "instagram"
+    if host in ("twitter.com", "x.com", "fxtwitter.com", "vxtwitter.com"):
+        return "twitter"
+    if host in ("facebook.com", "fb.watch", "fb.com"):
+        return "facebook"
+    return None
+
+def canonical_media_key(url: str) -> str:
+    """Map URL media ke key stabil 'platform:media_id' (non-URL dikembalikan apa adanya)"""
+    raw = (url or "").strip()
+    if not raw.startswith(("http://", "https://", "www.")):
+        return raw  # contoh: Spotify track_id, key varian 'tiktok:123#audio'
+    try:
+        parts = urllib.parse.urlsplit(raw if "://" in raw else f"https://{raw}")
+    except ValueError:
+        return raw
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m.", "mobile.", "music."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    query = urllib.parse.parse_qs(parts.query)
+    platform = media_platform(host)
+
+    if platform == "youtube":
+        if host == "youtu.be":
+            vid = path.strip("/").split("/")[0]
+        elif path.rstrip("/") == "/watch":
+            vid = (query.get("v") or [""])[0]
+        else:
+            m = MEDIA_ID_RE["youtube"].match(path)
+            vid = m.group(1) if m else ""
+        if re.fullmatch(r"[A-Za-z0-9_-]{11}", vid or ""):
+            return f"youtube:{vid}"
+    elif platform == "tiktok":
+        m = MEDIA_ID_RE["tiktok"].search(path)
+        if m:
+            return f"tiktok:{m.group(1)}"
+        if host in ("vm.tiktok.com", "vt.tiktok.com") or path.startswith("/t/"):
+            code = path.strip("/").split("/")[-1]
+            if code:
+                return f"tiktok:short:{code}"
+    elif platform == "instagram":
+        m = MEDIA_ID_RE["instagram"].match(path)
+        if m:
+            return f"instagram:{m.group(1)}"
+    elif platform == "twitter":
+        m = MEDIA_ID_RE["twitter"].search(path)
+        if m:
+            return f"twitter:{m.group(1)}"
+    elif platform == "facebook":
+        if host == "fb.watch":
+            code = path.strip("/").split("/")[0]
+            if code:
+                return f"facebook:short:{code}"
+        if (query.get("v") or [""])[0].isdigit():
+            return f"facebook:{query['v'][0]}"
+        m = MEDIA_ID_RE["facebook"].search(path)
+        if m:
+            return f"facebook:{m.group(1)}"
+
+    # Fallback: URL dinormalisasi (tanpa tracking param, tanpa trailing slash)
+    strip = MEDIA_TRACKING_PARAMS | MEDIA_PLATFORM_TRACKING_PARAMS.get(platform, set())
+    clean_q = sorted(
+        (k, v) for k, vals in query.items() for v in vals
+        if k.lower() not in strip and not k.lower().startswith("utm_")
+    )
+    return urllib.parse.urlunsplit(
+        ("https", host, path.rstrip("/") or "/", urllib.parse.urlencode(clean_q), "")
+    )
+
+async def rekey_media_cache(db):
+    """Migrasi: ubah key lama (URL mentah) ke canonical key, simpan entry terbaru"""
+    async with db.execute("SELECT url, file_id, media_type, timestamp FROM media_cache") as cur:
+        rows = await cur.fetchall()
+    for url, file_id, media_type, ts in rows:
+        if url.endswith("_audio"):  # format lama TikTok: f"{url}_audio"
+            new_key = f"{canonical_media_key(url[:-len('_audio')])}#audio"
+        else:
+            new_key = canonical_media_key(url)
+        if new_key == url:
+            continue
+        await db.execute("DELETE FROM media_cache WHERE url=?", (url,))
+        await db.execute(
+            "INSERT INTO media_cache (url, file_id, media_type, timestamp) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET file_id=excluded.file_id, media_type=excluded.media_type, "
+            "timestamp=excluded.timestamp WHERE excluded.timestamp > COALESCE(media_cache.timestamp, 0)",
+            (new_key, file_id, media_type, ts)
+        )
+    await db.commit()
+
+class BloomFilter:
+    """Bloom filter sederhana (bytearray + double hashing blake2b)"""
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size / self.capacity * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+MEDIA_CACHE_MAX_ROWS = cfg("MEDIA_CACHE_MAX_ROWS", 50000)       # batas jumlah baris media_cache
+MEDIA_CACHE_MAX_IDLE_DAYS = cfg("MEDIA_CACHE_MAX_IDLE_DAYS", 90)  # file_id tidak dipakai N hari → buang
+
+media_lru = TTLCache(maxsize=5000, ttl=6 * 3600, name="media")
+media_cache_stats = {"hits": 0, "misses": 0, "invalidated": 0}
+media_bloom = None     # None = belum dibangun → semua lookup ke DB
+_bloom_backlog = None  # key yang disimpan selama bloom sedang dibangun ulang
+
+async def load_media_bloom():
+    """Bangun bloom filter dari semua key media_cache (dipanggil saat boot)"""
+    global media_bloom, _bloom_backlog
+    if _bloom_backlog is not None:
+        return  # rebuild lain sedang jalan
+    _bloom_backlog = []
+    try:
+        rows = await db_fetch_all("SELECT url FROM media_cache")
+        bloom = BloomFilter(capacity=max(len(rows) * 2, 100000))
+        for (key,) in rows:
+            bloom.add(key)
+        for key in _bloom_backlog:
+            bloom.add(key)
+        media_bloom = bloom
+        logger.info(f"[CACHE] Media bloom ready: {len(rows)} keys, {len(bloom.bits) // 1024}KB")
+    except Exception as e:
+        media_bloom = None
+        logger.error(f"[CACHE] Bloom build error: {str(e)}")
+    finally:
+        _bloom_backlog = None
 
 async def save_media_cache(url: str, file_id: str, media_type: str) -> bool:
-    """Simpan media ke cache untuk reuse"""
+    """Simpan media ke cache untuk reuse (key = canonical_media_key)"""
+    url = canonical_media_key(url)
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with db_pool.write() as db:
             await db.execute(
                 "INSERT OR REPLACE INTO media_cache (url, file_id, media_type, timestamp) VALUES (?, ?, ?, ?)",
                 (url, file_id, media_type, time.time())
             )
-            await db.commit()
+        media_lru.set(url, {"file_id": file_id, "media_type": media_type, "cached": True})
+        if _bloom_backlog is not None:
+            _bloom_backlog.append(url)
+        if media_bloom is not None:
+            media_bloom.add(url)
+            if media_bloom.count > media_bloom.capacity:
+                asyncio.create_task(load_media_bloom())  # sudah penuh, bangun ulang lebih besar
         return True
     except Exception as e:
         logger.error(f"[CACHE] Save error: {str(e)}")
         return False
 
+def _record_media_hit(key: str, hit: bool):
+    """Catat hit/miss; update hits & last_hit di DB lewat write-behind sink"""
+    if not hit:
+        media_cache_stats["misses"] += 1
+        return
+    media_cache_stats["hits"] += 1
+    if action_sink.running:
+        action_sink.add(
+            "UPDATE media_cache SET hits = hits + 1, last_hit = ? WHERE url = ?",
+            (time.time(), key)
+        )
+
 async def get_media_cache(url: str) -> dict:
-    """Ambil media dari cache"""
+    """Ambil media dari cache (key = canonical_media_key)"""
+    url = canonical_media_key(url)
+    hit, value = media_lru.lookup(url)
+    if hit:
+        _record_media_hit(url, True)
+        return value
+    if media_bloom is not None and url not in media_bloom:
+        _record_media_hit(url, False)
+        return {"cached": False}
     try:
         result = await db_fetch_one(
             "SELECT file_id, media_type FROM media_cache WHERE url=?",
             (url,)
         )
         if result:
-            return {
+            value = {
                 "file_id": result[0],
                 "media_type": result[1],
                 "cached": True
             }
+            media_lru.set(url, value)
+            _record_media_hit(url, True)
+            return value
+        _record_media_hit(url, False)
         return {"cached": False}
     except Exception as e:
         logger.error(f"[CACHE] Get error: {str(e)}")
         return {"cached": False}
 
-async def clear_old_media_cache(days: int = 365) -> bool:
-    """Hapus cache yang sudah lama"""
+async def invalidate_media_cache(url: str) -> bool:
+    """Hapus 1 entry (misal Telegram menolak file_id lama saat resend)"""
+    url = canonical_media_key(url)
+    media_lru.invalidate(url)
+    media_cache_stats["invalidated"] += 1
+    logger.warning(f"[CACHE] Invalidated stale file_id: {url}")
+    return await db_execute("DELETE FROM media_cache WHERE url=?", (url,))
+
+async def evict_media_cache(max_rows=None, max_idle_days=None) -> int:
+    """Eviction LFU/LRU hybrid: buang file_id basi, lalu potong ke batas baris"""
+    max_rows = MEDIA_CACHE_MAX_ROWS if max_rows is None else max_rows
+    max_idle_days = MEDIA_CACHE_MAX_IDLE_DAYS if max_idle_days is None else max_idle_days
+    now = time.time()
     try:
-        old_timestamp = time.time() - (days * 24 * 3600)
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute(
-                "DELETE FROM media_cache WHERE timestamp < ?",
-                (old_timestamp,)
-            )
-            await db.commit()
-        return True
+        async with db_pool.write() as db:
+            # 1. File_id yang sudah lama tidak dipakai (kemungkinan besar sudah basi)
+            async with db.execute(
+                "SELECT url FROM media_cache WHERE COALESCE(last_hit, timestamp, 0) < ?",
+                (now - max_idle_days * 86400,)
+            ) as c:
+                evicted = [row[0] for row in await c.fetchall()]
+            await db.executemany("DELETE FROM media_cache WHERE url=?", [(u,) for u in evicted])
+
+            # 2. Row cap: skor = (hits + 1) / (1 + umur_hari sejak terakhir dipakai)
+            async with db.execute("SELECT COUNT(*) FROM media_cache") as c:
+                excess = (await c.fetchone())[0] - max_rows
+            if excess > 0:
+                async with db.execute(
+                    "SELECT url FROM media_cache ORDER BY"
+                    " (hits + 1.0) / (1.0 + (? - COALESCE(last_hit, timestamp, 0)) / 86400.0) ASC"
+                    " LIMIT ?",
+                    (now, excess)
+                ) as c:
+                    lowest = [row[0] for row in await c.fetchall()]
+                await db.executemany("DELETE FROM media_cache WHERE url=?", [(u,) for u in lowest])
+                evicted += lowest
+        # Cuma key yang dibuang; entry panas lain tetap di LRU (bloom boleh tetap, false positive cuma 1 query)
+        for url in evicted:
+            media_lru.invalidate(url)
+        return len(evicted)
     except Exception as e:
-        logger.error(f"[CACHE] Clear error: {str(e)}")
-        return False
+        logger.error(f"[CACHE] Evict error: {str(e)}")
+        return 0
+
+async def media_cache_eviction_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job berkala: jalankan eviction media_cache"""
+    await action_sink.flush()  # hit counter terbaru ikut dihitung
+    removed = await evict_media_cache()
+    if removed:
+        logger.info(f"[CACHE] Evicted {removed} media_cache rows")
+
+async def get_media_cache_summary() -> dict:
+    """Ringkasan untuk admin dashboard"""
+    row = await db_fetch_one("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM media_cache")
+    total = media_cache_stats["hits"] + media_cache_stats["misses"]
+    return {
+        "rows": row[0] if row else 0,
+        "stored_hits": row[1] if row else 0,
+        "hit_ratio": (media_cache_stats["hits"] / total) if total else 0.0,
+        "lru_size": len(media_lru),
+        **media_cache_stats,
+    }
 
 async def init_db():
     async with aiosqlite.connect(DB_NAME) as db:
@@ -371,8 +1855,128 @@ async def init_db():
         )
 
         await db.commit()
+
+        # Migrasi versi (index, tabel tambahan, perubahan data)
+        await run_migrations(db)
         print("✅ Database Initialized")
 
+# ==========================================
+# 🧬 SCHEMA MIGRATIONS (VERSIONED, IDEMPOTENT)
+# ==========================================
+# Format: (version, nama, [langkah]) — langkah berupa SQL string atau
+# async callable(db). Setiap langkah harus aman dijalankan ulang.
+# Jangan ubah migrasi yang sudah rilis, tambahkan versi baru di bawah.
+
+SCHEMA_MIGRATIONS = [
+    (1, "crypto_alerts table", [
+        """
+        CREATE TABLE IF NOT EXISTS crypto_alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            symbol TEXT,
+            target REAL,
+            created_at REAL
+        )
+        """,
+    ]),
+    (2, "indexes for hot query paths", [
+        # get_user_stats: COUNT(*) + MAX(timestamp) WHERE user_id=? (covering)
+        "CREATE INDEX IF NOT EXISTS idx_user_actions_user_ts ON user_actions (user_id, timestamp)",
+        # get_notes_page: WHERE user_id=? ORDER BY id DESC
+        "CREATE INDEX IF NOT EXISTS idx_user_notes_user_id ON user_notes (user_id, id)",
+        # check_pending_order: WHERE user_id=? AND status=?
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders (user_id, status)",
+        # admin dashboard: COUNT/SUM WHERE status=?
+        "CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)",
+        # stok: WHERE status='AVAILABLE' (GROUP BY plan)
+        "CREATE INDEX IF NOT EXISTS idx_accounts_status_plan ON accounts (status, plan)",
+        # check_price_alerts: scan penuh tapi urut per symbol (covering)
+        "CREATE INDEX IF NOT EXISTS idx_crypto_alerts_symbol ON crypto_alerts (symbol, target, chat_id)",
+    ]),
+    (3, "user_stats summary tables", [
+        """
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            total_actions INTEGER NOT NULL DEFAULT 0,
+            last_action TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_action_counts (
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, action)
+        ) WITHOUT ROWID
+        """,
+        lambda db: backfill_user_stats(db),
+    ]),
+    (4, "user_actions daily rollup + incremental vacuum", [
+        """
+        CREATE TABLE IF NOT EXISTS user_actions_daily (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, user_id, action)
+        ) WITHOUT ROWID
+        """,
+        lambda db: enable_incremental_vacuum(db),
+    ]),
+    (5, "media_cache canonical keys", [
+        lambda db: rekey_media_cache(db),
+    ]),
+    (6, "media_cache hit tracking", [
+        lambda db: add_column_if_missing(db, "media_cache", "hits", "INTEGER NOT NULL DEFAULT 0"),
+        lambda db: add_column_if_missing(db, "media_cache", "last_hit", "REAL"),
+    ]),
+]
+
+async def add_column_if_missing(db, table, column, decl):
+    """ALTER TABLE ADD COLUMN versi idempotent"""
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+        columns = [row[1] for row in await cur.fetchall()]
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+async def enable_incremental_vacuum(db):
+    """auto_vacuum=INCREMENTAL hanya berlaku setelah VACUUM penuh (sekali saja)"""
+    async with db.execute("PRAGMA auto_vacuum") as cur:
+        mode = (await cur.fetchone())[0]
+    if mode != 2:
+        await db.commit()
+        await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        await db.execute("VACUUM")
+
+async def run_migrations(db):
+    """Jalankan migrasi yang belum tercatat di schema_version, berurutan"""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TEXT
+        )
+        """
+    )
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cur:
+        current = (await cur.fetchone())[0]
+
+    for version, name, steps in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        for step in steps:
+            if callable(step):
+                await step(db)
+            else:
+                await db.execute(step)
+        await db.execute(
+            "INSERT OR REPLACE INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+            (version, name, datetime.datetime.now().isoformat())
+        )
+        await db.commit()
+        logger.info(f"[MIGRATION] Applied v{version}: {name}")
+
 # ✅ ADMIN DASHBOARD FUNCTIONS
 async def get_all_subscribers():
     """Get semua subscribers"""
@@ -433,28 +2037,15 @@ async def get_total_revenue_all_time():
 async def add_subscriber(user_id):
     """Add user ke subscribers table"""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with db_pool.write() as db:
             await db.execute(
                 "INSERT OR IGNORE INTO subscribers (user_id) VALUES (?)", 
                 (user_id,)
             )
-            await db.commit()
         return True
     except:
         return False
 
-async def is_registered(user_id: int) -> bool:
-    """Check apakah user sudah registered"""
-    try:
-        result = await db_fetch_one(
-            "SELECT 1 FROM premium_users WHERE user_id=?",
-            (user_id,)
-        )
-        return bool(result)
-    except Exception as e:
-        logger.error(f"[REGISTER CHECK] Error: {str(e)}")
-        return False
-
 async def check_pending_order(user_id: int) -> bool:
     """Check apakah user punya order pending"""
     try:
@@ -496,23 +2087,95 @@ async def get_price_for_plan(plan: str) -> str:
     return prices.get(plan, "Unknown")
 
 # ==========================================
-# 📝 LOGGING
-# ==========================================
+# 📝 LOGGING (WRITE-BEHIND BUFFER)
+# ==========================================
+
+class WriteBehindBuffer:
+    """Kumpulkan INSERT analytics di memori, flush per batch pakai executemany"""
+
+    def __init__(self, max_batch=200, max_age=2.0, max_pending=20000):
+        self.max_batch = max_batch      # flush kalau antrian sudah segini
+        self.max_age = max_age          # ...atau kalau data tertua sudah segini detik
+        self.max_pending = max_pending  # batas atas kalau DB lagi error terus
+        self._pending = defaultdict(list)  # query -> [params, ...]
+        self._count = 0
+        self._wake = None
+        self._task = None
+        self._stopping = False
+        self._flush_lock = asyncio.Lock()
+        self.flushed = 0
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    def add(self, query, params):
+        """Antrikan 1 baris (non-blocking, tanpa await)"""
+        self._pending[query].append(params)
+        self._count += 1
+        if self._wake and self._count >= self.max_batch:
+            self._wake.set()
+
+    async def flush(self):
+        """Tulis semua antrian dalam 1 transaksi (1 executemany per query)"""
+        async with self._flush_lock:
+            if not self._count:
+                return
+            batch, total = self._pending, self._count
+            self._pending, self._count = defaultdict(list), 0
+            try:
+                async with db_pool.write() as db:
+                    for query, rows in batch.items():
+                        await db.executemany(query, rows)
+                self.flushed += total
+            except BaseException as e:
+                # Termasuk CancelledError: batch sudah keluar dari _pending, jangan sampai hilang
+                logger.error(f"[WRITE-BEHIND] Flush error ({total} rows): {e!r}")
+                if self._count + total <= self.max_pending:
+                    # Balikin ke depan antrian, dicoba lagi di flush berikutnya
+                    for query, rows in batch.items():
+                        self._pending[query][:0] = rows
+                    self._count += total
+                else:
+                    self.dropped += total
+                if not isinstance(e, Exception):
+                    raise
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.max_age)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"[WRITE-BEHIND] Started (batch={self.max_batch}, age={self.max_age}s)")
+
+    async def stop(self):
+        """Matikan flusher lalu drain sisa antrian (dipanggil saat shutdown)"""
+        if self._task:
+            # Jangan cancel: biarkan flush yang sedang jalan selesai, loop keluar sendiri
+            self._stopping = True
+            self._wake.set()
+            try:
+                await self._task
+            except Exception as e:
+                logger.error(f"[WRITE-BEHIND] Flusher error: {e}")
+            self._task = None
+        await self.flush()
+        logger.info(f"[WRITE-BEHIND] Stopped (flushed={self.flushed}, dropped={self.dropped})")
+
+# Sink bersama untuk user_actions + transaction_logs
+action_sink = WriteBehindBuffer()
 
-async def log_user_action(user_id: int, action: str, details: str = "") -> bool:
-    """Log user action"""
-    try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute(
-                "INSERT INTO user_actions (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, action, details, datetime.datetime.now().isoformat())
-            )
-            await db.commit()
-        logger.info(f"[ACTION] User {user_id}: {action}")
-        return True
-    except Exception as e:
-        logger.error(f"[ACTION LOG] Error: {str(e)}")
-        return False
 # ==========================================
 # ⚙️ CONFIG MODIFIER (AUTO UPDATE PROXY)
 # ==========================================
@@ -659,17 +2322,6 @@ async def get_session(user_id: int):
     """Get user session"""
     return user_sessions.get(user_id)
 
-async def get_user_stats(user_id: int):
-    """Get statistik user"""
-    try:
-        result = await db_fetch_one(
-            "SELECT COUNT(*) FROM user_actions WHERE user_id=?",
-            (user_id,)
-        )
-        return (result[0],) if result else (0,)
-    except:
-        return (0,)
-
 # ==========================================
 # 🛠️ HELPERS (SYSTEM & WEATHER - GOD MODE UI)
 # ==========================================
@@ -809,18 +2461,27 @@ def escape_md(text):
 # 🔐 USER REGISTRATION CHECK
 # ==========================================
 
+# Status premium jarang berubah (cuma lewat /addprem), jadi aman di-cache.
+# Setiap mutasi premium_users WAJIB panggil invalidate_premium(user_id).
+premium_cache = TTLCache(maxsize=50000, ttl=600, name="premium")
+
+async def _load_premium(user_id: int) -> bool:
+    async with db_pool.read() as db:
+        async with db.execute("SELECT 1 FROM premium_users WHERE user_id=?", (user_id,)) as cur:
+            return bool(await cur.fetchone())
+
 async def is_registered(user_id: int) -> bool:
-    """Check apakah user sudah terdaftar"""
+    """Check apakah user sudah terdaftar (premium_users, lewat cache)"""
     try:
-        result = await db_fetch_one(
-            "SELECT user_id FROM premium_users WHERE user_id=?",
-            (user_id,)
-        )
-        return bool(result)
+        return await premium_cache.get_or_load(user_id, lambda: _load_premium(user_id))
     except Exception as e:
         logger.error(f"[REGISTER CHECK] Error: {str(e)}")
         return False
 
+def invalidate_premium(user_id: int):
+    """Buang status premium user dari cache (panggil setelah update premium_users)"""
+    premium_cache.invalidate(user_id)
+
 
 # ==========================================
 # 🛡️ RATE LIMITING & SESSION MANAGEMENT
@@ -865,45 +2526,176 @@ async def create_session(user_id: int) -> str:
     logger.info(f"[SESSION] Created session {session_id} for user {user_id}")
     return session_id
 
-async def get_session(user_id: int):
-    """Get user session"""
-    return user_sessions.get(user_id)
+async def get_session(user_id: int):
+    """Get user session"""
+    return user_sessions.get(user_id)
+
+async def update_session_data(user_id: int, key: str, value):
+    """Update session data"""
+    if user_id in user_sessions:
+        user_sessions[user_id]["data"][key] = value
+        user_sessions[user_id]["last_action"] = datetime.datetime.now()
+
+# ==========================================
+# 📊 ANALYTICS & LOGGING
+# ==========================================
+
+# 1 aksi = 3 statement: raw log + ringkasan user + counter per aksi.
+# Ketiganya ikut batch/transaksi yang sama, jadi ringkasan selalu sinkron.
+USER_ACTION_SQL = "INSERT INTO user_actions (user_id, action, details, timestamp) VALUES (?, ?, ?, ?)"
+USER_STATS_SQL = (
+    "INSERT INTO user_stats (user_id, total_actions, last_action) VALUES (?, 1, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET "
+    "total_actions = total_actions + 1, "
+    "last_action = MAX(COALESCE(last_action, ''), excluded.last_action)"
+)
+USER_ACTION_COUNT_SQL = (
+    "INSERT INTO user_action_counts (user_id, action, count) VALUES (?, ?, 1) "
+    "ON CONFLICT(user_id, action) DO UPDATE SET count = count + 1"
+)
+
+async def log_user_action(user_id: int, action: str, details: str = "") -> bool:
+    """Log setiap aksi user untuk analytics (diantrikan, tidak nunggu DB)"""
+    ts = datetime.datetime.now().isoformat()
+    rows = (
+        (USER_ACTION_SQL, (user_id, action, details, ts)),
+        (USER_STATS_SQL, (user_id, ts)),
+        (USER_ACTION_COUNT_SQL, (user_id, action)),
+    )
+    try:
+        if action_sink.running:
+            for query, params in rows:
+                action_sink.add(query, params)
+        else:
+            async with db_pool.write() as db:
+                for query, params in rows:
+                    await db.execute(query, params)
+        logger.info(f"[ACTION] User {user_id}: {action} - {details}")
+        return True
+    except Exception as e:
+        logger.error(f"[ACTION LOG] Error: {str(e)}")
+        return False
+
+async def get_user_stats(user_id: int):
+    """Get statistik user dari tabel ringkasan (O(1), bukan COUNT(*))"""
+    try:
+        result = await db_fetch_one(
+            "SELECT total_actions, last_action FROM user_stats WHERE user_id=?",
+            (user_id,)
+        )
+        return result if result else (0, None)
+    except Exception as e:
+        logger.error(f"[USER STATS] Error: {str(e)}")
+        return (0, None)
+
+async def backfill_user_stats(db):
+    """Bangun ulang user_stats & user_action_counts dari user_actions (+ rollup harian)"""
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='user_actions_daily'"
+    ) as cur:
+        has_rollup = bool(await cur.fetchone())
+
+    # Data yang sudah di-rollup (retention) tetap ikut dihitung
+    source = "SELECT user_id, action, 1 AS n, timestamp AS ts FROM user_actions"
+    if has_rollup:
+        source += " UNION ALL SELECT user_id, action, count, day FROM user_actions_daily"
+
+    await db.execute("DELETE FROM user_stats")
+    await db.execute("DELETE FROM user_action_counts")
+    await db.execute(
+        "INSERT INTO user_stats (user_id, total_actions, last_action) "
+        f"SELECT user_id, SUM(n), MAX(ts) FROM ({source}) GROUP BY user_id"
+    )
+    await db.execute(
+        "INSERT INTO user_action_counts (user_id, action, count) "
+        f"SELECT user_id, action, SUM(n) FROM ({source}) GROUP BY user_id, action"
+    )
+
+# ==========================================
+# 🧹 USER ACTIONS RETENTION (ROLLUP + ARCHIVE + PRUNE)
+# ==========================================
+
+ACTION_RETENTION_DAYS = cfg("ACTION_RETENTION_DAYS", 30)          # raw log disimpan N hari
+ACTION_ROLLUP_RETENTION_DAYS = cfg("ACTION_ROLLUP_RETENTION_DAYS", 730)  # 0 = simpan selamanya
+ACTION_ARCHIVE_DIR = cfg("ACTION_ARCHIVE_DIR", "archive")
+ACTION_PRUNE_CHUNK = cfg("ACTION_PRUNE_CHUNK", 5000)               # baris per transaksi
+ACTION_VACUUM_PAGES = cfg("ACTION_VACUUM_PAGES", 5000)
+
+def _append_jsonl_gz(path, rows):
+    """Tulis baris ke arsip .jsonl.gz (append = gzip multi-member, tetap valid)"""
+    with gzip.open(path, "at", encoding="utf-8") as f:
+        for _id, user_id, action, details, ts in rows:
+            f.write(json.dumps({
+                "id": _id, "user_id": user_id, "action": action,
+                "details": details, "timestamp": ts,
+            }, ensure_ascii=False) + "\n")
+
+async def prune_user_actions(retention_days=None, chunk=None):
+    """Rollup → arsip → hapus raw user_actions yang lebih tua dari retensi, per chunk"""
+    retention_days = ACTION_RETENTION_DAYS if retention_days is None else retention_days
+    chunk = chunk or ACTION_PRUNE_CHUNK
+    # Cutoff berupa tanggal saja: aman untuk format isoformat ('T') maupun CURRENT_TIMESTAMP (' ')
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=retention_days)).strftime("%Y-%m-%d")
+
+    os.makedirs(ACTION_ARCHIVE_DIR, exist_ok=True)
+    archive_path = os.path.join(
+        ACTION_ARCHIVE_DIR, f"user_actions_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl.gz"
+    )
+    last_id, total = 0, 0
+
+    while True:
+        # 1. Baca 1 chunk lewat reader (writer tidak terkunci)
+        rows = await db_fetch_all(
+            "SELECT id, user_id, action, details, timestamp FROM user_actions "
+            "WHERE id > ? AND timestamp < ? ORDER BY id LIMIT ?",
+            (last_id, cutoff, chunk)
+        )
+        if not rows:
+            break
+        first_id, last_id = rows[0][0], rows[-1][0]
+
+        # 2. Arsip dulu; kalau crash sebelum delete, paling cuma dobel di arsip
+        await run_blocking("cpu", _append_jsonl_gz, archive_path, rows)
+
+        # 3. Rollup + delete dalam 1 transaksi pendek
+        async with db_pool.write() as db:
+            await db.execute(
+                "INSERT INTO user_actions_daily (day, user_id, action, count) "
+                "SELECT substr(timestamp, 1, 10), user_id, action, COUNT(*) FROM user_actions "
+                "WHERE id BETWEEN ? AND ? AND timestamp < ? GROUP BY 1, 2, 3 "
+                "ON CONFLICT(day, user_id, action) DO UPDATE SET count = count + excluded.count",
+                (first_id, last_id, cutoff)
+            )
+            await db.execute(
+                "DELETE FROM user_actions WHERE id BETWEEN ? AND ? AND timestamp < ?",
+                (first_id, last_id, cutoff)
+            )
+        total += len(rows)
+        await asyncio.sleep(0.05)  # kasih napas ke writer lain
 
-async def update_session_data(user_id: int, key: str, value):
-    """Update session data"""
-    if user_id in user_sessions:
-        user_sessions[user_id]["data"][key] = value
-        user_sessions[user_id]["last_action"] = datetime.datetime.now()
+    if ACTION_ROLLUP_RETENTION_DAYS:
+        rollup_cutoff = (
+            datetime.datetime.now() - datetime.timedelta(days=ACTION_ROLLUP_RETENTION_DAYS)
+        ).strftime("%Y-%m-%d")
+        await db_execute("DELETE FROM user_actions_daily WHERE day < ?", (rollup_cutoff,))
 
-# ==========================================
-# 📊 ANALYTICS & LOGGING
-# ==========================================
+    return total, (archive_path if total else None)
 
-async def log_user_action(user_id: int, action: str, details: str = "") -> bool:
-    """Log setiap aksi user untuk analytics"""
+async def action_retention_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job harian: retensi user_actions lalu incremental vacuum"""
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            await db.execute("""
-                INSERT INTO user_actions (user_id, action, details, timestamp)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, action, details, datetime.datetime.now().isoformat()))
-            await db.commit()
-        logger.info(f"[ACTION] User {user_id}: {action} - {details}")
-        return True
+        start_t = time.time()
+        await action_sink.flush()
+        total, archive_path = await prune_user_actions()
+        # execute() cuma step statement sekali (= 1 halaman); executescript jalan sampai selesai
+        async with db_pool.write() as db:
+            await db.executescript(f"PRAGMA incremental_vacuum({int(ACTION_VACUUM_PAGES)});")
+        logger.info(
+            f"[RETENTION] Pruned {total} user_actions rows in {time.time() - start_t:.1f}s"
+            + (f" → {archive_path}" if archive_path else "")
+        )
     except Exception as e:
-        logger.error(f"[ACTION LOG] Error: {str(e)}")
-        return False
-
-async def get_user_stats(user_id: int):
-    """Get statistik user"""
-    result = await db_fetch_one("""
-        SELECT 
-            COUNT(*) as total_actions,
-            MAX(timestamp) as last_action
-        FROM user_actions 
-        WHERE user_id=?
-    """, (user_id,))
-    return result
+        logger.error(f"[RETENTION] Error: {e}")
 
 # ==========================================
 # 🔐 PERMISSION DECORATORS
@@ -1161,6 +2953,20 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         total_revenue = await get_total_revenue_all_time()  # ✅ GANTI INI
         pending_orders = await get_pending_orders_count()
         stock_data = await get_all_stock()
+        prem_stats = premium_cache.stats()
+        media_stats = await get_media_cache_summary()
+        http_stats = response_cache.stats()
+        dedup_text = single_flight_summary()
+        dl_stats = download_scheduler.stats()
+        sc = await run_blocking("io", scratch_space.report)
+        spotify_text = " | ".join(
+            f"{st['name']} {st['hit_ratio']:.0%} ({st['size']} keys)"
+            for st in (c.stats() for c in (spotify_search_cache, spotify_track_cache))
+        )
+        executor_text = " | ".join(
+            f"{st['name']} {st['running']}/{st['workers']} run, {st['queued']} q (peak {st['peak_queued']})"
+            for st in (ex.stats() for ex in EXECUTORS.values())
+        )
         
         # Format stock
         stock_text = ""
@@ -1175,6 +2981,23 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             f"💰 <b>Total Revenue:</b> Rp {total_revenue:,.0f}\n"  # ✅ GANTI INI
             f"📦 <b>Pending Orders:</b> {pending_orders}\n\n"
             f"<b>📈 Current Stock:</b>\n{stock_text or '  (No data)'}\n\n"
+            f"🧠 <b>Access Cache:</b> {prem_stats['hits']} hit / {prem_stats['misses']} miss "
+            f"({prem_stats['hit_ratio']:.0%}, {prem_stats['size']} keys)\n"
+            f"🎞️ <b>Media Cache:</b> {media_stats['rows']} files, hit ratio {media_stats['hit_ratio']:.0%} "
+            f"({media_stats['hits']}/{media_stats['hits'] + media_stats['misses']}), "
+            f"{media_stats['invalidated']} stale dropped\n"
+            f"🌐 <b>HTTP Cache:</b> {http_stats['hits']} fresh / {http_stats['stale_hits']} stale / "
+            f"{http_stats['misses']} miss ({http_stats['hit_ratio']:.0%}, {http_stats['size']} keys, "
+            f"{http_stats['bytes'] / 1024:.0f} KB)\n"
+            f"🔀 <b>Dedup (saved/calls):</b> {dedup_text}\n"
+            f"🎧 <b>Spotify Cache:</b> {spotify_text}\n"
+            f"🧵 <b>Executors:</b> {executor_text}\n"
+            f"📥 <b>DL Queue:</b> {dl_stats['running']} running, {dl_stats['queued']} queued, "
+            f"{dl_stats['completed']} done, {dl_stats['cancelled']} cancelled, avg wait {dl_stats['avg_wait']:.1f}s\n"
+            f"🧹 <b>Scratch ({sc['fs']}):</b> {sc['used'] / 1048576:.1f} MB on disk, "
+            f"{sc['reserved'] // 1048576}/{sc['quota'] // 1048576} MB reserved, {sc['active']} job(s), "
+            f"{sc['free'] / 1024**3:.1f} GB free, {sc['waits']} waits / {sc['rejected']} rejected, "
+            f"swept {sc['swept_dirs']} ({sc['swept_bytes'] / 1048576:.0f} MB)\n"
             f"🕐 <b>Last Updated:</b> {datetime.datetime.now(TZ).strftime('%d/%m/%Y %H:%M:%S')}"
         )
         
@@ -1199,17 +3022,74 @@ async def admin_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE
             parse_mode=ParseMode.HTML
         )
         
-async def get_user_stats(user_id: int):
-    """Get statistik user"""
+@require_owner
+async def backfill_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """One-shot: hitung ulang tabel user_stats dari data user_actions"""
+    msg = await update.message.reply_text("⏳ <b>Rebuilding user stats...</b>", parse_mode=ParseMode.HTML)
     try:
-        result = await db_fetch_one(
-            "SELECT COUNT(*) FROM user_actions WHERE user_id=?",
-            (user_id,)
+        await action_sink.flush()  # pastikan log yang masih antri ikut terhitung
+        start_t = time.time()
+        async with db_pool.write() as db:
+            await backfill_user_stats(db)
+        users = await db_fetch_one("SELECT COUNT(*), COALESCE(SUM(total_actions), 0) FROM user_stats")
+        await msg.edit_text(
+            f"✅ <b>USER STATS REBUILT</b>\n"
+            f"━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
+            f"👥 <b>Users:</b> {users[0]}\n"
+            f"📊 <b>Actions:</b> {users[1]}\n"
+            f"⏱️ <b>Took:</b> {time.time() - start_t:.2f}s",
+            parse_mode=ParseMode.HTML
         )
-        return (result[0],) if result else (0,)
     except Exception as e:
-        logger.error(f"[USER STATS] Error: {str(e)}")
-        return (0,)
+        logger.error(f"[BACKFILL STATS] Error: {str(e)}")
+        await msg.edit_text(f"❌ Backfill failed: {html.escape(str(e)[:80])}", parse_mode=ParseMode.HTML)
+
+@require_owner
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/perf [N] — handler paling lambat + stall event loop terburuk; /perf selftest — cek loop tidak stall"""
+    if context.args and context.args[0].lower() == "selftest":
+        ok, worst = await loop_stall_selftest()
+        await update.message.reply_text(
+            f"{'✅' if ok else '❌'} <b>Loop self-test:</b> max lag {worst * 1000:.0f}ms "
+            f"(limit {LOOP_STALL_THRESHOLD * 1000:.0f}ms) selama simulasi download "
+            f"{LOOP_SELFTEST_SECONDS:g}s di executor io/cpu/subprocess",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    top_n = int(context.args[0]) if context.args and context.args[0].isdigit() else 10
+    lag = loop_monitor.stats()
+
+    rows = sorted(handler_stats.values(), key=lambda h: h.percentile(0.95), reverse=True)
+    rows = [h for h in rows if h.count][:top_n]
+    lines = [
+        f"{h.name[:28]:<28} n={h.count:<5} avg={h.total / h.count:6.2f}s "
+        f"p95≤{h.percentile(0.95):6.2f}s max={h.max:6.2f}s err={h.errors}"
+        for h in rows
+    ]
+    proc_lines = [
+        f"{tool:<12} run={st['running']} ok={st['completed']} fail={st['failed']} timeout={st['timeouts']}"
+        for tool, st in process_runner.stats().items()
+    ]
+    text = (
+        f"🩺 PERF REPORT\n"
+        f"Loop lag: now {lag['current'] * 1000:.0f}ms, p99 {lag['p99'] * 1000:.0f}ms, "
+        f"max {lag['max'] * 1000:.0f}ms, stalls {lag['stalls']}\n\n"
+        f"TOP {top_n} SLOWEST HANDLERS (by p95)\n" + ("\n".join(lines) or "(no data)") + "\n\n"
+        "PROCESSES\n" + ("\n".join(proc_lines) or "(none)") + "\n\n"
+        "WORST LOOP STALLS\n"
+    )
+    for dur, when, stack in loop_monitor.worst[:top_n]:
+        text += f"--- {dur * 1000:.0f}ms @ {when}\n{stack}\n"
+    if not loop_monitor.worst:
+        text += "(none)\n"
+
+    if len(text) <= 3800:
+        await update.message.reply_text(f"<pre>{html.escape(text)}</pre>", parse_mode=ParseMode.HTML)
+    else:
+        with io.BytesIO(text.encode()) as f:
+            f.name = "perf_report.txt"
+            await update.message.reply_document(document=f, caption="🩺 <b>Perf report</b>", parse_mode=ParseMode.HTML)
 
 # ==========================================
 # 🕹️ MENU COMMAND — PREMIUM AESTHETIC HUB (UPGRADED)
@@ -1405,11 +3285,9 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if user_id == OWNER_ID:
         is_allowed = True
     else:
-        # 2. Cek apakah dia Premium User di Database?
-        async with aiosqlite.connect(DB_NAME) as db:
-            async with db.execute("SELECT user_id FROM premium_users WHERE user_id = ?", (user_id,)) as cursor:
-                if await cursor.fetchone():
-                    is_allowed = True
+        # 2. Cek apakah dia Premium User di Database? (lewat cache)
+        if await is_registered(user_id):
+            is_allowed = True
 
     # Jika BUKAN Owner dan BUKAN Premium, tolak!
     if not is_allowed:
@@ -1497,6 +3375,210 @@ async def gen_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.delete()
         os.remove(filename)
 
+# ==========================================
+# ⏳ DOWNLOAD QUEUE (FAIR SCHEDULER + PRIORITY LANE)
+# ==========================================
+
+DL_WORKERS = cfg("DL_WORKERS", 3)                # download paralel maksimal (global)
+DL_PER_USER_RUNNING = cfg("DL_PER_USER_RUNNING", 1)
+DL_PER_USER_QUEUED = cfg("DL_PER_USER_QUEUED", 3)
+DL_PREMIUM_BURST = 3                             # tiap 3 job premium, 1 slot buat lane biasa (anti starvation)
+
+class DownloadQueueFull(Exception):
+    """User sudah punya terlalu banyak job di antrean"""
+
+class DownloadCancelled(Exception):
+    """Job dibatalkan user lewat tombol Cancel"""
+
+class DownloadJob:
+    def __init__(self, job_id, user_id, premium, on_position):
+        self.id = job_id
+        self.user_id = user_id
+        self.premium = premium
+        self.on_position = on_position
+        self.task = asyncio.current_task()
+        self.grant = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.position = None
+        self.cancelled = False  # dibatalkan user (bukan shutdown)
+
+class DownloadScheduler:
+    """
+    Slot download terbatas: antrean per user (round-robin antar user), lane premium diprioritaskan,
+    batas job jalan/antre per user. Handler pakai: async with download_scheduler.slot(...) as job.
+    """
+
+    def __init__(self, workers, per_user_running, per_user_queued):
+        self.workers = workers
+        self.per_user_running = per_user_running
+        self.per_user_queued = per_user_queued
+        self.lanes = {True: OrderedDict(), False: OrderedDict()}  # premium? -> user_id -> deque[job]
+        self.jobs = {}             # job_id -> job (antre + jalan)
+        self.running = {}          # job_id -> job
+        self.user_running = defaultdict(int)
+        self._premium_streak = 0
+        self._seq = 0
+        self.submitted = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+
+    def queued_count(self, user_id=None):
+        return sum(
+            len(jobs) for lane in self.lanes.values()
+            for uid, jobs in lane.items() if user_id is None or uid == user_id
+        )
+
+    def _lane_order(self, premium):
+        """Urutan antre di 1 lane kalau diambil round-robin per user"""
+        lanes = [list(jobs) for jobs in self.lanes[premium].values()]
+        order = []
+        for i in range(max((len(j) for j in lanes), default=0)):
+            order.extend(j[i] for j in lanes if i < len(j))
+        return order
+
+    def _pick(self):
+        lanes = [True, False]
+        if self._premium_streak >= DL_PREMIUM_BURST:
+            lanes = [False, True]
+        for premium in lanes:
+            lane = self.lanes[premium]
+            for user_id in list(lane):
+                if self.user_running[user_id] >= self.per_user_running:
+                    continue
+                jobs = lane.pop(user_id)
+                job = jobs.popleft()
+                if jobs:
+                    lane[user_id] = jobs  # user pindah ke belakang → round-robin
+                self._premium_streak = self._premium_streak + 1 if premium else 0
+                return job
+        return None
+
+    def _dispatch(self):
+        while len(self.running) < self.workers:
+            job = self._pick()
+            if job is None:
+                break
+            self.running[job.id] = job
+            self.user_running[job.user_id] += 1
+            self.wait_total += time.monotonic() - job.enqueued_at
+            if not job.grant.done():
+                job.grant.set_result(True)
+        self._notify_positions()
+
+    def _notify_positions(self):
+        waiting = self._lane_order(True) + self._lane_order(False)
+        for pos, job in enumerate(waiting, start=1):
+            if job.position != pos:
+                job.position = pos
+                if job.on_position:
+                    asyncio.create_task(self._safe_notify(job, pos))
+
+    @staticmethod
+    async def _safe_notify(job, pos):
+        try:
+            await job.on_position(job, pos)
+        except Exception as e:
+            logger.debug(f"[DL QUEUE] Position update error: {e}")
+
+    def _remove_waiting(self, job):
+        lane = self.lanes[job.premium]
+        jobs = lane.get(job.user_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del lane[job.user_id]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id, premium=False, on_position=None):
+        if self.queued_count(user_id) >= self.per_user_queued:
+            self.rejected += 1
+            raise DownloadQueueFull(f"max {self.per_user_queued} link di antrean")
+
+        self._seq += 1
+        job = DownloadJob(f"{self._seq:x}", user_id, premium, on_position)
+        self.jobs[job.id] = job
+        self.lanes[premium].setdefault(user_id, deque()).append(job)
+        self.submitted += 1
+        try:
+            self._dispatch()
+            try:
+                await job.grant
+            except asyncio.CancelledError:
+                self._remove_waiting(job)
+                self._raise_if_user_cancel(job)
+                raise
+            try:
+                yield job
+            except asyncio.CancelledError:
+                self._raise_if_user_cancel(job)
+                raise
+            else:
+                self.completed += 1
+        finally:
+            # Lepas slot kalau sudah di-grant — termasuk cancel yang datang setelah _dispatch()
+            # memberi slot tapi sebelum task sempat bangun dari `await job.grant`
+            if self.running.pop(job.id, None) is not None:
+                self.user_running[job.user_id] -= 1
+                if self.user_running[job.user_id] <= 0:
+                    del self.user_running[job.user_id]
+            self.jobs.pop(job.id, None)
+            self._dispatch()
+
+    def _raise_if_user_cancel(self, job):
+        """CancelledError dari tombol Cancel → DownloadCancelled biasa (shutdown tetap CancelledError)"""
+        if not job.cancelled:
+            return
+        self.cancelled += 1
+        if hasattr(job.task, "uncancel"):
+            job.task.uncancel()
+        raise DownloadCancelled() from None
+
+    def cancel(self, job_id, user_id):
+        """Batalkan job milik user (yang antre maupun yang jalan)"""
+        job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return False
+        job.cancelled = True
+        if job.task is not None:
+            job.task.cancel()
+        return True
+
+    def stats(self):
+        started = self.completed + len(self.running)
+        return {
+            "running": len(self.running),
+            "queued": self.queued_count(),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "rejected": self.rejected,
+            "avg_wait": (self.wait_total / started) if started else 0.0,
+        }
+
+download_scheduler = DownloadScheduler(DL_WORKERS, DL_PER_USER_RUNNING, DL_PER_USER_QUEUED)
+
+def dl_abort_hook(job):
+    """Progress hook yt-dlp: thread download ikut berhenti kalau job di-cancel"""
+    def hook(_):
+        if job.cancelled:
+            raise yt_dlp.utils.DownloadCancelled("cancelled by user")
+    return hook
+
+def dl_cancel_markup(job):
+    """Tombol ❌ Cancel yang menempel di pesan status selama job antre & jalan"""
+    return InlineKeyboardMarkup([[InlineKeyboardButton("❌ Cancel", callback_data=f"dl_cancel|{job.id}")]])
+
+async def dl_cancel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tombol ❌ Cancel di pesan status /dl"""
+    q = update.callback_query
+    job_id = q.data.split("|", 1)[1]
+    if download_scheduler.cancel(job_id, q.from_user.id):
+        await q.answer("🛑 Download dibatalkan")
+    else:
+        await q.answer("⚠️ Job sudah selesai / bukan milikmu", show_alert=True)
+
 # ==========================================
 # 📥 DOWNLOADER (/dl) - TIKTOK API + YT-DLP
 # ==========================================
@@ -1513,26 +3595,563 @@ ERROR_MESSAGES = {
     "Restricted": "🔐 Content restricted in your region"
 }
 
-async def download_tiktok_audio(audio_url: str) -> str:
-    """Download TikTok audio dengan retry"""
+probe_flight = SingleFlight("probe")
+
+async def probe_tiktok(url):
+    """Metadata TikTok via tikwm, link sama yang masuk barengan cuma 1 request"""
+    async def load():
+        async with http_session("media", timeout=15.0) as client:
+            r = await client.get(f"https://www.tikwm.com/api/?url={url}")
+            return r.json()
+    return await probe_flight.do(("tikwm", canonical_media_key(url)), load)
+
+# Opsi ekstraksi yt-dlp /dl — probe & download harus sama supaya hasil probe bisa dipakai ulang
+DL_YTDLP_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "noplaylist": True,
+    "socket_timeout": 30,
+    "http_headers": {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    },
+    "nocheckcertificate": True,
+    "ignoreerrors": False,
+    "geo_bypass": True,
+    "geo_bypass_country": "US",
+    "extractor_retries": 3,
+}
+
+# Hasil probe per video id, dipakai lagi oleh fase download (URL format YouTube berlaku berjam-jam)
+media_info_cache = TTLCache(500, 600, "ytdlp-info")
+
+async def probe_media_info(url, ydl_opts=None):
+    """yt-dlp extract_info(download=False), di-cache per canonical id; link sama barengan cuma 1 probe"""
+    def extract():
+        with yt_dlp.YoutubeDL(ydl_opts or DL_YTDLP_OPTS) as ydl:
+            return ydl.extract_info(url, download=False)
+    return await media_info_cache.get_or_load(
+        canonical_media_key(url),
+        lambda: run_blocking("io", extract),
+    )
+
+STREAM_CHUNK = 64 * 1024
+TELEGRAM_UPLOAD_LIMIT = 50 * 1024 * 1024  # batas upload bot API
+
+# ==========================================
+# 🧹 SCRATCH SPACE (temp media)
+# ==========================================
+# Semua file sementara (download, remix, gallery, tts) di bawah satu root, bukan CWD.
+# Bisa diarahkan ke tmpfs (mis. /dev/shm/oktacomel) lewat config SCRATCH_DIR.
+SCRATCH_DIR = cfg("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "oktacomel"))
+SCRATCH_QUOTA_BYTES = cfg("SCRATCH_QUOTA_MB", 2048) * 1024 * 1024   # total reservasi job aktif
+SCRATCH_WAIT_TIMEOUT = cfg("SCRATCH_WAIT_TIMEOUT", 120)             # detik antre kuota sebelum menyerah
+SCRATCH_STALE_AFTER = cfg("SCRATCH_STALE_AFTER", 3 * 3600)           # dir job lebih tua dari ini = yatim
+SCRATCH_SWEEP_INTERVAL = 900
+SCRATCH_DL_WAIT = 10  # /dl (+ audio TikTok) antre kuota di dalam slot scheduler → jangan tahan slot lama-lama
+SCRATCH_JOB_RE = re.compile(r"^(?P<prefix>[a-z]+)_(?P<pid>\d+)_[\w-]+$")
+SCRATCH_LEGACY_RE = re.compile(r"^(dl|music|remix|gallery)_[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+class ScratchQuotaError(Exception):
+    """Kuota scratch penuh terlalu lama"""
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            with contextlib.suppress(OSError):
+                total += os.lstat(os.path.join(root, name)).st_size
+    return total
+
+def _pid_alive(pid):
     try:
-        temp_file = f"tiktok_audio_{uuid.uuid4()}.mp3"
-        
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+class ScratchSpace:
+    """
+    Dir kerja per job dengan kuota byte global: job baru menunggu kalau reservasi penuh,
+    dir SELALU dihapus saat keluar blok, sweeper membersihkan sisa crash (pid mati / kadaluarsa).
+    """
+
+    def __init__(self, root, quota_bytes, wait_timeout, stale_after):
+        self.root = os.path.abspath(root)
+        self.quota = quota_bytes
+        self.wait_timeout = wait_timeout
+        self.stale_after = stale_after
+        self.reserved = 0
+        self.active = {}
+        self._cond = asyncio.Condition()
+        self.jobs_total = 0
+        self.waits = 0
+        self.rejected = 0
+        self.peak_reserved = 0
+        self.swept_dirs = 0
+        self.swept_bytes = 0
+
+    async def _reserve(self, nbytes, wait_timeout):
+        async with self._cond:
+            if self.reserved + nbytes > self.quota:
+                self.waits += 1
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self.reserved + nbytes <= self.quota),
+                        wait_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.rejected += 1
+                    raise ScratchQuotaError(f"scratch penuh ({self.reserved // 1048576} MB dipakai)")
+            self.reserved += nbytes
+            self.peak_reserved = max(self.peak_reserved, self.reserved)
+
+    async def _release(self, nbytes):
+        async with self._cond:
+            self.reserved -= nbytes
+            self._cond.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def job(self, prefix, reserve=TELEGRAM_UPLOAD_LIMIT, wait_timeout=None):
+        """async with scratch_space.job("dl") as temp_dir: ... (absolute path)"""
+        reserve = min(reserve, self.quota)
+        await self._reserve(reserve, self.wait_timeout if wait_timeout is None else wait_timeout)
+        path = None
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            path = tempfile.mkdtemp(prefix=f"{prefix}_{os.getpid()}_", dir=self.root)
+            self.active[path] = reserve
+            self.jobs_total += 1
+            yield path
+        finally:
+            try:
+                if path:
+                    self.active.pop(path, None)
+                    await asyncio.shield(run_blocking("io", shutil.rmtree, path, True))
+            finally:
+                await self._release(reserve)
+
+    def sweep(self, startup=False):
+        """
+        Hapus dir job yatim (blocking, jalankan di executor io).
+        Startup: semua dir milik pid lain yang sudah mati + dir lama versi CWD.
+        Periodik: dir yang tidak aktif dan lebih tua dari stale_after.
+        """
+        removed, freed = 0, 0
+        now = time.time()
+        targets = []
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                m = SCRATCH_JOB_RE.match(entry.name)
+                if entry.path in self.active or not m:
+                    continue
+                try:
+                    age = now - entry.stat(follow_symlinks=False).st_mtime
+                except OSError:
+                    continue
+                pid = int(m.group("pid"))
+                dead = pid != os.getpid() and not _pid_alive(pid)
+                if (startup and dead) or age > self.stale_after:
+                    targets.append(entry.path)
+        if startup:
+            # Sisa versi lama yang nulis ke CWD
+            for entry in os.scandir("."):
+                if entry.is_dir(follow_symlinks=False) and SCRATCH_LEGACY_RE.match(entry.name):
+                    targets.append(entry.path)
+        for path in targets:
+            size = _dir_size(path) if os.path.isdir(path) else 0
+            try:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"[SCRATCH] Sweep failed {path}: {e}")
+                continue
+            removed += 1
+            freed += size
+        self.swept_dirs += removed
+        self.swept_bytes += freed
+        if removed:
+            logger.info(f"[SCRATCH] Swept {removed} orphan dir(s), {freed / 1048576:.1f} MB")
+        return removed, freed
+
+    async def start(self):
+        os.makedirs(self.root, exist_ok=True)
+        await run_blocking("io", self.sweep, True)
+
+    def fs_type(self):
+        """Tipe filesystem root (tmpfs/ext4/...) buat dashboard"""
+        best, fstype = "", "?"
+        try:
+            for part in psutil.disk_partitions(all=True):
+                mp = part.mountpoint
+                if self.root.startswith(mp) and len(mp) > len(best):
+                    best, fstype = mp, part.fstype
+        except Exception:
+            pass
+        return fstype
+
+    def usage(self):
+        """Byte yang benar-benar terpakai di root (blocking kecil: walk dir)"""
+        return _dir_size(self.root) if os.path.isdir(self.root) else 0
+
+    def report(self):
+        """stats() + pemakaian disk nyata, tipe fs & sisa ruang (blocking: jalankan di executor io)"""
+        free = shutil.disk_usage(self.root).free if os.path.isdir(self.root) else 0
+        return {**self.stats(), "used": self.usage(), "free": free, "fs": self.fs_type()}
+
+    def stats(self):
+        return {
+            "root": self.root,
+            "active": len(self.active),
+            "reserved": self.reserved,
+            "quota": self.quota,
+            "peak_reserved": self.peak_reserved,
+            "jobs_total": self.jobs_total,
+            "waits": self.waits,
+            "rejected": self.rejected,
+            "swept_dirs": self.swept_dirs,
+            "swept_bytes": self.swept_bytes,
         }
-        
-        async with httpx.AsyncClient(headers=headers, timeout=30.0) as client:
-            response = await client.get(audio_url)
-            if response.status_code == 200:
-                with open(temp_file, 'wb') as f:
-                    f.write(response.content)
-                return temp_file
-        return None
+
+scratch_space = ScratchSpace(SCRATCH_DIR, SCRATCH_QUOTA_BYTES, SCRATCH_WAIT_TIMEOUT, SCRATCH_STALE_AFTER)
+
+async def scratch_sweep_job(context: ContextTypes.DEFAULT_TYPE):
+    """Job periodik: bersihkan dir scratch yatim"""
+    try:
+        await run_blocking("io", scratch_space.sweep)
     except Exception as e:
-        logger.error(f"[TIKTOK AUDIO] Error: {e}")
+        logger.error(f"[SCRATCH] Sweep error: {e}")
+
+# ==========================================
+# 🎯 FORMAT PLANNER (/dl)
+# ==========================================
+DL_DEFAULT_FORMAT = "best[ext=mp4]/best[ext=mkv]/best[height<=720]/best"
+DL_MAX_HEIGHT = 1080
+DL_SIZE_HEADROOM = 0.92  # estimasi bitrate × durasi bisa meleset, sisakan ruang
+DL_NATIVE_VCODECS = ("avc1", "avc3", "h264")
+DL_NATIVE_ACODECS = ("mp4a", "aac")
+DL_VIDEO_EXTS = ("mp4", "mkv", "mov", "webm", "avi", "flv")
+
+def _codec(fmt, key):
+    c = fmt.get(key)
+    return None if c in (None, "none") else c.lower()
+
+def estimate_format_size(fmt, duration):
+    """Byte: filesize dari extractor, kalau tidak ada → bitrate (kbit/s) × durasi"""
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    if size:
+        return int(size)
+    tbr = fmt.get("tbr") or ((fmt.get("vbr") or 0) + (fmt.get("abr") or 0))
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return None
+
+def plan_download_format(info, limit=TELEGRAM_UPLOAD_LIMIT):
+    """
+    Pilih stream terbaik yang muat di batas upload Telegram SEBELUM download.
+    Urutan: H.264/AAC (MP4, bisa diputar langsung) > resolusi tertinggi > ukuran terkecil.
+    Return dict {format, size, height, native, merge} | {"format": None, "size": terkecil}
+    kalau semua kandidat pasti kebesaran | None kalau tidak bisa direncanakan (playlist/tanpa list format).
+    """
+    formats = info.get("formats") if info else None
+    if not formats or info.get("entries"):
+        return None
+
+    duration = info.get("duration") or 0
+    budget = limit * DL_SIZE_HEADROOM
+    can_merge = shutil.which("ffmpeg") is not None
+    muxed, videos, audios = [], [], []
+
+    for f in formats:
+        if not f.get("format_id") or (f.get("height") or 0) > DL_MAX_HEIGHT:
+            continue
+        v, a = _codec(f, "vcodec"), _codec(f, "acodec")
+        if f.get("vcodec") == "none" and f.get("acodec") == "none":
+            continue  # storyboard / thumbnail
+        if v and a or (v is None and a is None):
+            muxed.append(f)
+        elif v:
+            videos.append(f)
+        else:
+            audios.append(f)
+
+    def is_native(f):
+        v, a = _codec(f, "vcodec"), _codec(f, "acodec")
+        if v is None and a is None:
+            return f.get("ext") == "mp4"  # progressive tanpa info codec
+        return bool(v and v.startswith(DL_NATIVE_VCODECS)) and bool(a and a.startswith(DL_NATIVE_ACODECS))
+
+    candidates = []
+    for f in muxed:
+        candidates.append({
+            "format": f["format_id"],
+            "size": estimate_format_size(f, duration),
+            "height": f.get("height") or 0,
+            "native": is_native(f),
+            "merge": False,
+        })
+
+    if can_merge and videos and audios:
+        def audio_key(a):
+            return a.get("abr") or a.get("tbr") or 0
+        native_audio = [a for a in audios if (_codec(a, "acodec") or "").startswith(DL_NATIVE_ACODECS)]
+        best_native_audio = max(native_audio, key=audio_key) if native_audio else None
+        best_audio = max(audios, key=audio_key)
+        for v in videos:
+            native_v = (_codec(v, "vcodec") or "").startswith(DL_NATIVE_VCODECS)
+            a = best_native_audio if native_v and best_native_audio else best_audio
+            v_size, a_size = estimate_format_size(v, duration), estimate_format_size(a, duration)
+            candidates.append({
+                "format": f"{v['format_id']}+{a['format_id']}",
+                "size": v_size + a_size if v_size and a_size else None,
+                "height": v.get("height") or 0,
+                "native": native_v and a is best_native_audio,
+                "merge": True,
+            })
+
+    if not candidates:
         return None
 
+    fitting = [c for c in candidates if c["size"] is not None and c["size"] <= budget]
+    if fitting:
+        return max(fitting, key=lambda c: (c["native"], c["height"], -c["size"]))
+
+    unknown = [c for c in candidates if c["size"] is None]
+    if unknown:
+        # Ukuran tidak diketahui: ambil yang terbaik (native, resolusi tertinggi), dicek lagi setelah download
+        return max(unknown, key=lambda c: (c["native"], c["height"]))
+
+    return {"format": None, "size": min(c["size"] for c in candidates)}
+
+async def remux_for_telegram(path):
+    """Ganti container ke MP4 + faststart tanpa re-encode (-c copy); gagal → file asli"""
+    if path.lower().endswith(".mp4") or not shutil.which("ffmpeg"):
+        return path
+    out = os.path.splitext(path)[0] + ".tg.mp4"
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-i", path,
+        "-map", "0:v:0", "-map", "0:a:0?", "-c", "copy", "-movflags", "+faststart", out,
+    ]
+    try:
+        result = await process_runner.run(cmd)
+    except ProcessTimeoutError as e:
+        logger.warning(f"[DL] Remux timeout: {e}")
+        result = None
+    if result is not None and result.ok and os.path.exists(out) and os.path.getsize(out) > 0:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+        return out
+    with contextlib.suppress(OSError):
+        os.remove(out)
+    return path
+
+# ==========================================
+# 📤 UPLOAD STAGE (/dl)
+# ==========================================
+DL_UPLOAD_CONCURRENCY = 3          # request upload paralel per /dl
+DL_PROGRESS_INTERVAL = 2.0         # jarak minimal edit status (flood limit)
+TELEGRAM_PHOTO_LIMIT = 10 * 1024 * 1024
+TELEGRAM_ALBUM_MAX = 10
+DL_AUDIO_EXTS = ("mp3", "m4a", "wav", "aac", "flac")
+DL_PHOTO_EXTS = ("jpg", "jpeg", "png", "webp")
+
+def classify_upload(path):
+    """'video' | 'photo' | 'audio' | 'animation' | 'document'"""
+    ext = path.rsplit(".", 1)[-1].lower()
+    if ext in DL_VIDEO_EXTS:
+        return "video"
+    if ext in DL_PHOTO_EXTS:
+        return "photo" if os.path.getsize(path) <= TELEGRAM_PHOTO_LIMIT else "document"
+    if ext in DL_AUDIO_EXTS:
+        return "audio"
+    if ext == "gif":
+        return "animation"
+    return "document"
+
+def plan_upload_batches(items):
+    """
+    Susun item (path, kind, size) jadi unit kirim berurutan:
+    foto/video → album maks 10 item & total ≤ batas upload, audio → album audio, sisanya satu-satu.
+    """
+    batches, current = [], {"visual": [], "audio": []}
+    used = {"visual": 0, "audio": 0}
+
+    def flush(group):
+        if current[group]:
+            batches.append(current[group])
+        current[group], used[group] = [], 0
+
+    for item in items:
+        _, kind, size = item
+        group = "visual" if kind in ("photo", "video") else "audio" if kind == "audio" else None
+        if group is None:
+            batches.append([item])
+            continue
+        if len(current[group]) >= TELEGRAM_ALBUM_MAX or used[group] + size > TELEGRAM_UPLOAD_LIMIT:
+            flush(group)
+        current[group].append(item)
+        used[group] += size
+    flush("visual")
+    flush("audio")
+    return batches
+
+class UploadProgress:
+    """Progress byte untuk status message; di-update tiap file/album selesai terkirim"""
+
+    def __init__(self, status_msg, header, total_bytes, total_files, reply_markup=None):
+        self.status_msg = status_msg
+        self.reply_markup = reply_markup
+        self.header = header
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.sent_bytes = 0
+        self.sent_files = 0
+        self._last_edit = 0.0
+
+    async def advance(self, nbytes, nfiles):
+        self.sent_bytes += nbytes
+        self.sent_files += nfiles
+        now = time.monotonic()
+        if now - self._last_edit < DL_PROGRESS_INTERVAL and self.sent_files < self.total_files:
+            return
+        self._last_edit = now
+        pct = self.sent_bytes * 100 // max(self.total_bytes, 1)
+        with contextlib.suppress(Exception):
+            await self.status_msg.edit_text(
+                f"{self.header}\n"
+                f"📤 <b>Uploading...</b> {pct}%\n"
+                f"<i>{self.sent_bytes / 1024 / 1024:.1f}/{self.total_bytes / 1024 / 1024:.1f} MB "
+                f"• {self.sent_files}/{self.total_files} file(s)</i>",
+                parse_mode=ParseMode.HTML,
+                reply_markup=self.reply_markup,
+            )
+
+def _read_file(path):
+    with open(path, "rb") as fp:
+        return fp.read()
+
+async def _send_single(msg, path, kind, data, caption):
+    """Kirim satu file; return (file_id, media_type) buat cache"""
+    kw = {"caption": caption, "parse_mode": ParseMode.HTML}
+    name = os.path.basename(path)
+    if kind == "video":
+        m = await msg.reply_video(video=data, filename=name, supports_streaming=True, **kw)
+        return m.video.file_id, "video"
+    if kind == "audio":
+        m = await msg.reply_audio(audio=data, filename=name, **kw)
+        return m.audio.file_id, "audio"
+    if kind == "photo":
+        m = await msg.reply_photo(photo=data, filename=name, **kw)
+        return m.photo[-1].file_id, "photo"
+    if kind == "animation":
+        m = await msg.reply_animation(animation=data, filename=name, **kw)
+        return m.animation.file_id, "animation"
+    m = await msg.reply_document(document=data, filename=name, **kw)
+    return m.document.file_id, "document"
+
+def _input_media(kind, data, name, caption):
+    kw = {"caption": caption, "parse_mode": ParseMode.HTML, "filename": name}
+    if kind == "video":
+        return InputMediaVideo(media=data, supports_streaming=True, **kw)
+    if kind == "audio":
+        return InputMediaAudio(media=data, **kw)
+    return InputMediaPhoto(media=data, **kw)
+
+async def upload_downloaded_media(msg, status_msg, header, files, caption, cache_url, reply_markup=None):
+    """
+    Kirim hasil download: album (send_media_group) per ≤10 item, beberapa unit paralel,
+    file dibaca sekali di thread io. Return (sent_count, too_large).
+    """
+    items, too_large = [], 0
+    for path in files:
+        size = os.path.getsize(path)
+        if size > TELEGRAM_UPLOAD_LIMIT:
+            too_large += 1
+            logger.warning(f"[DL] Skip oversized file: {size} bytes")
+            continue
+        kind = classify_upload(path)
+        if kind == "video":
+            path = await remux_for_telegram(path)
+            size = os.path.getsize(path)
+        items.append((path, kind, size))
+
+    if not items:
+        return 0, too_large
+
+    batches = plan_upload_batches(items)
+    progress = UploadProgress(status_msg, header, sum(s for _, _, s in items), len(items), reply_markup)
+    sem = asyncio.Semaphore(DL_UPLOAD_CONCURRENCY)
+    sent = 0
+
+    async def send_batch(index, batch):
+        nonlocal sent
+        cap = caption if index == 0 else None
+        async with sem:
+            datas = await asyncio.gather(*(run_blocking("io", _read_file, p) for p, _, _ in batch))
+            try:
+                if len(batch) == 1:
+                    (path, kind, _), = batch
+                    file_id, media_type = await _send_single(msg, path, kind, datas[0], cap)
+                else:
+                    media = [
+                        _input_media(kind, data, os.path.basename(path), cap if i == 0 else None)
+                        for i, ((path, kind, _), data) in enumerate(zip(batch, datas))
+                    ]
+                    messages = await msg.reply_media_group(media=media)
+                    first = messages[0]
+                    if first.video:
+                        file_id, media_type = first.video.file_id, "video"
+                    elif first.audio:
+                        file_id, media_type = first.audio.file_id, "audio"
+                    else:
+                        file_id, media_type = first.photo[-1].file_id, "photo"
+            except Exception as ex:
+                logger.error(f"[SEND {index}] Error: {ex}")
+                return
+        sent += len(batch)
+        if index == 0:
+            await save_media_cache(cache_url, file_id, media_type)
+        await progress.advance(sum(s for _, _, s in batch), len(batch))
+
+    # Unit pertama (yang ada caption) duluan biar urutan chat tetap rapi
+    await send_batch(0, batches[0])
+    await asyncio.gather(*(send_batch(i, b) for i, b in enumerate(batches[1:], start=1)))
+    logger.info(f"[DL] Uploaded {sent} file(s) in {len(batches)} request(s)")
+    return sent, too_large
+
+@contextlib.asynccontextmanager
+async def download_tiktok_audio(audio_url: str):
+    """
+    Stream audio TikTok per chunk ke dir scratch (memori konstan).
+    Yield path atau None; file SELALU dihapus saat keluar blok, error atau tidak.
+    """
+    # Dipanggil di dalam slot /dl juga → batas antre kuota sama dengan job "dl"
+    async with scratch_space.job("tiktok", reserve=TELEGRAM_UPLOAD_LIMIT, wait_timeout=SCRATCH_DL_WAIT) as job_dir:
+        temp_file = os.path.join(job_dir, "audio.mp3")
+        headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+        }
+        ok = False
+        try:
+            async with http_session("media", headers=headers, timeout=30.0) as client:
+                async with client.stream("GET", audio_url, follow_redirects=True) as response:
+                    if response.status_code == 200:
+                        size = 0
+                        with open(temp_file, "wb") as f:
+                            async for chunk in response.aiter_bytes(STREAM_CHUNK):
+                                size += len(chunk)
+                                if size > TELEGRAM_UPLOAD_LIMIT:
+                                    raise ValueError("audio melebihi batas upload Telegram")
+                                f.write(chunk)
+                        ok = size > 0
+        except Exception as e:
+            logger.error(f"[TIKTOK AUDIO] Error: {e}")
+        yield temp_file if ok else None
+
 async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Downloader command: /dl [link]"""
     
@@ -1573,8 +4192,16 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     await msg.reply_audio(file_id, caption=caption, parse_mode=ParseMode.HTML)
                 elif m_type == "photo":
                     await msg.reply_photo(file_id, caption=caption, parse_mode=ParseMode.HTML)
+                elif m_type == "animation":
+                    await msg.reply_animation(file_id, caption=caption, parse_mode=ParseMode.HTML)
+                else:
+                    await msg.reply_document(file_id, caption=caption, parse_mode=ParseMode.HTML)
                 logger.info(f"[CACHE HIT] {url}")
                 return
+            except BadRequest as e:
+                # Telegram menolak file_id lama → buang entry, lanjut download ulang
+                logger.warning(f"[CACHE SEND] Rejected file_id: {e}")
+                await invalidate_media_cache(url)
             except Exception as e:
                 logger.debug(f"[CACHE SEND] Error: {e}")
     except Exception as e:
@@ -1586,6 +4213,55 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.HTML
     )
 
+    # ==========================================
+    # ⏳ ANTRE SLOT DOWNLOAD
+    # ==========================================
+    user_id = update.effective_user.id
+    premium = await is_registered(user_id)
+
+    async def show_position(job, pos):
+        await status_msg.edit_text(
+            f"⏳ <b>In Queue:</b> #{pos}\n"
+            f"{'💎 Priority lane' if job.premium else '👤 Standard lane'} · "
+            f"{len(download_scheduler.running)}/{download_scheduler.workers} slots busy\n"
+            f"<i>Download starts automatically...</i>",
+            parse_mode=ParseMode.HTML,
+            reply_markup=dl_cancel_markup(job),
+        )
+
+    try:
+        async with download_scheduler.slot(user_id, premium, on_position=show_position) as job:
+            await dl_process(update, context, url, status_msg, job)
+    except DownloadQueueFull as e:
+        await status_msg.edit_text(f"⚠️ <b>Queue Full:</b> {html.escape(str(e))}. Tunggu yang sebelumnya selesai.", parse_mode=ParseMode.HTML)
+    except DownloadCancelled:
+        with contextlib.suppress(Exception):
+            await status_msg.edit_text("🛑 <b>Download Cancelled.</b>", parse_mode=ParseMode.HTML)
+
+async def dl_report_download_error(status_msg, e):
+    """Pesan error yt-dlp yang ramah user (probe & download pakai yang sama)"""
+    error_str = str(e).lower()
+
+    for key, msg_text in ERROR_MESSAGES.items():
+        if key.lower() in error_str:
+            await status_msg.edit_text(f"❌ {msg_text}", parse_mode=ParseMode.HTML)
+            return
+
+    await status_msg.edit_text(
+        "❌ <b>Download Failed</b>\n\n"
+        "Possible causes:\n"
+        "• Private/Restricted Content\n"
+        "• Video Deleted\n"
+        "• Geo-Blocked\n"
+        "• Server Rate Limited\n\n"
+        "Try again in 5 minutes.",
+        parse_mode=ParseMode.HTML
+    )
+
+async def dl_process(update: Update, context: ContextTypes.DEFAULT_TYPE, url, status_msg, job):
+    """Isi /dl setelah dapat slot dari download_scheduler"""
+    msg = update.message
+
     # ==========================================
     # 2️⃣ TIKTOK ENGINE (API - KHUSUS)
     # ==========================================
@@ -1595,12 +4271,11 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "🎥 <b>TikTok Detected</b>\n"
                 "📥 <b>Downloading...</b>\n"
                 "<i>Please wait...</i>",
-                parse_mode=ParseMode.HTML
+                parse_mode=ParseMode.HTML,
+                reply_markup=dl_cancel_markup(job)
             )
             
-            async with httpx.AsyncClient(timeout=15.0) as client:
-                r = await client.get(f"https://www.tikwm.com/api/?url={url}")
-                data = r.json()
+            data = await probe_tiktok(url)
             
             if data and data.get("code") == 0:
                 d = data.get("data", {})
@@ -1615,30 +4290,53 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 
                 await status_msg.delete()
 
+                # Short link (vm./vt.) baru ketahuan ID aslinya dari API → simpan di 2 key
+                cache_keys = {canonical_media_key(url)}
+                if d.get("id"):
+                    cache_keys.add(f"tiktok:{d['id']}")
+
                 # ✅ SEND VIDEO
                 if d.get("play"):
                     try:
                         v = await msg.reply_video(d["play"], caption=caption, parse_mode=ParseMode.HTML)
-                        await save_media_cache(url, v.video.file_id, "video")
+                        for key in cache_keys:
+                            await save_media_cache(key, v.video.file_id, "video")
                         logger.info(f"[TIKTOK] Video sent: {url}")
                     except Exception as e:
                         logger.error(f"[TIKTOK VIDEO] Error: {e}")
 
                 # ✅ SEND AUDIO
                 if d.get("music"):
+                    # 1 sound dipakai banyak video → cek cache per music id dulu, baru download
+                    audio_keys = [f"{key}#audio" for key in cache_keys]
+                    music_id = (d.get("music_info") or {}).get("id")
+                    if music_id:
+                        audio_keys.insert(0, f"tiktok:music:{music_id}")
                     try:
-                        audio_file = await download_tiktok_audio(d["music"])
-                        
-                        if audio_file and os.path.exists(audio_file):
-                            with open(audio_file, 'rb') as af:
-                                a = await msg.reply_audio(af, caption="🎵 Original Sound", parse_mode=ParseMode.HTML)
-                                await save_media_cache(f"{url}_audio", a.audio.file_id, "audio")
-                                logger.info(f"[TIKTOK] Audio sent: {url}")
-                            
+                        sent_audio = False
+                        for key in audio_keys:
+                            cached = await get_media_cache(key)
+                            if not cached.get("cached"):
+                                continue
                             try:
-                                os.remove(audio_file)
-                            except:
-                                pass
+                                a = await msg.reply_audio(cached["file_id"], caption="🎵 Original Sound", parse_mode=ParseMode.HTML)
+                                sent_audio = True
+                                logger.info(f"[TIKTOK] Audio from cache: {key}")
+                                break
+                            except BadRequest:
+                                await invalidate_media_cache(key)
+
+                        if not sent_audio:
+                            async with download_tiktok_audio(d["music"]) as audio_file:
+                                if audio_file:
+                                    with open(audio_file, 'rb') as af:
+                                        a = await msg.reply_audio(af, caption="🎵 Original Sound", parse_mode=ParseMode.HTML)
+                                    sent_audio = True
+                                    logger.info(f"[TIKTOK] Audio sent: {url}")
+
+                        if sent_audio:
+                            for key in audio_keys:
+                                await save_media_cache(key, a.audio.file_id, "audio")
                     except Exception as e:
                         logger.error(f"[TIKTOK AUDIO] Error: {e}")
                 
@@ -1657,30 +4355,30 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
     # ==========================================
-    # 3️⃣ YOUTUBE DURATION CHECK
+    # 3️⃣ PROBE + YOUTUBE DURATION CHECK
     # ==========================================
-    if "youtube.com" in url or "youtu.be" in url:
+    # Hasil probe dipakai ulang di fase download (1 ekstraksi, bukan 2) dan buat pilih format
+    probe_info = None
+    try:
+        await status_msg.edit_text(
+            "🔎 <b>Checking media...</b>\n"
+            "<i>Please wait...</i>",
+            parse_mode=ParseMode.HTML,
+            reply_markup=dl_cancel_markup(job)
+        )
+        probe_info = await probe_media_info(url)
+    except yt_dlp.utils.DownloadError as e:
+        await dl_report_download_error(status_msg, e)
+        return
+    except Exception as e:
+        logger.debug(f"[DL] Probe error: {e}")
+
+    if probe_info and ("youtube.com" in url or "youtu.be" in url):
         try:
-            await status_msg.edit_text(
-                "⏱️ <b>Checking duration...</b>\n"
-                "<i>Please wait...</i>",
-                parse_mode=ParseMode.HTML
-            )
-            
-            loop = asyncio.get_running_loop()
-            
-            ydl_opts = {
-                "quiet": True,
-                "no_warnings": True,
-                "socket_timeout": 30,
-                "nocheckcertificate": True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
-                duration = info.get('duration', 0)
-                title = info.get('title', 'Video')
-                uploader = info.get('uploader', 'Unknown')
+            info = probe_info
+            duration = info.get('duration') or 0
+            title = info.get('title', 'Video')
+            uploader = info.get('uploader', 'Unknown')
             
             # Reject jika > 1 jam (3600 detik)
             if duration > 3600:
@@ -1700,161 +4398,132 @@ async def dl_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             logger.debug(f"Duration check error: {e}")
 
+    # Pilih format yang pasti muat & bisa diputar langsung sebelum download
+    plan = plan_download_format(probe_info)
+    if plan and plan["format"] is None:
+        await status_msg.edit_text(
+            f"❌ <b>File Terlalu Besar!</b>\n\n"
+            f"📏 <b>Perkiraan terkecil:</b> {plan['size'] / 1024 / 1024:.0f} MB\n"
+            f"📦 <b>Batas Telegram:</b> {TELEGRAM_UPLOAD_LIMIT // 1024 // 1024} MB\n\n"
+            f"<i>Gunakan video yang lebih pendek.</i>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+
     # ==========================================
     # 4️⃣ UNIVERSAL ENGINE (YT-DLP)
     # ==========================================
     try:
-        temp_dir = f"dl_{uuid.uuid4()}"
-        os.makedirs(temp_dir, exist_ok=True)
-
-        # Detect platform
-        if "instagram.com" in url:
-            platform, icon = "INSTAGRAM", "📸"
-        elif "youtube.com" in url or "youtu.be" in url:
-            platform, icon = "YOUTUBE", "📺"
-        elif "twitter.com" in url or "x.com" in url:
-            platform, icon = "X/TWITTER", "🐦"
-        elif "facebook.com" in url:
-            platform, icon = "FACEBOOK", "📘"
-        else:
-            platform, icon = "UNIVERSAL", "📁"
-
-        await status_msg.edit_text(
-            f"{icon} <b>{platform}</b>\n"
-            f"📥 <b>Downloading...</b>\n"
-            f"<i>Please wait...</i>",
-            parse_mode=ParseMode.HTML
-        )
+        async with scratch_space.job("dl", reserve=2 * TELEGRAM_UPLOAD_LIMIT, wait_timeout=SCRATCH_DL_WAIT) as temp_dir:
+            # Detect platform
+            if "instagram.com" in url:
+                platform, icon = "INSTAGRAM", "📸"
+            elif "youtube.com" in url or "youtu.be" in url:
+                platform, icon = "YOUTUBE", "📺"
+            elif "twitter.com" in url or "x.com" in url:
+                platform, icon = "X/TWITTER", "🐦"
+            elif "facebook.com" in url:
+                platform, icon = "FACEBOOK", "📘"
+            else:
+                platform, icon = "UNIVERSAL", "📁"
 
-        ydl_opts = {
-            "format": "best[ext=mp4]/best[ext=mkv]/best[height<=720]/best",
-            "outtmpl": f"{temp_dir}/%(title)s.%(ext)s",
-            "quiet": True,
-            "no_warnings": True,
-            "noplaylist": True,
-            "socket_timeout": 30,
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-            },
-            "nocheckcertificate": True,
-            "ignoreerrors": False,
-            "geo_bypass": True,
-            "geo_bypass_country": "US",
-            "extractor_retries": 3,
-            "retries": 3,
-        }
+            await status_msg.edit_text(
+                f"{icon} <b>{platform}</b>\n"
+                f"📥 <b>Downloading...</b>\n"
+                f"<i>Please wait...</i>",
+                parse_mode=ParseMode.HTML,
+                reply_markup=dl_cancel_markup(job)
+            )
 
-        loop = asyncio.get_running_loop()
+            ydl_opts = {
+                **DL_YTDLP_OPTS,
+                "format": f"{plan['format']}/{DL_DEFAULT_FORMAT}" if plan else DL_DEFAULT_FORMAT,
+                "merge_output_format": "mp4/mkv",  # merge = stream copy, MP4 kalau codec cocok
+                "outtmpl": f"{temp_dir}/%(title)s.%(ext)s",
+                "retries": 3,
+                "progress_hooks": [dl_abort_hook(job)],
+            }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=True))
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = None
+                if probe_info is not None:
+                    # Pakai hasil probe: cuma pilih format + download, tanpa resolve halaman/player lagi
+                    try:
+                        info = await run_blocking(
+                            "subprocess", ydl.process_ie_result, copy.deepcopy(probe_info), download=True
+                        )
+                    except yt_dlp.utils.DownloadError as e:
+                        logger.warning(f"[DL] Probe reuse failed, re-extracting: {e}")
+                        media_info_cache.invalidate(canonical_media_key(url))
+                if info is None:
+                    info = await run_blocking("subprocess", ydl.extract_info, url, download=True)
 
-            if not info:
-                raise Exception("Extraction failed")
+                if not info:
+                    raise Exception("Extraction failed")
 
-            video_title = info.get("title", "Media")
-            uploader = info.get("uploader", "Unknown")
+                video_title = info.get("title", "Media")
+                uploader = info.get("uploader", "Unknown")
             
-            files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if os.path.isfile(os.path.join(temp_dir, f))]
+                files = [os.path.join(temp_dir, f) for f in os.listdir(temp_dir) if os.path.isfile(os.path.join(temp_dir, f))]
             
-            if not files:
-                raise Exception("No files downloaded")
-
-            # ==========================================
-            # 5️⃣ SEND FILES
-            # ==========================================
-            caption_base = (
-                f"{icon} <b>OKTACOMEL {platform}</b>\n"
-                f"━━━━━━━━━━━━━━━━━━\n"
-                f"📝 <b>Title:</b> {html.escape(str(video_title)[:80])}\n"
-                f"👤 <b>By:</b> {html.escape(str(uploader)[:50])}\n"
-                f"⚡ <i>Powered by Oktacomel</i>"
-            )
-
-            await status_msg.edit_text(
-                f"{icon} <b>{platform}</b>\n"
-                f"📤 <b>Sending...</b>\n"
-                f"<i>Uploading {len(files)} file(s)...</i>",
-                parse_mode=ParseMode.HTML
-            )
+                if not files:
+                    raise Exception("No files downloaded")
 
-            sent_count = 0
-            for i, f_path in enumerate(files[:10]):  # Max 10 files
-                ext = f_path.split(".")[-1].lower()
-                cap = caption_base if i == 0 else None
-
-                try:
-                    if ext in ["mp4", "mkv", "mov", "webm", "avi", "flv"]:
-                        with open(f_path, "rb") as fp:
-                            v = await msg.reply_video(video=fp, caption=cap, parse_mode=ParseMode.HTML)
-                            if i == 0:
-                                await save_media_cache(url, v.video.file_id, "video")
-                        sent_count += 1
-                        logger.info(f"[DL] Video sent: {platform}")
-
-                    elif ext in ["mp3", "m4a", "wav", "aac", "flac"]:
-                        with open(f_path, "rb") as fp:
-                            a = await msg.reply_audio(audio=fp, caption=cap, parse_mode=ParseMode.HTML)
-                            if i == 0:
-                                await save_media_cache(url, a.audio.file_id, "audio")
-                        sent_count += 1
-                        logger.info(f"[DL] Audio sent: {platform}")
-
-                    elif ext in ["jpg", "jpeg", "png", "webp", "gif"]:
-                        with open(f_path, "rb") as fp:
-                            p = await msg.reply_photo(photo=fp, caption=cap, parse_mode=ParseMode.HTML)
-                            if i == 0:
-                                await save_media_cache(url, p.photo[-1].file_id, "photo")
-                        sent_count += 1
-                        logger.info(f"[DL] Photo sent: {platform}")
-
-                except Exception as ex:
-                    logger.error(f"[SEND {i}] Error: {ex}")
-                    continue
+                if plan:
+                    logger.info(
+                        f"[DL] Format {plan['format']} ({plan['height']}p, "
+                        f"~{(plan['size'] or 0) / 1024 / 1024:.1f} MB, native={plan['native']})"
+                    )
 
-                finally:
-                    try:
-                        os.remove(f_path)
-                    except:
-                        pass
+                # ==========================================
+                # 5️⃣ SEND FILES
+                # ==========================================
+                caption_base = (
+                    f"{icon} <b>OKTACOMEL {platform}</b>\n"
+                    f"━━━━━━━━━━━━━━━━━━\n"
+                    f"📝 <b>Title:</b> {html.escape(str(video_title)[:80])}\n"
+                    f"👤 <b>By:</b> {html.escape(str(uploader)[:50])}\n"
+                    f"⚡ <i>Powered by Oktacomel</i>"
+                )
 
-            # Cleanup
-            try:
-                os.rmdir(temp_dir)
-            except:
-                pass
+                await status_msg.edit_text(
+                    f"{icon} <b>{platform}</b>\n"
+                    f"📤 <b>Sending...</b>\n"
+                    f"<i>Uploading {len(files)} file(s)...</i>",
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=dl_cancel_markup(job)
+                )
 
-            if sent_count > 0:
-                await status_msg.delete()
-                logger.info(f"[SUCCESS] Downloaded {sent_count} file(s) from {platform}")
-                return
+                sent_count, too_large = await upload_downloaded_media(
+                    msg, status_msg, f"{icon} <b>{platform}</b>", files[:10], caption_base, url,
+                    reply_markup=dl_cancel_markup(job),
+                )
 
-    except yt_dlp.utils.DownloadError as e:
-        error_str = str(e).lower()
-        
-        for key, msg_text in ERROR_MESSAGES.items():
-            if key.lower() in error_str:
-                await status_msg.edit_text(f"❌ {msg_text}", parse_mode=ParseMode.HTML)
-                return
+                if sent_count > 0:
+                    await status_msg.delete()
+                    logger.info(f"[SUCCESS] Downloaded {sent_count} file(s) from {platform}")
+                    return
+
+                if too_large:
+                    await status_msg.edit_text(
+                        f"❌ <b>File Terlalu Besar!</b>\n\n"
+                        f"📦 <b>Batas Telegram:</b> {TELEGRAM_UPLOAD_LIMIT // 1024 // 1024} MB",
+                        parse_mode=ParseMode.HTML
+                    )
+                    return
 
+    except ScratchQuotaError:
         await status_msg.edit_text(
-            "❌ <b>Download Failed</b>\n\n"
-            "Possible causes:\n"
-            "• Private/Restricted Content\n"
-            "• Video Deleted\n"
-            "• Geo-Blocked\n"
-            "• Server Rate Limited\n\n"
-            "Try again in 5 minutes.",
+            "⏳ <b>Server Sibuk</b>\n\n"
+            "Ruang penyimpanan sementara penuh. Coba lagi sebentar lagi.",
             parse_mode=ParseMode.HTML
         )
 
+    except yt_dlp.utils.DownloadError as e:
+        await dl_report_download_error(status_msg, e)
+
     except Exception as e:
         logger.error(f"[DL] Error: {e}")
-        try:
-            shutil.rmtree(temp_dir)
-        except:
-            pass
 
         await status_msg.edit_text(
             f"❌ <b>Download Failed</b>\n\n"
@@ -2469,7 +5138,7 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     parse_mode=ParseMode.HTML,
                 )
 
-            async with httpx.AsyncClient(timeout=15) as client:
+            async with http_session(timeout=15) as client:
                 resp = await client.get(
                     "https://www.omdbapi.com/",
                     params={"apikey": omdb_key, "t": q, "plot": "short"},
@@ -2759,7 +5428,7 @@ async def scrape_stripe_command(update: Update, context: ContextTypes.DEFAULT_TY
     )
 
     try:
-        async with httpx.AsyncClient(timeout=20, follow_redirects=True) as client:
+        async with http_session(timeout=20, follow_redirects=True) as client:
             headers = {
                 "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
                 "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
@@ -3114,8 +5783,8 @@ async def anime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.UPLOAD_PHOTO)
     
     try:
-        # Request ke API
-        data = await fetch_json(url)
+        # Request ke API (random tiap request, jangan di-cache)
+        data = await fetch_json(url, cache=False)
         
         if data and 'url' in data:
             img_url = data['url']
@@ -3138,17 +5807,45 @@ async def anime_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 🎨 AI IMAGE GENERATOR — PREMIUM ULTIMATE EDITION v2.0
 # ==========================================
 
+IMG_SOURCE_TIMEOUT = 45.0     # batas per source
+IMG_HEDGE_DELAY = 10.0        # source berikut ikut start kalau yang jalan belum jawab
+IMG_PROGRESS_INTERVAL = 2.0
+IMG_SIZE = "1024x1024"
+IMG_SEED_RE = re.compile(r"(?:^|\s)--seed[ =](\d{1,9})\b")
+
+# token reroll (callback_data max 64 byte) -> (prompt, pinned_seed)
+img_reroll_tokens = TTLCache(20000, 24 * 3600, "img-reroll")
+
+def img_cache_key(prompt, model, size=IMG_SIZE, seed=None):
+    """Key cache gambar: prompt dinormalisasi + model + ukuran (+ seed kalau di-pin)"""
+    norm = " ".join(prompt.lower().split())
+    raw = f"{norm}|{model}|{size}|{seed if seed is not None else '*'}"
+    return f"img:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+def img_reroll_markup(prompt, pinned_seed):
+    token = hashlib.sha1(f"{prompt}|{pinned_seed}".encode()).hexdigest()[:16]
+    img_reroll_tokens.set(token, (prompt, pinned_seed))
+    return InlineKeyboardMarkup([[InlineKeyboardButton("🎲 Reroll", callback_data=f"img_reroll|{token}")]])
+
 async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """AI Image Generator dengan progress bar animasi"""
     
     if not context.args:
         return await update.message.reply_text(
             "⚠️ <b>Usage:</b> <code>/img kucing terbang di langit</code>\n\n"
-            "💡 <b>Tips:</b> Semakin detail prompt, semakin bagus hasilnya!",
+            "💡 <b>Tips:</b> Semakin detail prompt, semakin bagus hasilnya!\n"
+            "🔢 <b>Seed tetap:</b> <code>/img kucing --seed 42</code>",
             parse_mode=ParseMode.HTML
         )
 
     prompt = " ".join(context.args)
+
+    # Seed di-pin? (--seed 123)
+    pinned_seed = None
+    m = IMG_SEED_RE.search(prompt)
+    if m:
+        pinned_seed = int(m.group(1))
+        prompt = (prompt[:m.start()] + prompt[m.end():]).strip()
     
     # Validasi prompt
     if len(prompt) < 3:
@@ -3161,17 +5858,22 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if len(prompt) > 500:
         prompt = prompt[:500]
 
-    seed = random.randint(1, 999999)
+    await img_generate(update.message, context, prompt, pinned_seed)
 
-    await context.bot.send_chat_action(update.effective_chat.id, ChatAction.UPLOAD_PHOTO)
-    
-    # Initial message
-    msg = await update.message.reply_text(
-        "🎨 <b>Generating AI Image...</b>\n"
-        "[░░░░░░░░░░░░░░░░░░] 0%",
-        parse_mode=ParseMode.HTML
-    )
+async def img_reroll_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tombol Reroll: generate ulang prompt yang sama, sengaja lewati cache"""
+    q = update.callback_query
+    token = q.data.split("|", 1)[1]
+    hit, entry = img_reroll_tokens.lookup(token)
+    if not hit:
+        await q.answer("⌛ Prompt sudah kadaluarsa, kirim /img lagi.", show_alert=True)
+        return
+    await q.answer("🎲 Rerolling...")
+    prompt, pinned_seed = entry
+    await img_generate(q.message, context, prompt, pinned_seed, reroll=True)
 
+async def img_generate(message, context, prompt, pinned_seed=None, reroll=False):
+    """Cache file_id (prompt+model+size+seed) → kalau miss, race generator lalu simpan file_id"""
     # ==========================================
     # SMART MODEL DETECTOR
     # ==========================================
@@ -3198,34 +5900,53 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         style_name = "Flux Ultra HD"
         icon = "📸"
 
+    cache_key = img_cache_key(prompt, model, IMG_SIZE, pinned_seed)
+    reroll_markup = img_reroll_markup(prompt, pinned_seed)
+
     # ==========================================
-    # PROGRESS BAR STAGES
+    # CACHE (TELEGRAM FILE_ID)
     # ==========================================
-    
-    stages = [
-        {"progress": 10, "text": "Analyzing prompt...", "bar": "██░░░░░░░░░░░░░░░░"},
-        {"progress": 25, "text": "Initializing AI model...", "bar": "█████░░░░░░░░░░░░░░"},
-        {"progress": 40, "text": "Processing neural network...", "bar": "████████░░░░░░░░░░░░"},
-        {"progress": 60, "text": "Rendering image...", "bar": "████████████░░░░░░░░"},
-        {"progress": 80, "text": "Optimizing quality...", "bar": "████████████████░░░░"},
-        {"progress": 95, "text": "Finalizing details...", "bar": "███████████████████░"},
-    ]
+    if not reroll:
+        cached = await get_media_cache(cache_key)
+        if cached.get("cached"):
+            try:
+                await message.reply_photo(
+                    photo=cached["file_id"],
+                    caption=(
+                        f"🎨 <b>AI Image Studio — Premium</b> {icon}\n"
+                        f"━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+                        f"🖼️ <b>Prompt:</b>\n"
+                        f"<code>{html.escape(prompt)}</code>\n\n"
+                        f"⚙️ <b>Model:</b> {style_name}\n"
+                        f"📊 <b>Quality:</b> Ultra HD ({IMG_SIZE})\n"
+                        f"🔢 <b>Seed:</b> <code>{pinned_seed if pinned_seed is not None else '-'}</code>\n"
+                        f"🌐 <b>Source:</b> ⚡ Cache\n"
+                        f"━━━━━━━━━━━━━━━━━━━━━━━━━\n"
+                        f"⭐ <i>Powered by Oktacomel AI</i>"
+                    ),
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=reroll_markup,
+                )
+                return
+            except BadRequest as e:
+                logger.warning(f"[IMG CACHE] Rejected file_id: {e}")
+                await invalidate_media_cache(cache_key)
+            except Exception as e:
+                logger.debug(f"[IMG CACHE] Send error: {e}")
 
-    # Update progress
-    for stage in stages:
-        try:
-            await msg.edit_text(
-                f"🎨 <b>Generating AI Image...</b>\n"
-                f"[{stage['bar']}] {stage['progress']}%\n"
-                f"⏳ {stage['text']}",
-                parse_mode=ParseMode.HTML
-            )
-            await asyncio.sleep(0.8)  # Delay untuk effect
-        except:
-            pass
+    seed = pinned_seed if pinned_seed is not None else random.randint(1, 999999)
+
+    await context.bot.send_chat_action(message.chat_id, ChatAction.UPLOAD_PHOTO)
+    
+    # Initial message
+    msg = await message.reply_text(
+        "🎨 <b>Generating AI Image...</b>\n"
+        "[░░░░░░░░░░░░░░░░░░] 0%",
+        parse_mode=ParseMode.HTML
+    )
 
     # ==========================================
-    # MULTIPLE API SOURCES (FALLBACK)
+    # MULTIPLE API SOURCES (HEDGED RACE)
     # ==========================================
     
     api_sources = [
@@ -3243,46 +5964,61 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         },
     ]
 
-    img_url = None
-    used_source = None
-
-    # Try setiap API source
-    for idx, source in enumerate(api_sources):
-        try:
-            progress = 95 + (idx * 2)
-            
-            await msg.edit_text(
-                f"🎨 <b>Generating with {source['name']}...</b>\n"
-                f"[{'█' * (progress // 5)}{'░' * (20 - (progress // 5))}] {progress}%\n"
-                f"⏳ Connecting to server...",
-                parse_mode=ParseMode.HTML
-            )
-            
+    def make_attempt(source):
+        async def attempt():
             url = source["func"](prompt, seed, model)
-            
-            # Test URL dengan timeout
-            async with httpx.AsyncClient(timeout=45.0) as client:
+            async with http_session("media", timeout=IMG_SOURCE_TIMEOUT) as client:
                 response = await client.get(url, follow_redirects=True)
-                
-                if response.status_code == 200:
-                    img_url = url
-                    used_source = source["name"]
-                    break
-                else:
-                    logger.debug(f"[IMG] {source['name']} returned {response.status_code}")
-                    continue
-                    
-        except asyncio.TimeoutError:
-            logger.debug(f"[IMG] {source['name']} timeout")
-            await msg.edit_text(
-                f"⏳ <b>{source['name']} timeout, trying next source...</b>\n"
-                f"[{'█' * 15}{'░' * 5}] 75%",
-                parse_mode=ParseMode.HTML
+            if response.status_code == 200 and response.content:
+                return url, response.content  # kirim byte-nya, Telegram tidak perlu generate ulang
+            logger.debug(f"[IMG] {source['name']} returned {response.status_code}")
+            return None
+        return source["name"], attempt
+
+    # Progress dari state race yang asli (source aktif/gagal + waktu jalan), bukan sleep kosmetik
+    race = {"started": time.monotonic(), "active": [], "failed": []}
+
+    def on_race_event(kind, name):
+        if name in race["active"]:
+            race["active"].remove(name)
+        if kind == "start":
+            race["active"].append(name)
+        elif kind == "fail":
+            race["failed"].append(name)
+
+    async def render_progress():
+        last_text = None
+        while True:
+            elapsed = time.monotonic() - race["started"]
+            progress = min(95, 5 + int(elapsed / IMG_SOURCE_TIMEOUT * 90))
+            bar = "█" * (progress // 5) + "░" * (20 - progress // 5)
+            text = (
+                f"🎨 <b>Generating AI Image...</b>\n"
+                f"[{bar}] {progress}%\n"
+                f"⏳ {elapsed:.0f}s — {', '.join(race['active']) or 'connecting'}"
             )
-            continue
-        except Exception as e:
-            logger.debug(f"[IMG] {source['name']} error: {e}")
-            continue
+            if race["failed"]:
+                text += f"\n⚠️ Failed: {', '.join(race['failed'])}"
+            if text != last_text:
+                try:
+                    await msg.edit_text(text, parse_mode=ParseMode.HTML)
+                    last_text = text
+                except Exception:
+                    pass
+            await asyncio.sleep(IMG_PROGRESS_INTERVAL)
+
+    progress_task = asyncio.create_task(render_progress())
+    try:
+        used_source, result = await hedged_race(
+            [make_attempt(source) for source in api_sources],
+            hedge_delay=IMG_HEDGE_DELAY,
+            on_event=on_race_event,
+        )
+    finally:
+        # Tunggu render_progress benar-benar berhenti, biar edit progress basi tidak menimpa hasil
+        progress_task.cancel()
+        await asyncio.wait([progress_task])
+    img_url, img_bytes = result if result else (None, None)
 
     # ==========================================
     # ERROR HANDLING
@@ -3318,8 +6054,6 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         pass
 
-    await asyncio.sleep(0.5)
-
     # ==========================================
     # CAPTION PREMIUM
     # ==========================================
@@ -3329,7 +6063,7 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🖼️ <b>Prompt:</b>\n"
         f"<code>{html.escape(prompt)}</code>\n\n"
         f"⚙️ <b>Model:</b> {style_name}\n"
-        f"📊 <b>Quality:</b> Ultra HD (1024x1024)\n"
+        f"📊 <b>Quality:</b> Ultra HD ({IMG_SIZE})\n"
         f"🔢 <b>Seed:</b> <code>{seed}</code>\n"
         f"🌐 <b>Source:</b> {used_source}\n"
         f"━━━━━━━━━━━━━━━━━━━━━━━━━\n"
@@ -3340,12 +6074,15 @@ async def img_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # SEND IMAGE
     # ==========================================
     try:
-        await update.message.reply_photo(
-            photo=img_url,
+        sent = await message.reply_photo(
+            photo=img_bytes,
             caption=caption,
-            parse_mode=ParseMode.HTML
+            parse_mode=ParseMode.HTML,
+            reply_markup=reroll_markup,
         )
         await msg.delete()
+        if sent.photo and not reroll:
+            await save_media_cache(cache_key, sent.photo[-1].file_id, "photo")
 
     except Exception as e:
         logger.error(f"[IMG] Photo send error: {e}")
@@ -3385,16 +6122,14 @@ async def tts_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.UPLOAD_VOICE)
 
     try:
-        # Generate Suara
+        # Generate Suara (file di scratch, terhapus otomatis)
         tts = gTTS(text=text, lang=lang)
-        filename = f"voice_{update.effective_user.id}.mp3"
-        tts.save(filename)
-        
-        # Kirim File
-        await update.message.reply_audio(filename, title="Okta TTS", performer="Google Voice")
-        
-        # Hapus File Sampah
-        os.remove(filename)
+        async with scratch_space.job("voice", reserve=5 * 1024 * 1024) as job_dir:
+            filename = os.path.join(job_dir, "voice.mp3")
+            await run_blocking("io", tts.save, filename)
+
+            # Kirim File
+            await update.message.reply_audio(filename, title="Okta TTS", performer="Google Voice")
         
     except ValueError:
         await update.message.reply_text("❌ Bahasa tidak didukung. Coba: id, en, ja.", parse_mode=ParseMode.HTML)
@@ -3426,7 +6161,7 @@ async def tr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # 2. Proses Translate (Otomatis deteksi bahasa asal)
         translator = GoogleTranslator(source='auto', target=target_lang)
-        translated = translator.translate(text_to_tr)
+        translated = await run_blocking("io", translator.translate, text_to_tr)
         
         # 3. Tampilan Hasil (Rapi)
         res = (
@@ -3498,8 +6233,8 @@ async def convert_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 3. Request ke API Coinbase (Gratis & Akurat untuk USDT)
         url = f"https://api.coinbase.com/v2/exchange-rates?currency={base_curr}"
         
-        # Gunakan requests (sesuai library yang kamu punya)
-        r = requests.get(url)
+        async with http_session(timeout=15.0) as client:
+            r = await client.get(url)
         data = r.json()
 
         # 4. Validasi Response
@@ -3779,25 +6514,13 @@ async def crypto_alert_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         symbol = parts[1] if len(parts) > 1 else "UNKNOWN"
         target_price = float(parts[2]) if len(parts) > 2 else None
 
-        # Simpan ke SQLite (table crypto_alerts) — jika tabel belum ada, buat otomatis
+        # Simpan ke SQLite (table crypto_alerts dibuat oleh migrasi v1)
         try:
-            async with aiosqlite.connect(DB_NAME) as db:
-                await db.execute("""
-                    CREATE TABLE IF NOT EXISTS crypto_alerts (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        chat_id INTEGER,
-                        symbol TEXT,
-                        target REAL,
-                        created_at REAL
-                    )
-                """)
-                await db.commit()
-
+            async with db_pool.write() as db:
                 await db.execute(
                     "INSERT INTO crypto_alerts (chat_id, symbol, target, created_at) VALUES (?, ?, ?, ?)",
                     (q.message.chat_id, symbol, target_price if target_price else 0.0, time.time())
                 )
-                await db.commit()
         except Exception:
             # jangan crash kalau DB error, lanjutkan saja
             pass
@@ -3810,41 +6533,39 @@ async def crypto_alert_handler(update: Update, context: ContextTypes.DEFAULT_TYP
 # --- OPTIONAL: Checker job — panggil ini via job_queue.run_repeating(check_price_alerts, interval=60, first=30) ---
 async def check_price_alerts(context: ContextTypes.DEFAULT_TYPE):
     try:
-        async with aiosqlite.connect(DB_NAME) as db:
-            async with db.execute("SELECT id, chat_id, symbol, target FROM crypto_alerts") as cur:
-                rows = await cur.fetchall()
-                if not rows:
-                    return
+        # Reader cuma dipinjam sebentar, jangan ditahan selama fetch ke Binance
+        rows = await db_fetch_all("SELECT id, chat_id, symbol, target FROM crypto_alerts ORDER BY symbol")
+        if not rows:
+            return
 
-                # group by symbol untuk efisiensi
-                by_symbol = {}
-                for r in rows:
-                    _id, chat_id, sym, target = r
-                    sym = sym.upper()
-                    by_symbol.setdefault(sym, []).append(( _id, chat_id, target ))
-
-                for sym, alerts in by_symbol.items():
-                    pair = f"{sym}USDT"
-                    url = f"https://api.binance.com/api/v3/ticker/24hr?symbol={pair}"
-                    d = await fetch_json(url)
-                    if not d or 'lastPrice' not in d: 
-                        continue
-                    last = float(d.get('lastPrice', 0))
-                    # peringatan bila last >= target (simple logic)
-                    for (_id, chat_id, target) in alerts:
-                        try:
-                            if target > 0 and last >= float(target):
-                                text = (f"🚨 <b>Price Alert</b>\n"
-                                        f"Pair: <code>{pair}</code>\n"
-                                        f"Current: <code>${last:,.6f}</code>\n"
-                                        f"Target: <code>${float(target):,.6f}</code>\n"
-                                        f"ID Alert: <code>{_id}</code>")
-                                await context.bot.send_message(chat_id, text, parse_mode=ParseMode.HTML)
-                                # hapus alert setelah trigger (opsional)
-                                await db.execute("DELETE FROM crypto_alerts WHERE id=?", (_id,))
-                                await db.commit()
-                        except:
-                            pass
+        # group by symbol untuk efisiensi
+        by_symbol = {}
+        for r in rows:
+            _id, chat_id, sym, target = r
+            sym = sym.upper()
+            by_symbol.setdefault(sym, []).append(( _id, chat_id, target ))
+
+        for sym, alerts in by_symbol.items():
+            pair = f"{sym}USDT"
+            url = f"https://api.binance.com/api/v3/ticker/24hr?symbol={pair}"
+            d = await fetch_json(url)
+            if not d or 'lastPrice' not in d: 
+                continue
+            last = float(d.get('lastPrice', 0))
+            # peringatan bila last >= target (simple logic)
+            for (_id, chat_id, target) in alerts:
+                try:
+                    if target > 0 and last >= float(target):
+                        text = (f"🚨 <b>Price Alert</b>\n"
+                                f"Pair: <code>{pair}</code>\n"
+                                f"Current: <code>${last:,.6f}</code>\n"
+                                f"Target: <code>${float(target):,.6f}</code>\n"
+                                f"ID Alert: <code>{_id}</code>")
+                        await context.bot.send_message(chat_id, text, parse_mode=ParseMode.HTML)
+                        # hapus alert setelah trigger (opsional)
+                        await db_execute("DELETE FROM crypto_alerts WHERE id=?", (_id,))
+                except:
+                    pass
     except Exception:
         pass
 
@@ -4128,21 +6849,20 @@ async def addprem_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         target_id = int(context.args[0])
 
-        async with aiosqlite.connect(DB_NAME) as db:
-            # Cek apakah sudah premium
-            async with db.execute("SELECT 1 FROM premium_users WHERE user_id = ? LIMIT 1", (target_id,)) as cur:
-                exists = await cur.fetchone()
+        # Cek apakah sudah premium
+        exists = await db_fetch_one("SELECT 1 FROM premium_users WHERE user_id = ? LIMIT 1", (target_id,))
 
-            if exists:
-                await update.message.reply_text(
-                    f"ℹ️ User <code>{target_id}</code> is already <b>PREMIUM</b>.",
-                    parse_mode=ParseMode.HTML
-                )
-                return
+        if exists:
+            await update.message.reply_text(
+                f"ℹ️ User <code>{target_id}</code> is already <b>PREMIUM</b>.",
+                parse_mode=ParseMode.HTML
+            )
+            return
 
-            # Masukkan ke DB
+        # Masukkan ke DB
+        async with db_pool.write() as db:
             await db.execute("INSERT OR IGNORE INTO premium_users (user_id) VALUES (?)", (target_id,))
-            await db.commit()
+        invalidate_premium(target_id)
 
         # Format waktu (pakai TZ jika tersedia)
         try:
@@ -4242,7 +6962,7 @@ async def okta_ai_process(
     }
 
     try:
-        async with httpx.AsyncClient(timeout=120) as client: # Timeout lamaan dikit buat Gemini Thinking
+        async with http_session("ai", timeout=120) as client: # Timeout lamaan dikit buat Gemini Thinking
             resp = await client.post(endpoint, json=payload, headers=headers)
             
         if resp.status_code != 200:
@@ -4277,6 +6997,8 @@ async def okta_ai_process(
         else:
             await bot_msg.edit_text(final_text + footer, parse_mode=ParseMode.HTML)
 
+    except CircuitOpenError as e:
+        await bot_msg.edit_text(f"⏸️ <b>AI Server Busy:</b> {html.escape(str(e))}", parse_mode=ParseMode.HTML)
     except Exception as e:
         await bot_msg.edit_text(f"❌ <b>System Error:</b> {str(e)}")
 
@@ -4905,7 +7627,7 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # PARSE RSS
     # ==========================================
     try:
-        feed = feedparser.parse(rss_url)
+        feed = await run_blocking("io", feedparser.parse, rss_url)
 
         if not feed.entries:
             return await update.message.reply_text(
@@ -5027,7 +7749,7 @@ async def scr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
                 }
                 
-                async with httpx.AsyncClient(timeout=20) as client:
+                async with http_session(timeout=20) as client:
                     r = await client.get(web_url, headers=headers)
                     
                     if "is not accessible" in r.text or "Access Denied" in r.text or r.status_code == 404:
@@ -5077,7 +7799,7 @@ async def scr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
                 }
                 
-                async with httpx.AsyncClient(timeout=20) as client:
+                async with http_session(timeout=20) as client:
                     r = await client.get(web_url, headers=headers)
                     
                     if "is not accessible" in r.text or "Access Denied" in r.text or r.status_code == 404:
@@ -5393,7 +8115,7 @@ async def scr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 web_url = f"https://t.me/s/{username}"
                 headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"}
                 
-                async with httpx.AsyncClient(timeout=20) as client:
+                async with http_session(timeout=20) as client:
                     r = await client.get(web_url, headers=headers)
                     target_text = r.text
             except Exception as e:
@@ -5457,6 +8179,40 @@ async def scr_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+# ==========================================
+# 🎧 SPOTIFY METADATA CACHE
+# ==========================================
+SPOTIFY_SEARCH_LIMIT = 50
+spotify_search_cache = TTLCache(maxsize=2000, ttl=1800, name="spotify-search")
+spotify_track_cache = TTLCache(maxsize=10000, ttl=6 * 3600, name="spotify-track")
+
+def normalize_music_query(query):
+    """'  Dewa 19   KANGEN ' → 'dewa 19 kangen' (key cache search)"""
+    return " ".join(query.lower().split())
+
+async def spotify_search_tracks(query, limit=SPOTIFY_SEARCH_LIMIT):
+    """
+    Hasil search per query ter-normalisasi, di-cache 30 menit: Prev/Next cuma slice dari memori.
+    Track hasil search sekalian mengisi spotify_track_cache (objek track-nya sudah lengkap).
+    """
+    key = (normalize_music_query(query), limit)
+
+    async def load():
+        raw = await run_blocking("io", sp_client.search, q=key[0], limit=limit, type="track")
+        items = [t for t in raw["tracks"]["items"] if t and t.get("id")]
+        for t in items:
+            spotify_track_cache.set(t["id"], t)
+        return items
+
+    return await spotify_search_cache.get_or_load(key, load)
+
+async def spotify_track(track_id):
+    """sp_client.track(id) lewat cache; tap song/lyrics/effect untuk lagu yang sama cuma 1 call"""
+    return await spotify_track_cache.get_or_load(
+        track_id,
+        lambda: run_blocking("io", sp_client.track, track_id),
+    )
+
 # ==========================================
 # 🎵 MUSIC SEARCH ENGINE (SMART FILTER + RECOMMENDATION)
 # ==========================================
@@ -5472,8 +8228,7 @@ async def show_music_search(update, context, query, offset=0):
         max_total = 20 # Maksimal cuma 20 lagu yang ditampilkan (2 Halaman)
 
         # 1. SEARCH LOGIC (Cari agak banyak dulu buat difilter)
-        raw_results = sp_client.search(q=query, limit=50, type='track')
-        raw_tracks = raw_results['tracks']['items']
+        raw_tracks = await spotify_search_tracks(query)
 
         if not raw_tracks:
             msg = "❌ <b>Song not found.</b> Try specific keyword."
@@ -5589,7 +8344,7 @@ async def song_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # 1. AMBIL METADATA SPOTIFY (Wajib buat Caption)
     try:
-        track = sp_client.track(track_id)
+        track = await spotify_track(track_id)
         song_name = track['name']
         artist_name = track['artists'][0]['name']
         album_name = track['album']['name']
@@ -5613,19 +8368,24 @@ async def song_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             [InlineKeyboardButton("❌ Close", callback_data="cmd_close")]
         ]
 
-        # 2. CEK DATABASE (SMART CACHE)
-        cached = await get_cached_media(track_id)
+        # 2. CEK CACHE (LRU → BLOOM → DATABASE)
+        cached = await get_media_cache(track_id)
         
-        if cached:
-            file_id = cached[0] 
-            await context.bot.send_audio(
-                chat_id=q.message.chat_id,
-                audio=file_id,
-                caption=caption,
-                parse_mode=ParseMode.HTML,
-                reply_markup=InlineKeyboardMarkup(kb_effects)
-            )
-            return
+        if cached.get("cached"):
+            file_id = cached["file_id"]
+            try:
+                await context.bot.send_audio(
+                    chat_id=q.message.chat_id,
+                    audio=file_id,
+                    caption=caption,
+                    parse_mode=ParseMode.HTML,
+                    reply_markup=InlineKeyboardMarkup(kb_effects)
+                )
+                return
+            except BadRequest as e:
+                # file_id basi → hapus dari cache, lanjut download baru
+                logger.warning(f"[SONG CACHE] Rejected file_id: {e}")
+                await invalidate_media_cache(track_id)
 
     except Exception as e:
         await context.bot.send_message(chat_id=q.message.chat_id, text=f"⚠️ <b>Metadata Error:</b> {e}", parse_mode=ParseMode.HTML)
@@ -5635,73 +8395,72 @@ async def song_button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     msg = await context.bot.send_message(chat_id=q.message.chat_id, text="⏳ <b>Downloading High Quality Audio...</b>", parse_mode=ParseMode.HTML)
 
     try:
-        search_query = f"{artist_name} - {song_name} audio"
-        temp_dir = f"music_{uuid.uuid4()}"
+        async with scratch_space.job("music", reserve=2 * TELEGRAM_UPLOAD_LIMIT) as temp_dir:
+            search_query = f"{artist_name} - {song_name} audio"
         
-        # --- CONFIG SAKTI DI SINI ---
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{temp_dir}/%(title)s.%(ext)s',
+            # --- CONFIG SAKTI DI SINI ---
+            ydl_opts = {
+                'format': 'bestaudio/best',
+                'outtmpl': f'{temp_dir}/%(title)s.%(ext)s',
             
-            # Konversi ke MP3 192kbps (Standar Bagus)
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
+                # Konversi ke MP3 192kbps (Standar Bagus)
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'mp3',
+                    'preferredquality': '192',
+                }],
             
-            # DOWNLOAD NGEBUT (Multi-thread)
-            'concurrent_fragment_downloads': 5, 
+                # DOWNLOAD NGEBUT (Multi-thread)
+                'concurrent_fragment_downloads': 5, 
             
-            # Anti Blokir (Pura-pura jadi HP Android)
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android_music', 'android', 'ios'],
-                    'player_skip': ['web', 'tv']
-                }
-            },
+                # Anti Blokir (Pura-pura jadi HP Android)
+                'extractor_args': {
+                    'youtube': {
+                        'player_client': ['android_music', 'android', 'ios'],
+                        'player_skip': ['web', 'tv']
+                    }
+                },
             
-            # Proxy & Keamanan
-            'proxy': MY_PROXY,
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'nocheckcertificate': True,
+                # Proxy & Keamanan
+                'proxy': MY_PROXY,
+                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+                'nocheckcertificate': True,
             
-            'quiet': True,
-            'no_warnings': True,
-            'default_search': 'ytsearch1:', 
-            'max_filesize': 50 * 1024 * 1024
-        }
-
-        file_path = None
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.extract_info(search_query, download=True)
-            if os.path.exists(temp_dir):
-                for f in os.listdir(temp_dir):
-                    if f.endswith('.mp3'): file_path = os.path.join(temp_dir, f)
+                'quiet': True,
+                'no_warnings': True,
+                'default_search': 'ytsearch1:', 
+                'max_filesize': 50 * 1024 * 1024
+            }
 
-        if file_path:
-            sent_msg = await context.bot.send_audio(
-                chat_id=q.message.chat_id,
-                audio=open(file_path, 'rb'),
-                title=song_name, performer=artist_name,
-                caption=caption, parse_mode=ParseMode.HTML,
-                thumbnail=requests.get(cover_url).content,
-                reply_markup=InlineKeyboardMarkup(kb_effects)
-            )
+            file_path = None
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                await run_blocking("subprocess", ydl.extract_info, search_query, download=True)
+                if os.path.exists(temp_dir):
+                    for f in os.listdir(temp_dir):
+                        if f.endswith('.mp3'): file_path = os.path.join(temp_dir, f)
+
+            if file_path:
+                async with http_session("media", timeout=20) as client:
+                    thumb = (await client.get(cover_url)).content
+                sent_msg = await context.bot.send_audio(
+                    chat_id=q.message.chat_id,
+                    audio=open(file_path, 'rb'),
+                    title=song_name, performer=artist_name,
+                    caption=caption, parse_mode=ParseMode.HTML,
+                    thumbnail=thumb,
+                    reply_markup=InlineKeyboardMarkup(kb_effects)
+                )
             
-            # Simpan ke Database
-            new_file_id = sent_msg.audio.file_id
-            await save_media_cache(track_id, new_file_id, "audio")
+                # Simpan ke Database
+                new_file_id = sent_msg.audio.file_id
+                await save_media_cache(track_id, new_file_id, "audio")
             
-            os.remove(file_path)
-            if os.path.exists(temp_dir): os.rmdir(temp_dir)
-            await msg.delete()
-        else:
-            await msg.edit_text("❌ <b>Download Failed.</b> Stream restricted.", parse_mode=ParseMode.HTML)
+                await msg.delete()
+            else:
+                await msg.edit_text("❌ <b>Download Failed.</b> Stream restricted.", parse_mode=ParseMode.HTML)
 
     except Exception as e:
         await msg.edit_text(f"❌ <b>System Error:</b> {e}", parse_mode=ParseMode.HTML)
-        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
 
 # ==========================================
 # 📝 LYRICS HANDLER (SMART SEARCH + ENGLISH UI)
@@ -5714,7 +8473,7 @@ async def lyrics_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # 1. Info Lagu (Spotify)
-        track = sp_client.track(track_id)
+        track = await spotify_track(track_id)
         raw_title = track['name']
         raw_artist = track['artists'][0]['name']
         duration = track['duration_ms'] / 1000
@@ -5733,7 +8492,7 @@ async def lyrics_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         lirik_raw = None
         
-        async with httpx.AsyncClient(timeout=20) as client:
+        async with http_session(timeout=20) as client:
             # A. Coba cari spesifik (Paling Akurat)
             params = {"artist_name": raw_artist, "track_name": raw_title, "duration": duration}
             resp = await client.get(url_get, params=params)
@@ -5786,13 +8545,14 @@ async def lyrics_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Pesan Gagal (English)
             await q.message.reply_text(f"❌ <b>Lyrics not found.</b>\nTry checking the song title spelling.", parse_mode=ParseMode.HTML)
 
+    except CircuitOpenError as e:
+        await q.message.reply_text(f"⏸️ <b>Lyrics server busy:</b> {html.escape(str(e))}", parse_mode=ParseMode.HTML)
     except Exception as e:
         await context.bot.send_message(chat_id=q.message.chat_id, text=f"⚠️ <b>System Error:</b> {str(e)}", parse_mode=ParseMode.HTML)
 
 # ==========================================
 # 🎧 REAL AUDIO EFFECT ENGINE (CLEAN SIMPLE)
 # ==========================================
-import subprocess
 
 async def real_effect_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -5806,84 +8566,81 @@ async def real_effect_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     try:
         # 1. Get Info & Download Raw
-        track = sp_client.track(track_id)
+        track = await spotify_track(track_id)
         song_name = track['name']
         artist_name = track['artists'][0]['name']
         
-        search_query = f"{artist_name} - {song_name} audio"
-        temp_dir = f"remix_{uuid.uuid4()}"
-        output_path = f"{temp_dir}/remix_output.mp3"
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'outtmpl': f'{temp_dir}/input.%(ext)s',
-            'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3','preferredquality': '192'}],
-            'quiet': True, 'default_search': 'ytsearch1:',
-            'proxy': MY_PROXY,
-            'extractor_args': {'youtube': {'player_client': ['android', 'ios']}}
-        }
+        async with scratch_space.job("remix", reserve=2 * TELEGRAM_UPLOAD_LIMIT) as temp_dir:
+            search_query = f"{artist_name} - {song_name} audio"
+            output_path = f"{temp_dir}/remix_output.mp3"
+        
+            ydl_opts = {
+                'format': 'bestaudio/best',
+                'outtmpl': f'{temp_dir}/input.%(ext)s',
+                'postprocessors': [{'key': 'FFmpegExtractAudio','preferredcodec': 'mp3','preferredquality': '192'}],
+                'quiet': True, 'default_search': 'ytsearch1:',
+                'proxy': MY_PROXY,
+                'extractor_args': {'youtube': {'player_client': ['android', 'ios']}}
+            }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.extract_info(search_query, download=True)
-            input_path = f"{temp_dir}/input.mp3"
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                await run_blocking("subprocess", ydl.extract_info, search_query, download=True)
+                input_path = f"{temp_dir}/input.mp3"
 
-        if not os.path.exists(input_path):
-            await msg.edit_text("❌ <b>Source Error.</b> Failed to download audio.")
-            return
+            if not os.path.exists(input_path):
+                await msg.edit_text("❌ <b>Source Error.</b> Failed to download audio.")
+                return
 
-        # 2. FFmpeg Processing
-        cmd = []
-        tag_display = ""
-        
-        if effect_type == "eff_8d":
-            tag_display = "8D Audio"
-            filter_cmd = "apulsator=hz=0.125"
-        elif effect_type == "eff_bass":
-            tag_display = "Bass Boosted"
-            filter_cmd = "equalizer=f=60:width_type=h:width=50:g=15"
-        elif effect_type == "eff_slow":
-            tag_display = "Slowed + Reverb"
-            filter_cmd = "atempo=0.85,aecho=0.8:0.9:1000:0.3"
-        elif effect_type == "eff_night":
-            tag_display = "Nightcore"
-            filter_cmd = "asetrate=44100*1.25,atempo=1.0"
-        elif effect_type == "eff_reverb":
-            tag_display = "Reverb"
-            filter_cmd = "aecho=0.8:0.9:1000:0.3"
-        elif effect_type == "eff_speed":
-            tag_display = "Speed Up"
-            filter_cmd = "atempo=1.25"
-
-        cmd = ['ffmpeg', '-i', input_path, '-af', filter_cmd, '-y', output_path]
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        # 3. Send Result (Tampilan Simple Normal)
-        if os.path.exists(output_path):
-            caption = (
-                f"🎧 <b>{html.escape(song_name)}</b>\n"
-                f"👤 {html.escape(artist_name)}\n"
-                f"🎛 <b>Effect:</b> {tag_display}\n\n"
-                f"⚡ <i>Powered by Oktacomel</i>"
-            )
+            # 2. FFmpeg Processing
+            cmd = []
+            tag_display = ""
+        
+            if effect_type == "eff_8d":
+                tag_display = "8D Audio"
+                filter_cmd = "apulsator=hz=0.125"
+            elif effect_type == "eff_bass":
+                tag_display = "Bass Boosted"
+                filter_cmd = "equalizer=f=60:width_type=h:width=50:g=15"
+            elif effect_type == "eff_slow":
+                tag_display = "Slowed + Reverb"
+                filter_cmd = "atempo=0.85,aecho=0.8:0.9:1000:0.3"
+            elif effect_type == "eff_night":
+                tag_display = "Nightcore"
+                filter_cmd = "asetrate=44100*1.25,atempo=1.0"
+            elif effect_type == "eff_reverb":
+                tag_display = "Reverb"
+                filter_cmd = "aecho=0.8:0.9:1000:0.3"
+            elif effect_type == "eff_speed":
+                tag_display = "Speed Up"
+                filter_cmd = "atempo=1.25"
+
+            cmd = ['ffmpeg', '-i', input_path, '-af', filter_cmd, '-y', output_path]
+            await process_runner.run(cmd)
+
+            # 3. Send Result (Tampilan Simple Normal)
+            if os.path.exists(output_path):
+                caption = (
+                    f"🎧 <b>{html.escape(song_name)}</b>\n"
+                    f"👤 {html.escape(artist_name)}\n"
+                    f"🎛 <b>Effect:</b> {tag_display}\n\n"
+                    f"⚡ <i>Powered by Oktacomel</i>"
+                )
             
-            await context.bot.send_audio(
-                chat_id=q.message.chat_id,
-                audio=open(output_path, 'rb'),
-                title=f"{song_name} ({tag_display})",
-                performer=artist_name,
-                caption=caption,
-                parse_mode=ParseMode.HTML,
-                reply_to_message_id=q.message.id
-            )
-            await msg.delete()
-        else:
-            await msg.edit_text("❌ <b>Render Failed.</b>")
-
-        shutil.rmtree(temp_dir)
+                await context.bot.send_audio(
+                    chat_id=q.message.chat_id,
+                    audio=open(output_path, 'rb'),
+                    title=f"{song_name} ({tag_display})",
+                    performer=artist_name,
+                    caption=caption,
+                    parse_mode=ParseMode.HTML,
+                    reply_to_message_id=q.message.id
+                )
+                await msg.delete()
+            else:
+                await msg.edit_text("❌ <b>Render Failed.</b>")
 
     except Exception as e:
         await msg.edit_text(f"❌ <b>Error:</b> {str(e)}", parse_mode=ParseMode.HTML)
-        if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
 
 # ==========================================
 # 📸 GALLERY SCRAPER (BULK DOWNLOADER)
@@ -5908,63 +8665,57 @@ async def gallery_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.HTML
     )
 
-    # Buat folder sementara unik
-    temp_dir = f"gallery_{uuid.uuid4()}"
-    
     try:
-        # 2. Jalankan Gallery-DL via Terminal
-        # --range 1-10 : Ambil 10 gambar pertama saja (Biar gak berat)
-        # --destination : Simpan di folder temp
-        cmd = ["gallery-dl", url, "--destination", temp_dir, "--range", "1-10"]
-        
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        # 3. Cari File Gambar (Recursive)
-        # Gallery-dl sering bikin sub-folder, jadi kita harus cari sampai dalam
-        image_files = []
-        for root, dirs, files in os.walk(temp_dir):
-            for file in files:
-                if file.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
-                    image_files.append(os.path.join(root, file))
-
-        # 4. Kirim sebagai Album (MediaGroup)
-        if image_files:
-            media_group = []
-            total_img = len(image_files)
+        async with scratch_space.job("gallery", reserve=TELEGRAM_UPLOAD_LIMIT) as temp_dir:
+            # 2. Jalankan Gallery-DL via Terminal
+            # --range 1-10 : Ambil 10 gambar pertama saja (Biar gak berat)
+            # --destination : Simpan di folder temp
+            cmd = ["gallery-dl", url, "--destination", temp_dir, "--range", "1-10"]
+        
+            await process_runner.run(cmd)
+
+            # 3. Cari File Gambar (Recursive)
+            # Gallery-dl sering bikin sub-folder, jadi kita harus cari sampai dalam
+            image_files = []
+            for root, dirs, files in os.walk(temp_dir):
+                for file in files:
+                    if file.lower().endswith(('.jpg', '.jpeg', '.png', '.webp')):
+                        image_files.append(os.path.join(root, file))
+
+            # 4. Kirim sebagai Album (MediaGroup)
+            if image_files:
+                media_group = []
+                total_img = len(image_files)
             
-            # Caption cuma di foto pertama
-            caption = (
-                f"📸 <b>GALLERY EXTRACTED</b>\n"
-                f"━━━━━━━━━━━━━━━━━━\n"
-                f"🔗 <b>Source:</b> <a href='{url}'>Original Link</a>\n"
-                f"🖼 <b>Count:</b> {total_img} Images\n"
-                f"━━━━━━━━━━━━━━━━━━\n"
-                f"⚡ <i>Powered by Oktacomel</i>"
-            )
+                # Caption cuma di foto pertama
+                caption = (
+                    f"📸 <b>GALLERY EXTRACTED</b>\n"
+                    f"━━━━━━━━━━━━━━━━━━\n"
+                    f"🔗 <b>Source:</b> <a href='{url}'>Original Link</a>\n"
+                    f"🖼 <b>Count:</b> {total_img} Images\n"
+                    f"━━━━━━━━━━━━━━━━━━\n"
+                    f"⚡ <i>Powered by Oktacomel</i>"
+                )
 
-            for i, img_path in enumerate(image_files):
-                # Batas Telegram MediaGroup cuma 10 foto per pesan
-                if i >= 10: break 
+                for i, img_path in enumerate(image_files):
+                    # Batas Telegram MediaGroup cuma 10 foto per pesan
+                    if i >= 10: break 
                 
-                # Pasang caption di foto ke-0
-                cap = caption if i == 0 else None
+                    # Pasang caption di foto ke-0
+                    cap = caption if i == 0 else None
                 
-                # Masukkan ke grup
-                media_group.append(InputMediaPhoto(open(img_path, 'rb'), caption=cap, parse_mode=ParseMode.HTML))
+                    # Masukkan ke grup
+                    media_group.append(InputMediaPhoto(open(img_path, 'rb'), caption=cap, parse_mode=ParseMode.HTML))
 
-            # Kirim Album
-            await context.bot.send_media_group(chat_id=chat_id, media=media_group)
-            await msg.delete()
+                # Kirim Album
+                await context.bot.send_media_group(chat_id=chat_id, media=media_group)
+                await msg.delete()
             
-        else:
-            await msg.edit_text("❌ <b>No Images Found.</b>\nMake sure the link is public/valid.", parse_mode=ParseMode.HTML)
+            else:
+                await msg.edit_text("❌ <b>No Images Found.</b>\nMake sure the link is public/valid.", parse_mode=ParseMode.HTML)
 
     except Exception as e:
         await msg.edit_text(f"❌ <b>Extraction Error:</b> {str(e)}", parse_mode=ParseMode.HTML)
-        
-    # 5. Bersih-bersih (Wajib biar VPS gak penuh)
-    if os.path.exists(temp_dir):
-        shutil.rmtree(temp_dir)
 
 # ==========================================
 # 🖥️ SYSTEM LOG VIEWER (OWNER ONLY)
@@ -6049,7 +8800,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 1. CEK SPOTIFY
     try:
         if sp_client:
-            sp_client.search(q="test", limit=1, type="track")
+            await run_blocking("io", sp_client.search, q="test", limit=1, type="track")
             spot_status = "🟢 ONLINE"
         else:
             spot_status = "⚪ DISABLED"
@@ -6058,7 +8809,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 2. CEK AI ENGINE
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with http_session(timeout=5) as client:
             resp = await client.get("https://api.emergent.sh/health")
             ai_status = "🟢 ONLINE" if resp.status_code in (200, 401) else "🟠 UNSTABLE"
     except Exception:
@@ -6080,7 +8831,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # 5. CEK MAIL SERVER (Temp Mail Premium)
     try:
-        async with httpx.AsyncClient(timeout=5) as client:
+        async with http_session(timeout=5) as client:
             headers = {"X-API-Key": TEMPMAIL_API_KEY}
             resp = await client.get("https://api.temp-mail.io/v1/domains", headers=headers)
             mail_status = "🟢 ACTIVE" if resp.status_code == 200 else f"🔴 ERROR ({resp.status_code})"
@@ -6093,8 +8844,13 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 7. CEK DATABASE
     db_status = "🟢 CONNECTED" if os.path.exists(DB_NAME) else "🔴 MISSING"
 
+    # 8. CIRCUIT BREAKER UPSTREAM
+    open_breakers = [b for b in circuit_breakers.values() if b.state != "closed"]
+    breaker_status = f"🟠 {len(open_breakers)} OPEN" if open_breakers else "🟢 ALL CLOSED"
+    breaker_lines = "\n".join(html.escape(line) for line in breaker_report()) or "(no traffic yet)"
+
     # === HITUNG OVERALL HEALTH ===
-    statuses = [spot_status, ai_status, mail_status, apify_status, proxy_status, ffmpeg_status, db_status]
+    statuses = [spot_status, ai_status, mail_status, apify_status, proxy_status, ffmpeg_status, db_status, breaker_status]
 
     if any(s.startswith("🔴") for s in statuses):
         overall = "🔴 <b>CRITICAL</b> — Immediate attention required."
@@ -6124,6 +8880,9 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🛡️ Proxy Tunnel   ⇾ <code>{proxy_status}</code>\n"
         f"🎬 FFmpeg Core    ⇾ <code>{ffmpeg_status}</code>\n"
         f"💾 Database       ⇾ <code>{db_status}</code>\n"
+        f"⚡ Breakers       ⇾ <code>{breaker_status}</code>\n\n"
+        "<b>UPSTREAMS</b>\n"
+        f"<code>{breaker_lines}</code>\n"
         "✦────────────────────────✦\n"
         "🧩 <i>Tip:</i> Run <code>/status</code> regularly to monitor bot health.\n"
         "🤖 <i>Diagnostics powered by Oktacomel</i>"
@@ -6208,9 +8967,9 @@ async def tm_dashboard(update, context, new=False, chosen_domain=None):
             # --- MULAI PERBAIKAN: PROTEKSI SERVER DOWN ---
             try:
                 if chosen_domain:
-                    mail_obj = client.create_email(domain=chosen_domain)
+                    mail_obj = await run_blocking("io", client.create_email, domain=chosen_domain)
                 else:
-                    mail_obj = client.create_email(domain_type=DomainType.PREMIUM)
+                    mail_obj = await run_blocking("io", client.create_email, domain_type=DomainType.PREMIUM)
             except Exception as e:
                 # Jika errornya "Expecting value", berarti server TempMail lagi down/sibuk
                 if "Expecting value" in str(e):
@@ -6384,7 +9143,7 @@ async def tm_inbox(update, context, auto=False):
         
         # --- PERBAIKAN DISINI (PROTEKSI SERVER DOWN) ---
         try:
-            msgs = client.list_email_messages(email=email)
+            msgs = await run_blocking("io", client.list_email_messages, email=email)
         except Exception as e:
             # Jika error "Expecting value", berarti API Server lagi batuk/down
             if "Expecting value" in str(e):
@@ -6449,7 +9208,7 @@ async def tm_autorefresh(update, context):
     client = TempMailClient(api_key=TEMPMAIL_API_KEY)
 
     try:
-        msgs = client.list_email_messages(email=email)
+        msgs = await run_blocking("io", client.list_email_messages, email=email)
 
         old = len(cache.get(email, []))
         new = len(msgs)
@@ -6473,7 +9232,7 @@ async def tm_autorefresh(update, context):
 async def tm_read(update, context, msg_id):
     try:
         client = TempMailClient(api_key=TEMPMAIL_API_KEY)
-        m = client.get_message(message_id=msg_id)
+        m = await run_blocking("io", client.get_message, message_id=msg_id)
 
         sender  = html.escape(m.from_addr or "Unknown")
         subject = html.escape(m.subject or "(No Subject)")
@@ -6620,12 +9379,11 @@ async def note_add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await msg.edit_text("<code>[🔄] ENCRYPTING BYTES... ▰▰▰▱▱</code>", parse_mode=ParseMode.HTML)
     
     # 2. Simpan ke DB
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.write() as db:
         await db.execute(
             "INSERT INTO user_notes (user_id, content, date_added) VALUES (?, ?, ?)",
             (user.id, note_content, date_now)
         )
-        await db.commit()
 
     await asyncio.sleep(0.5)
 
@@ -6650,7 +9408,7 @@ async def note_add_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # 2. LIST NOTES (PREMIUM AUDIT LOG)
 # Fungsi Helper untuk Pagination
 async def get_notes_page(user_id, page, per_page=5):
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.read() as db:
         # Hitung total
         async with db.execute("SELECT COUNT(*) FROM user_notes WHERE user_id=?", (user_id,)) as c:
             total = (await c.fetchone())[0]
@@ -6782,9 +9540,8 @@ async def notes_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
         await asyncio.sleep(0.8)
         
         # Hapus DB
-        async with aiosqlite.connect(DB_NAME) as db:
+        async with db_pool.write() as db:
             await db.execute("DELETE FROM user_notes WHERE user_id=?", (user_id,))
-            await db.commit()
             
         final_txt = (
             "<b>♻️ SYSTEM CLEANSED</b>\n"
@@ -6848,15 +9605,18 @@ async def pdf_merge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         file2 = await doc2.get_file()
         await file2.download_to_drive(custom_path=f2)
 
-        # Merge using PyPDF2
-        merger = PdfMerger()
-        merger.append(f1)
-        merger.append(f2)
-
+        # Merge using PyPDF2 (di executor cpu)
         output_path = os.path.join(tmp_dir, "merged.pdf")
-        with open(output_path, "wb") as out_f:
-            merger.write(out_f)
-        merger.close()
+
+        def merge_pdfs():
+            merger = PdfMerger()
+            merger.append(f1)
+            merger.append(f2)
+            with open(output_path, "wb") as out_f:
+                merger.write(out_f)
+            merger.close()
+
+        await run_blocking("cpu", merge_pdfs)
 
         # Send result
         with open(output_path, "rb") as fh:
@@ -6916,22 +9676,26 @@ async def pdf_split_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f = await doc.get_file()
         await f.download_to_drive(custom_path=pdf_path)
 
-        reader = PdfReader(pdf_path)
-        num_pages = len(reader.pages)
-
-        # Create per-page PDFs and add to ZIP
+        # Create per-page PDFs and add to ZIP (di executor cpu)
         zip_path = os.path.join(tmp_dir, "split_pages.zip")
-        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
-            for i in range(num_pages):
-                writer = PdfWriter()
-                writer.add_page(reader.pages[i])
 
-                page_filename = f"page_{i+1}.pdf"
-                page_path = os.path.join(tmp_dir, page_filename)
-                with open(page_path, "wb") as pf:
-                    writer.write(pf)
+        def split_pdf():
+            reader = PdfReader(pdf_path)
+            num_pages = len(reader.pages)
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+                for i in range(num_pages):
+                    writer = PdfWriter()
+                    writer.add_page(reader.pages[i])
+
+                    page_filename = f"page_{i+1}.pdf"
+                    page_path = os.path.join(tmp_dir, page_filename)
+                    with open(page_path, "wb") as pf:
+                        writer.write(pf)
+
+                    zf.write(page_path, arcname=page_filename)
+            return num_pages
 
-                zf.write(page_path, arcname=page_filename)
+        num_pages = await run_blocking("cpu", split_pdf)
 
         with open(zip_path, "rb") as fh:
             await msg.reply_document(
@@ -6996,15 +9760,16 @@ async def pdf_to_text_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         f = await doc.get_file()
         await f.download_to_drive(custom_path=pdf_path)
 
-        reader = PdfReader(pdf_path)
-        all_text = []
-
-        for page in reader.pages:
-            txt = page.extract_text() or ""
-            if txt.strip():
-                all_text.append(txt)
+        def extract_pdf_text():
+            reader = PdfReader(pdf_path)
+            all_text = []
+            for page in reader.pages:
+                txt = page.extract_text() or ""
+                if txt.strip():
+                    all_text.append(txt)
+            return "\n\n".join(all_text).strip()
 
-        full_text = "\n\n".join(all_text).strip()
+        full_text = await run_blocking("cpu", extract_pdf_text)
 
         if not full_text:
             await status.edit_text(
@@ -7113,12 +9878,7 @@ async def pdf_compress_command(update: Update, context: ContextTypes.DEFAULT_TYP
             src_pdf,
         ]
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.DEVNULL,
-            stderr=asyncio.subprocess.DEVNULL,
-        )
-        await proc.communicate()
+        await process_runner.run(cmd)
 
         if not os.path.exists(out_pdf):
             await status.edit_text(
@@ -7246,73 +10006,79 @@ async def imgpdf_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # --- 5. Open images with Pillow, fix orientation & convert to RGB ---
-        pil_images = []
-        for p in image_paths:
-            try:
-                im = Image.open(p)
+        # --- 5-7 jalan di executor cpu (Pillow + PyPDF2 berat buat event loop) ---
+        base_pdf_path = os.path.join(tmp_dir, "output_raw.pdf")
+        final_pdf_path = os.path.join(tmp_dir, "output_final.pdf")
 
-                # Auto-rotate if EXIF orientation exists
+        def build_pdf():
+            # --- 5. Open images with Pillow, fix orientation & convert to RGB ---
+            pil_images = []
+            for p in image_paths:
                 try:
-                    im = ImageOps.exif_transpose(im)
-                except Exception:
-                    pass
+                    im = Image.open(p)
 
-                # Convert all to RGB (required for PDF)
-                if im.mode in ("RGBA", "P"):
-                    im = im.convert("RGB")
+                    # Auto-rotate if EXIF orientation exists
+                    try:
+                        im = ImageOps.exif_transpose(im)
+                    except Exception:
+                        pass
 
-                # Optional: simple auto-resize if extremely large
-                max_dim = 2500
-                if max(im.size) > max_dim:
-                    im.thumbnail((max_dim, max_dim))
+                    # Convert all to RGB (required for PDF)
+                    if im.mode in ("RGBA", "P"):
+                        im = im.convert("RGB")
 
-                pil_images.append(im)
-            except Exception as e:
-                print(f"Image open error: {e}")
+                    # Optional: simple auto-resize if extremely large
+                    max_dim = 2500
+                    if max(im.size) > max_dim:
+                        im.thumbnail((max_dim, max_dim))
 
-        if not pil_images:
-            await status.edit_text(
-                "❌ <b>Failed to process the image.</b>",
-                parse_mode=ParseMode.HTML
-            )
-            return
+                    pil_images.append(im)
+                except Exception as e:
+                    print(f"Image open error: {e}")
 
-        # --- 6. Save to PDF (single or multi-page) ---
-        base_pdf_path = os.path.join(tmp_dir, "output_raw.pdf")
+            if not pil_images:
+                return 0
 
-        first_img = pil_images[0]
-        if len(pil_images) == 1:
-            first_img.save(base_pdf_path, "PDF", resolution=150.0)
-        else:
-            # Multi-page PDF (future-proof if you add album support)
-            first_img.save(
-                base_pdf_path,
-                "PDF",
-                resolution=150.0,
-                save_all=True,
-                append_images=pil_images[1:]
-            )
+            # --- 6. Save to PDF (single or multi-page) ---
+            first_img = pil_images[0]
+            if len(pil_images) == 1:
+                first_img.save(base_pdf_path, "PDF", resolution=150.0)
+            else:
+                # Multi-page PDF (future-proof if you add album support)
+                first_img.save(
+                    base_pdf_path,
+                    "PDF",
+                    resolution=150.0,
+                    save_all=True,
+                    append_images=pil_images[1:]
+                )
 
-        final_pdf_path = os.path.join(tmp_dir, "output_final.pdf")
+            # --- 7. Optional: add password protection (D) ---
+            if password:
+                reader = PdfReader(base_pdf_path)
+                writer = PdfWriter()
+                for page in reader.pages:
+                    writer.add_page(page)
 
-        # --- 7. Optional: add password protection (D) ---
-        if password:
-            reader = PdfReader(base_pdf_path)
-            writer = PdfWriter()
-            for page in reader.pages:
-                writer.add_page(page)
+                writer.encrypt(password)
 
-            writer.encrypt(password)
+                with open(final_pdf_path, "wb") as fw:
+                    writer.write(fw)
+            else:
+                # No password → just use base PDF
+                shutil.copy(base_pdf_path, final_pdf_path)
+            return len(pil_images)
 
-            with open(final_pdf_path, "wb") as fw:
-                writer.write(fw)
-        else:
-            # No password → just use base PDF
-            shutil.copy(base_pdf_path, final_pdf_path)
+        page_count = await run_blocking("cpu", build_pdf)
+        if not page_count:
+            await status.edit_text(
+                "❌ <b>Failed to process the image.</b>",
+                parse_mode=ParseMode.HTML
+            )
+            return
 
         # --- 8. Send result to user ---
-        pages_info = "1 page" if len(pil_images) == 1 else f"{len(pil_images)} pages"
+        pages_info = "1 page" if page_count == 1 else f"{page_count} pages"
         pass_info = "🔓 <b>Unprotected PDF</b>" if not password else "🔐 <b>Password-Protected PDF</b>"
 
         with open(final_pdf_path, "rb") as fh:
@@ -7380,7 +10146,7 @@ class UserInfoCache:
         }
         
         try:
-            async with aiosqlite.connect(DB_NAME) as db:
+            async with db_pool.read() as db:
                 async with db.execute("SELECT 1 FROM subscribers WHERE user_id=?", (user_id,)) as c:
                     db_data["is_sub"] = bool(await c.fetchone())
                 
@@ -7640,7 +10406,6 @@ async def setproxy_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode=ParseMode.HTML,
     )
 
-import subprocess
 import json
 
 # ==========================================
@@ -7680,34 +10445,24 @@ async def animate_loading_speedtest(msg_obj, duration=180):
     except Exception as e:
         logger.warning(f"Animasi error: {e}")
 
-def run_ookla_native():
+async def run_ookla_native():
     """Jalankan Ookla CLI"""
+    if not shutil.which("speedtest"):
+        return {"error": "NOT_INSTALLED"}
     try:
-        check = subprocess.run(
-            ["which", "speedtest"],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        
-        if check.returncode != 0:
-            return {"error": "NOT_INSTALLED"}
-        
-        process = subprocess.run(
+        process = await process_runner.run(
             [
                 "speedtest",
                 "--format=json",
                 "--accept-license",
                 "--accept-gdpr"
             ],
-            capture_output=True,
-            text=True,
             timeout=180,
-            check=False
+            capture_stdout=True,
         )
         
-        if process.returncode != 0:
-            error_msg = process.stderr.strip()
+        if not process.ok:
+            error_msg = process.stderr_tail.strip()
             logger.error(f"Speedtest error: {error_msg}")
             return {"error": f"CLI_ERROR: {error_msg[:100]}"}
         
@@ -7716,7 +10471,7 @@ def run_ookla_native():
         except json.JSONDecodeError:
             return {"error": "JSON_PARSE_ERROR"}
         
-    except subprocess.TimeoutExpired:
+    except ProcessTimeoutError:
         return {"error": "TIMEOUT"}
     except FileNotFoundError:
         return {"error": "NOT_INSTALLED"}
@@ -7754,10 +10509,7 @@ async def speedtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     test_task = None
     
     try:
-        loop = asyncio.get_running_loop()
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-        
-        test_task = loop.run_in_executor(executor, run_ookla_native)
+        test_task = asyncio.create_task(run_ookla_native())
         animation_task = asyncio.create_task(animate_loading_speedtest(status_msg, duration=180))
         
         data = await asyncio.wait_for(test_task, timeout=190)
@@ -7879,7 +10631,7 @@ async def jeni_auto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     attempt_success = False
 
     try:
-        async with httpx.AsyncClient(timeout=30) as client:
+        async with http_session(timeout=30) as client:
             
             for attempt in range(1, max_retries + 1):
                 logs_attempt = f"> Attempt {attempt}/{max_retries}..."
@@ -8274,14 +11026,25 @@ CONFIRM_CARD = 4
 # ==========================================
 
 async def log_transaction(action: str, plan: str, user_id: int, status: str):
-    """Log semua transaksi"""
+    """Log semua transaksi (lewat write-behind sink yang sama dengan user_actions)"""
     try:
-        await db_insert("transaction_logs", {  # ✅ GANTI cursor
+        data = {
             "action": action,
             "plan": plan,
             "user_id": user_id,
-            "status": status
-        })
+            "status": status,
+            # Format sama dengan CURRENT_TIMESTAMP, dicatat saat kejadian bukan saat flush
+            "timestamp": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        if action_sink.running:
+            columns = ", ".join(data.keys())
+            placeholders = ", ".join(["?" for _ in data])
+            action_sink.add(
+                f"INSERT INTO transaction_logs ({columns}) VALUES ({placeholders})",
+                tuple(data.values())
+            )
+        else:
+            await db_insert("transaction_logs", data)
     except Exception as e:
         logger.error(f"Log transaction error: {e}")
 
@@ -9134,7 +11897,7 @@ async def proxy_scrape_command(update: Update, context: ContextTypes.DEFAULT_TYP
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
     }
 
-    async with httpx.AsyncClient(headers=headers, timeout=15, follow_redirects=True) as client:
+    async with http_session(headers=headers, timeout=15, follow_redirects=True) as client:
         # Kita buat list tasks untuk semua URL sekaligus
         tasks = []
         map_url_proto = {} # Mapping untuk tahu URL mana milik protokol apa
@@ -9265,12 +12028,11 @@ async def setsholat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Simpan Database
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.write() as db:
         await db.execute(
             "INSERT OR REPLACE INTO prayer_subs (chat_id, city) VALUES (?, ?)",
             (chat_id, city),
         )
-        await db.commit()
 
     await update.message.reply_text(
         (
@@ -9293,9 +12055,8 @@ async def setsholat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # ==========================================
 async def stopsholat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    async with aiosqlite.connect(DB_NAME) as db:
+    async with db_pool.write() as db:
         await db.execute("DELETE FROM prayer_subs WHERE chat_id=?", (chat_id,))
-        await db.commit()
 
     await update.message.reply_text(
         "🔕 <b>Prayer notifications disabled for this chat.</b>",
@@ -9441,14 +12202,12 @@ async def schedule_prayers_for_user(
 # ==========================================
 async def daily_prayer_scheduler(context: ContextTypes.DEFAULT_TYPE):
     """Dijalankan tiap pagi: refresh jadwal semua user yang terdaftar."""
-    async with aiosqlite.connect(DB_NAME) as db:
-        async with db.execute("SELECT chat_id, city FROM prayer_subs") as cursor:
-            rows = await cursor.fetchall()
-            for chat_id, city in rows:
-                try:
-                    await schedule_prayers_for_user(context, chat_id, city)
-                except Exception as e:
-                    print(f"daily_prayer_scheduler error ({chat_id}, {city}): {e}")
+    rows = await db_fetch_all("SELECT chat_id, city FROM prayer_subs")
+    for chat_id, city in rows:
+        try:
+            await schedule_prayers_for_user(context, chat_id, city)
+        except Exception as e:
+            print(f"daily_prayer_scheduler error ({chat_id}, {city}): {e}")
 
 # ==========================================
 # 🔄 CALLBACK ROUTER (FIXED & SAFE + REGISTER LOCK + PDF MENU)
@@ -9836,6 +12595,29 @@ async def menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
+# ==========================================
+# 🔌 LIFECYCLE HOOKS (STARTUP / SHUTDOWN)
+# ==========================================
+async def on_startup(app: Application):
+    """Dijalankan PTB setelah initialize(), di event loop yang sama dengan bot"""
+    loop_monitor.start()
+    await db_pool.start()
+    action_sink.start()
+    http_clients.start()
+    await load_media_bloom()
+    try:
+        await scratch_space.start()  # bersihkan sisa crash sebelumnya
+    except Exception as e:
+        logger.error(f"[SCRATCH] Startup sweep error: {e}")
+
+async def on_shutdown(app: Application):
+    """Dijalankan PTB saat bot berhenti — tutup resource dengan rapi"""
+    await action_sink.stop()  # drain log dulu sebelum pool ditutup
+    await db_pool.close()
+    await http_clients.close()
+    shutdown_executors()
+    await loop_monitor.stop()
+
 # ==========================================
 # 🚀 MAIN PROGRAM (MESIN UTAMA)
 # ==========================================
@@ -9846,8 +12628,14 @@ def main():
     loop = asyncio.get_event_loop()
     loop.run_until_complete(init_db())
 
-    # 2. Build Bot
-    app = Application.builder().token(TOKEN).build()
+    # 2. Build Bot (pool DB dibuka di on_startup, ditutup di on_shutdown)
+    app = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # ==========================================
     # 🎮 COMMAND HANDLERS
@@ -9908,6 +12696,7 @@ def main():
     app.add_handler(CommandHandler("think", think_command))
     app.add_handler(CommandHandler("gemini", think_command))
     app.add_handler(CommandHandler("img", img_command))
+    app.add_handler(CallbackQueryHandler(img_reroll_handler, pattern=r"^img_reroll\|"))
     app.add_handler(CommandHandler("tts", tts_command))
     app.add_handler(CommandHandler("tr", tr_command))
     app.add_handler(CommandHandler("convert", convert_command))
@@ -9918,7 +12707,8 @@ def main():
     app.add_handler(CommandHandler("berita", news_command))
 
     # --- Downloader ---
-    app.add_handler(CommandHandler("dl", dl_command))
+    app.add_handler(CommandHandler("dl", dl_command, block=False))  # jalan paralel, dibatasi download_scheduler
+    app.add_handler(CallbackQueryHandler(dl_cancel_handler, pattern=r"^dl_cancel\|", block=False))
     app.add_handler(CommandHandler("gl", gallery_command))
     app.add_handler(CommandHandler("gallery", gallery_command))
 
@@ -10029,6 +12819,8 @@ def main():
     # --- Admin Stats Dashboard ---
     app.add_handler(CommandHandler("admin", admin_stats_command))
     app.add_handler(CallbackQueryHandler(admin_stats_command, pattern="^admin_stats$"))
+    app.add_handler(CommandHandler("backfillstats", backfill_stats_command))
+    app.add_handler(CommandHandler("perf", perf_command))
 
     # --- Main Menu Callback (last, catch-all) ---
     app.add_handler(CallbackQueryHandler(menu_callback))
@@ -10051,9 +12843,23 @@ def main():
         try:
             jq.run_repeating(check_price_alerts, interval=60, first=30, name="price_alert_checker")
         except NameError: pass
+
+        try:
+            jq.run_repeating(media_cache_eviction_job, interval=3600, first=300, name="media_cache_eviction")
+        except NameError: pass
+
+        try:
+            jq.run_repeating(scratch_sweep_job, interval=SCRATCH_SWEEP_INTERVAL, first=SCRATCH_SWEEP_INTERVAL, name="scratch_sweeper")
+        except NameError: pass
+
+        try:
+            jq.run_daily(action_retention_job, time=datetime.time(hour=3, minute=30, tzinfo=TZ), name="action_retention")
+        except NameError: pass
     else:
         print("\n❌ WARNING: JobQueue TIDAK AKTIF! (pip install python-telegram-bot[job-queue])\n")
 
+    instrument_handlers(app)  # paling akhir, setelah semua handler terdaftar
+
     print("✅ SYSTEM ONLINE (FULL FEATURES + FACTORY MODE)")
     app.run_polling()
 
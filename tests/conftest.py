@@ -0,0 +1,40 @@
+"""Import duhur.py untuk test: config dummy + DB & bot.log di folder temp"""
+import os
+import sys
+import tempfile
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG_KEYS = (
+    "TOKEN", "OWNER_ID", "WEATHER_API_KEY", "YOU_API_KEY", "DB_NAME",
+    "SPOTIPY_CLIENT_ID", "SPOTIPY_CLIENT_SECRET", "MY_PROXY", "QRIS_IMAGE",
+    "BASE_URL", "BMKG_URL", "ANIME_API", "BIN_API", "TEMPMAIL_API_KEY",
+    "OMYGPT_API_KEY", "OMDB_API_KEY", "FIREBASE_API_KEY",
+)
+
+
+@pytest.fixture(scope="session")
+def duhur():
+    """Modul duhur dengan DB_NAME di folder temp (config.py asli tidak disentuh)"""
+    workdir = tempfile.mkdtemp(prefix="duhur_test_")
+    config = types.ModuleType("config")
+    for key in CONFIG_KEYS:
+        setattr(config, key, "x")
+    config.TOKEN = "0:test"
+    config.OWNER_ID = 0
+    config.MY_PROXY = None
+    config.DB_NAME = os.path.join(workdir, "test.db")
+    sys.modules["config"] = config
+
+    # bot.log ditulis ke cwd saat import
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    try:
+        import duhur as module
+    finally:
+        os.chdir(cwd)
+    return module
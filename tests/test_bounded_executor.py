@@ -0,0 +1,47 @@
+import asyncio
+import threading
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_failures_are_counted_separately(duhur):
+    ex = duhur.BoundedExecutor("t-fail", 2)
+
+    def boom():
+        raise ValueError("boom")
+
+    assert await ex.run(lambda: 1) == 1
+    with pytest.raises(ValueError):
+        await ex.run(boom)
+    await asyncio.sleep(0)  # _finish dijadwalkan lewat call_soon_threadsafe
+
+    stats = ex.stats()
+    assert (stats["completed"], stats["failed"], stats["running"]) == (1, 1, 0)
+    ex.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_slot_held_until_thread_finishes_even_if_caller_cancelled(duhur):
+    ex = duhur.BoundedExecutor("t-cancel", 1)
+    started, release = threading.Event(), threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    task = asyncio.create_task(ex.run(blocker))
+    await asyncio.to_thread(started.wait, 5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # Thread masih jalan: slot belum boleh dipakai kerja lain
+    second = asyncio.create_task(ex.run(lambda: "second"))
+    await asyncio.sleep(0.1)
+    assert not second.done()
+    assert (ex.stats()["running"], ex.stats()["queued"]) == (1, 1)
+
+    release.set()
+    assert await asyncio.wait_for(second, 5) == "second"
+    ex.shutdown()
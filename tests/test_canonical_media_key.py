@@ -0,0 +1,16 @@
+import pytest
+
+
+@pytest.mark.parametrize("url, key", [
+    ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&si=abc&t=10", "youtube:dQw4w9WgXcQ"),
+    ("https://youtube.com/playlist?list=PL1&si=x&utm_source=share", "https://youtube.com/playlist?list=PL1"),
+    ("https://x.com/i/web/?s=20&t=abc", "https://x.com/i/web"),
+    ("https://www.facebook.com/groups/1?ref=share&mibextid=z", "https://facebook.com/groups/1"),
+])
+def test_platform_share_params_are_stripped(duhur, url, key):
+    assert duhur.canonical_media_key(url) == key
+
+
+def test_unknown_host_keeps_s_t_ref(duhur):
+    url = "https://example.com/search?s=cats&t=10&ref=abc&utm_source=x&fbclid=1"
+    assert duhur.canonical_media_key(url) == "https://example.com/search?ref=abc&s=cats&t=10"
@@ -0,0 +1,23 @@
+import asyncio
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_losers_are_cancelled_and_awaited(duhur):
+    cleaned = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            await asyncio.sleep(0.05)  # cleanup async (tutup koneksi dll.)
+            cleaned.append("slow")
+
+    async def fast():
+        return "ok"
+
+    name, result = await duhur.hedged_race([("slow", slow), ("fast", fast)], hedge_delay=0.01)
+
+    assert (name, result) == ("fast", "ok")
+    assert cleaned == ["slow"]  # loser sudah selesai cleanup saat hedged_race return
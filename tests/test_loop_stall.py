@@ -0,0 +1,79 @@
+"""Regression: kerja blocking lewat run_blocking tidak boleh bikin event loop stall"""
+import asyncio
+import io
+import os
+import time
+
+import pytest
+from PIL import Image
+
+WORK_SECONDS = 0.5
+TICK = 0.01
+
+
+class FakeYoutubeDL:
+    """Pengganti yt_dlp.YoutubeDL: extract_info blocking (tunggu network + tulis file)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def extract_info(self, url, download=True):
+        with open(self.path, "wb") as f:
+            for _ in range(25):
+                time.sleep(WORK_SECONDS / 25)
+                f.write(os.urandom(64 * 1024))
+        return {"id": "fake", "webpage_url": url, "filepath": self.path}
+
+
+def pil_work():
+    """Resize + encode JPEG berulang (seperti kompres foto / thumbnail)"""
+    end = time.monotonic() + WORK_SECONDS
+    count = 0
+    while time.monotonic() < end:
+        img = Image.new("RGB", (1920, 1080), (count % 255, 80, 160))
+        img.thumbnail((640, 640))
+        img.save(io.BytesIO(), "JPEG", quality=85)
+        count += 1
+    return count
+
+
+async def max_lag_while(coro):
+    """Jalankan coro sambil ticker ukur keterlambatan loop, return (hasil, lag maks)"""
+    worst = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal worst
+        while not done.is_set():
+            start = time.monotonic()
+            await asyncio.sleep(TICK)
+            worst = max(worst, time.monotonic() - start - TICK)
+
+    task = asyncio.create_task(ticker())
+    try:
+        result = await coro
+    finally:
+        done.set()
+        await task
+    return result, worst
+
+
+@pytest.mark.asyncio
+async def test_blocking_helpers_do_not_stall_loop(duhur, tmp_path):
+    ydl = FakeYoutubeDL(str(tmp_path / "video.mp4"))
+    rows = [(i, 1, "download", "", "2024-01-01T00:00:00") for i in range(20000)]
+
+    (info, frames, _), lag = await max_lag_while(asyncio.gather(
+        duhur.run_blocking("subprocess", ydl.extract_info, "https://example.com/v", download=True),
+        duhur.run_blocking("cpu", pil_work),
+        duhur.run_blocking("cpu", duhur._append_jsonl_gz, str(tmp_path / "a.jsonl.gz"), rows),
+    ))
+
+    assert info["id"] == "fake" and frames > 0
+    assert lag < duhur.LOOP_STALL_THRESHOLD, f"loop lag {lag * 1000:.0f}ms"
+
+
+@pytest.mark.asyncio
+async def test_perf_selftest_passes(duhur):
+    ok, worst = await duhur.loop_stall_selftest(seconds=WORK_SECONDS)
+    assert ok, f"loop lag {worst * 1000:.0f}ms"
@@ -0,0 +1,21 @@
+import time
+
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_evict_drops_only_evicted_keys_from_lru(duhur):
+    await duhur.init_db()
+    stale, hot = "https://example.com/stale", "https://example.com/hot"
+    assert await duhur.save_media_cache(stale, "file-stale", "video")
+    assert await duhur.save_media_cache(hot, "file-hot", "video")
+    await duhur.db_execute(
+        "UPDATE media_cache SET timestamp=?, last_hit=NULL WHERE url=?",
+        (time.time() - 90 * 86400, duhur.canonical_media_key(stale)),
+    )
+
+    assert await duhur.evict_media_cache(max_rows=1000, max_idle_days=30) == 1
+
+    assert duhur.media_lru.lookup(duhur.canonical_media_key(stale))[0] is False
+    hit, value = duhur.media_lru.lookup(duhur.canonical_media_key(hot))
+    assert hit and value["file_id"] == "file-hot"
@@ -0,0 +1,12 @@
+def test_unknown_sizes_pick_highest_native_height(duhur):
+    info = {
+        "duration": 60,
+        "formats": [
+            {"format_id": "low", "ext": "mp4", "height": 360, "vcodec": "avc1.42001E", "acodec": "mp4a.40.2"},
+            {"format_id": "high", "ext": "mp4", "height": 720, "vcodec": "avc1.64001F", "acodec": "mp4a.40.2"},
+            {"format_id": "vp9", "ext": "webm", "height": 1080, "vcodec": "vp9", "acodec": "opus"},
+        ],
+    }
+    plan = duhur.plan_download_format(info)
+    assert plan["format"] == "high"
+    assert plan["size"] is None
@@ -0,0 +1,43 @@
+import asyncio
+import contextlib
+
+import aiosqlite
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_stop_during_flush_persists_every_row(duhur, monkeypatch):
+    await duhur.db_execute("CREATE TABLE IF NOT EXISTS wb_rows (n INTEGER)")
+    query = "INSERT INTO wb_rows (n) VALUES (?)"
+
+    in_flush = asyncio.Event()
+    original_write = duhur.db_pool.write
+
+    @contextlib.asynccontextmanager
+    async def slow_write():
+        async with original_write() as db:
+            yield db
+            # Batch sudah keluar dari _pending, commit belum: titik paling rawan
+            in_flush.set()
+            await asyncio.sleep(0.2)
+
+    monkeypatch.setattr(duhur.db_pool, "write", slow_write)
+
+    sink = duhur.WriteBehindBuffer(max_batch=10, max_age=60)
+    sink.start()
+    for n in range(10):
+        sink.add(query, (n,))
+    await asyncio.wait_for(in_flush.wait(), timeout=5)
+
+    # Baris yang masuk selama flush juga harus ikut ter-drain
+    for n in range(10, 15):
+        sink.add(query, (n,))
+    await sink.stop()
+
+    async with aiosqlite.connect(duhur.DB_NAME) as db:
+        async with db.execute("SELECT n FROM wb_rows ORDER BY n") as cur:
+            rows = [n for (n,) in await cur.fetchall()]
+    assert rows == list(range(15))
+    assert sink.flushed == 15
+    assert sink.dropped == 0
+    assert not sink.running